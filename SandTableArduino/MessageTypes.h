@@ -17,13 +17,18 @@ enum class MessageType: uint8_t {
     failedRec = 0x70, //j
     getRBuffSize = 0x71,
     sendRBuffSize = 0x72,
-    bufferFull = 0x73
+    bufferFull = 0x73,
+    positions = 0x74,
+    positionsRec = 0x75,
+    getFrameStatus = 0x76,
+    sendFrameStatus = 0x77
 };
 
 enum class SerialState: uint8_t {
     readHeader,
     readMsg,
     readPosition,
+    readPositions,
     readSpeed,
     returnMsg
 };
\ No newline at end of file
@@ -11,7 +11,9 @@ SerialCOM::SerialCOM(){
 void SerialCOM::readSerialInput() {
     this->available = Serial.available();
 
-    if (this->available == 0) {
+    // a frame of positions also has to time out without input
+    if (this->available == 0 &&
+        this->curState != SerialState::readPositions) {
         return;
     }
     uint8_t incoming = 0;
@@ -26,6 +28,9 @@ void SerialCOM::readSerialInput() {
         case SerialState::readPosition:
             this->readPosition();
             break;
+        case SerialState::readPositions:
+            this->readPositions();
+            break;
         case SerialState::readSpeed:
             this->readSpeed();
             break;
@@ -66,12 +71,26 @@ void SerialCOM::readMsgLogic() {
             this->lastMsg = static_cast<MessageType>(received);
             this->curState = SerialState::readSpeed;
             break;
+        case MessageType::positions:
+            this->lastMsg = static_cast<MessageType>(received);
+            this->curState = SerialState::readPositions;
+            this->posAvailable = Serial.available();
+            this->posTime = millis();
+            break;
         case MessageType::getRBuffSize:
             this->lastMsg = static_cast<MessageType>(received);
             this->curState = SerialState::readHeader;
             this->writeBuff[3] = this->rBuff.getSize();
             this->sendMsgResponse(MessageType::sendRBuffSize, 4);
             break;
+        case MessageType::getFrameStatus:
+            this->lastMsg = static_cast<MessageType>(received);
+            this->curState = SerialState::readHeader;
+            this->writeBuff[3] = this->lastSeq;
+            this->writeBuff[4] = this->lastAccepted;
+            this->writeBuff[5] = this->rBuff.getSize();
+            this->sendMsgResponse(MessageType::sendFrameStatus, 6);
+            break;
         case MessageType::start:
         case MessageType::stop:
         case MessageType::clear:
@@ -118,13 +137,8 @@ void SerialCOM::readPosition() {
         return;
     }
 
-    int numBytes = Serial.readBytes(rec, 4);
-    this->posR = ((long)rec[0] << 24) | ((long)rec[1] << 16) 
-                | ((long)rec[2] <<8) | (long)rec[3];
-
-    numBytes = Serial.readBytes(rec, 4);
-    this->posPhi = ((long)rec[0] << 24) | ((long)rec[1] << 16) 
-                | ((long)rec[2] <<8) | (long)rec[3];
+    this->posR = this->readLong();
+    this->posPhi = this->readLong();
 
     this->rBuff.addItem(this->posR, this->posPhi);
 
@@ -133,6 +147,100 @@ void SerialCOM::readPosition() {
 }
 
 
+/*Read a frame of multiple positions. The first byte is the id of the
+frame and the second the number of positions, followed by r and phi of each
+position. The positions are read as they arrive, so the frame can be bigger
+than the serial input buffer, and are moved to the rolling buffer once the
+frame is complete. Positions that don't fit into the rolling buffer are
+dropped together with all following positions to keep the order.
+The response echoes the id and reports how many positions were accepted and
+the new buffer size. The id and the accepted positions are kept, so the
+host can ask with getFrameStatus whether a frame whose response got lost
+was received. A frame whose bytes stop arriving for POS_TIMEOUT is aborted,
+otherwise the following messages would be read as positions.*/
+void SerialCOM::readPositions() {
+    if (this->available != this->posAvailable) {
+        this->posTime = millis();
+    } else if (millis() - this->posTime > POS_TIMEOUT) {
+        this->abortPositions();
+        return;
+    }
+
+    if (this->posLeft < 0) {
+        if (Serial.available() < 2) {
+            this->posAvailable = Serial.available();
+            return;
+        }
+        this->posSeq = Serial.read();
+        this->posLeft = Serial.read();
+        this->frameBuff.clear();
+    }
+
+    while (this->posLeft > 0 && Serial.available() >= 8) {
+        this->posR = this->readLong();
+        this->posPhi = this->readLong();
+        this->posLeft--;
+
+        if (!this->frameBuff.isFull()) {
+            this->frameBuff.addItem(this->posR, this->posPhi);
+        }
+    }
+
+    this->posAvailable = Serial.available();
+    if (this->posLeft > 0) {
+        return;
+    }
+
+    this->posAccepted = 0;
+    while (!this->frameBuff.isEmpty() && !this->rBuff.isFull()) {
+        this->frameBuff.getItem(this->posR, this->posPhi);
+        this->rBuff.addItem(this->posR, this->posPhi);
+        this->posAccepted++;
+    }
+
+    this->lastSeq = this->posSeq;
+    this->lastAccepted = this->posAccepted;
+    this->writeBuff[3] = this->posSeq;
+    this->writeBuff[4] = this->posAccepted;
+    this->writeBuff[5] = this->rBuff.getSize();
+    this->sendMsgResponse(MessageType::positionsRec, 6);
+    this->posLeft = -1;
+    this->curState = SerialState::readHeader;
+}
+
+
+/*Abort a frame that stopped arriving. None of its positions are accepted,
+so the host sends them again. Without the id of the frame the host is
+told that the message failed.*/
+void SerialCOM::abortPositions() {
+    this->frameBuff.clear();
+
+    if (this->posLeft < 0) {
+        this->sendMsgResponse(MessageType::failedRec);
+    } else {
+        this->lastSeq = this->posSeq;
+        this->lastAccepted = 0;
+        this->writeBuff[3] = this->posSeq;
+        this->writeBuff[4] = 0;
+        this->writeBuff[5] = this->rBuff.getSize();
+        this->sendMsgResponse(MessageType::positionsRec, 6);
+    }
+
+    this->posLeft = -1;
+    this->curState = SerialState::readHeader;
+}
+
+
+/*Read a big endian int32 from the serial input.*/
+long SerialCOM::readLong() {
+    uint8_t rec[4];
+    Serial.readBytes(rec, 4);
+
+    return ((long)rec[0] << 24) | ((long)rec[1] << 16) 
+            | ((long)rec[2] <<8) | (long)rec[3];
+}
+
+
 bool SerialCOM::getPosition(long& r, long& phi) {
     if (this->rBuff.isEmpty()) {
         return false;
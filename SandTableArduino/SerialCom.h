@@ -4,6 +4,8 @@
 
 constexpr uint8_t RBUFF_SIZE = 10;
 constexpr uint8_t WRITE_BUFF_SIZE = 11;
+// ms without new bytes after which a frame of positions is aborted
+constexpr unsigned long POS_TIMEOUT = 100;
 
 struct RollingBuffer {
     long bufferR[RBUFF_SIZE];
@@ -59,12 +61,23 @@ class SerialCOM {
 
     private:
         RollingBuffer rBuff;
+        // positions of the current frame until it is complete
+        RollingBuffer frameBuff;
         uint8_t header[2];
         uint8_t writeBuff[WRITE_BUFF_SIZE];
         uint8_t available;
         float speed = 1000;
         long posR;
         long posPhi;
+        int16_t posLeft = -1;
+        uint8_t posSeq = 0;
+        uint8_t posAccepted = 0;
+        // input bytes and time when the frame last made progress
+        uint8_t posAvailable = 0;
+        unsigned long posTime = 0;
+        // id and accepted positions of the last complete frame
+        uint8_t lastSeq = 0;
+        uint8_t lastAccepted = 0;
         MessageType lastMsg;
         SerialState curState;
 
@@ -73,4 +86,7 @@ class SerialCOM {
         void sendMsgResponse(MessageType msg, uint8_t buffSize= 3);
         void readSpeed();
         void readPosition();
+        void readPositions();
+        void abortPositions();
+        long readLong();
 };
@@ -0,0 +1,256 @@
+"""
+Benchmarks for svg parsing, path compiling and the serial link. The serial
+link is measured against the VirtualTable, so no sand table is needed.
+
+python benchmark.py -o bench.json
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+import stlib as st
+
+
+EPS_VALUES = [None, 0.5, 1, 2, 5]
+SPIRAL = {"r0": 0, "r1": 200, "num_revolutions": 20}
+# the motors of the virtual table move fast enough to never be the limit
+TABLE_URL = "sandtable://?time_scale=1e6"
+
+
+def _timeit(func, repeat: int):
+    """
+    Best time of several runs and the peak memory of the first run.
+
+    :return: tuple of (result, best time in s, peak memory in bytes)
+    """
+    tracemalloc.start()
+    ret = func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t)
+
+    return ret, min(times), peak
+
+
+def bench_patterns(files: list[str], repeat: int) -> list[dict]:
+    results = []
+
+    for fname in files:
+        pts, t_parse, mem_parse = _timeit(
+            lambda: st.get_pts_from_svg(fname), repeat)
+        item = {
+            "pattern": fname,
+            "parse_s": t_parse,
+            "parse_peak_bytes": mem_parse,
+            "input_points": int(len(pts)),
+            "compile": [],
+        }
+
+        if len(pts) < 2:
+            results.append(item)
+            continue
+
+        for eps in EPS_VALUES:
+            pm, t_comp, mem_comp = _timeit(
+                lambda: st.PathMaker(pts, eps=eps), repeat)
+            item["compile"].append({
+                "eps": eps,
+                "compile_s": t_comp,
+                "compile_peak_bytes": mem_comp,
+                "points": int(pm.positions.shape[0]),
+            })
+
+        results.append(item)
+
+    pm, t_comp, mem_comp = _timeit(
+        lambda: st.SpiralAboutCenter(**SPIRAL), repeat)
+    results.append({
+        "pattern": "SpiralAboutCenter",
+        "params": SPIRAL,
+        "compile": [{
+            "eps": None,
+            "compile_s": t_comp,
+            "compile_peak_bytes": mem_comp,
+            "points": int(pm.positions.shape[0]),
+        }],
+    })
+
+    return results
+
+
+def bench_ack_rtt(com: st.SerialCOM, num: int, timeout: float) -> dict:
+    """
+    Round trip time of a buffer size query, the smallest request/response.
+    The queries are sent by the loop of the SerialCOM, which owns the port,
+    and the round trip is taken from its ack_rtt histogram. Queries that
+    timed out are skipped.
+    """
+    hist = com.metrics.ack_rtt
+    timeouts = com.metrics.timeouts
+    rtt = []
+
+    for _ in range(num):
+        count, total, failed = hist.count, hist.sum, timeouts.value
+        com.query_buffsize()
+
+        t_end = time.monotonic() + timeout
+        while hist.count == count and timeouts.value == failed and \
+                time.monotonic() < t_end:
+            time.sleep(0.0001)
+        if hist.count == count + 1:
+            rtt.append(hist.sum - total)
+
+    if not rtt:
+        return {"samples": 0}
+
+    rtt.sort()
+    return {
+        "samples": len(rtt),
+        "failed": num - len(rtt),
+        "mean_s": statistics.fmean(rtt),
+        "p50_s": rtt[len(rtt)//2],
+        "p99_s": rtt[min(len(rtt) - 1, int(len(rtt)*0.99))],
+        "max_s": rtt[-1],
+    }
+
+
+def _wait_done(table: st.VirtualTable, num: int, timeout: float) -> None:
+    t_end = time.monotonic() + timeout
+    while table.done < num and time.monotonic() < t_end:
+        time.sleep(0.001)
+
+
+def bench_serial(pm: st.PathMaker, url: str, timeout: float,
+                 packets: bool = False) -> dict:
+    """
+    :param packets: send the encoded path with send_packets instead of
+        every point with send_pos
+    """
+    com = st.SerialCOM(url)
+    # the port is opened by the loop, the round trips are measured while
+    # it has nothing to send
+    com.begin_com()
+    com.wait_ready(timeout)
+    table = com._serial.table
+    rtt = bench_ack_rtt(com, 200, timeout)
+    com.start()
+
+    t = time.perf_counter()
+    if packets:
+        com.send_packets(pm.encode())
+    else:
+        for val in pm:
+            com.send_pos(val)
+    _wait_done(table, pm.positions.shape[0], timeout)
+    elapsed = time.perf_counter() - t
+
+    com.stop_com()
+
+    return {
+        "transport": "SerialCOM packets" if packets else "SerialCOM",
+        "points": table.done,
+        "elapsed_s": elapsed,
+        "points_per_s": table.done/elapsed,
+        "ack_rtt": rtt,
+    }
+
+
+def bench_async_serial(pm: st.PathMaker, url: str, timeout: float) -> dict:
+    async def run():
+        com = st.AsyncSerialCOM(url)
+        await com.begin_com()
+        await com.wait_ready(timeout)
+        await com.start()
+        table = com._serial.table
+
+        t = time.perf_counter()
+        for val in pm:
+            await com.send_pos(val)
+        t_end = time.monotonic() + timeout
+        while table.done < pm.positions.shape[0] and \
+                time.monotonic() < t_end:
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - t
+
+        await com.stop_com()
+
+        return {
+            "transport": "AsyncSerialCOM",
+            "points": table.done,
+            "elapsed_s": elapsed,
+            "points_per_s": table.done/elapsed,
+        }
+
+    return asyncio.run(run())
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("-o", "--output", help="write results to json file")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="number of timed runs per measurement")
+    parser.add_argument("--eps", type=float, default=1,
+                        help="eps of the pattern streamed over serial")
+    parser.add_argument("--url", default=TABLE_URL,
+                        help="serial port or sandtable:// url")
+    parser.add_argument("--timeout", type=float, default=120,
+                        help="max time in s to stream one pattern")
+    parser.add_argument("--no-serial", action="store_true",
+                        help="skip the serial benchmarks")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    files = sorted(glob.glob(os.path.join(root, "data", "*", "source.svg")) +
+                   glob.glob(os.path.join(root, "web", "static", "images",
+                                          "*", "source.svg")))
+
+    results = {
+        "commit": _git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "patterns": bench_patterns(files, args.repeat),
+        "serial": [],
+    }
+
+    if not args.no_serial:
+        # the pattern with the most points is the worst case for the link
+        pts = max((st.get_pts_from_svg(f) for f in files), key=len)
+        benches = (bench_serial,
+                   lambda *a: bench_serial(*a, packets=True),
+                   bench_async_serial)
+        for bench in benches:
+            pm = st.PathMaker(pts, eps=args.eps)
+            results["serial"].append(bench(pm, args.url, args.timeout))
+
+    out = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Replay the serial traffic captured by SerialCOM against the VirtualTable or
+another port and report the throughput, ack latencies and stalls of the
+capture and of the replay. The msgs are written with their original
+timing divided by --speed, so a slowdown of a real table can be reproduced
+and protocol changes can be compared offline.
+
+python replay.py capture.bin --speed 10 -o report.json
+"""
+import argparse
+import json
+import time
+from typing import Iterable, Iterator
+import numpy as np
+import serial
+
+import stlib as st
+from stlib.capture import CaptureKind, CaptureRecord, CaptureSerial
+from stlib.serial_com import RESPONSE_DATA_SIZE, MsgType
+
+
+def _msg_name(msg: bytes) -> str:
+    try:
+        return MsgType(msg).name
+    except ValueError:
+        return msg.hex()
+
+
+def exchanges(records: Iterable[CaptureRecord]) -> Iterator[dict]:
+    """
+    Pair every msg written by the host with the response read after it.
+    The protocol is request and response, so the first complete response
+    belongs to the last msg, a msg without one timed out.
+
+    :param records: records of a session, see read_capture
+
+    :return: generator of dicts with the time, the msg type, the number of
+        positions and the response type, its data and the latency, which
+        are None if the msg timed out
+    """
+    header = st.SerialCOM.HEADER
+    rx = bytearray()
+    pending = None
+
+    for rec in records:
+        if rec["kind"] == CaptureKind.open:
+            # the port was opened again, the old bytes are gone
+            rx.clear()
+
+        elif rec["kind"] == CaptureKind.write:
+            if pending is not None:
+                yield pending
+
+            data = bytes(rec["data"])
+            pending = None
+            if data[:2] == header and len(data) > 2:
+                msg = data[2:3]
+                is_frame = msg == MsgType.positions.value and len(data) > 4
+                seq, num = data[3:5] if is_frame else (None, 0)
+                pending = {"time": rec["time"], "msg": msg, "seq": seq,
+                           "num": num,
+                           "response": None, "data": None, "latency": None}
+
+        else:
+            rx += rec["data"]
+            while True:
+                start = rx.find(header)
+                if start < 0 or len(rx) < start + 3:
+                    break
+                msg = bytes(rx[start+2:start+3])
+                end = start + 3 + RESPONSE_DATA_SIZE.get(msg, 0)
+                if len(rx) < end:
+                    break
+
+                if pending is not None:
+                    pending |= {"response": msg,
+                                "data": bytes(rx[start+3:end]),
+                                "latency": rec["time"] - pending["time"]}
+                    yield pending
+                    pending = None
+                del rx[:end]
+
+    if pending is not None:
+        yield pending
+
+
+def _distribution(values: list[float]) -> dict:
+    if not values:
+        return {"samples": 0}
+
+    a = np.asarray(values)
+    p50, p90, p99 = np.percentile(a, [50, 90, 99])
+
+    return {"samples": int(a.size), "mean_s": float(a.mean()),
+            "p50_s": float(p50), "p90_s": float(p90), "p99_s": float(p99),
+            "max_s": float(a.max())}
+
+
+def summarize(records: Iterable[CaptureRecord], stall_time: float = 0.5,
+              max_stalls: int = 10) -> dict:
+    """
+    Throughput, ack latencies and stalls of a session.
+
+    A buffer full burst is a run of exchanges in which the sand table
+    didn't take all positions of a frame or reported a full buffer, until
+    the next frame is fully accepted. A stall is a gap of more than
+    stall_time between two accepted frames.
+
+    :param records: records of the session, see read_capture
+    :param stall_time: min gap in s that counts as a stall
+    :param max_stalls: number of the longest stalls that are listed
+
+    :return: dict with the report
+    """
+    latencies: dict[str, list[float]] = {}
+    msgs: dict[str, int] = {}
+    sent = accepted = timeouts = 0
+    full = bursts = burst = longest_burst = 0
+    accept_times = []
+    first = last = None
+    # last frame that was sent
+    frame = None
+
+    for ex in exchanges(records):
+        name = _msg_name(ex["msg"])
+        msgs[name] = msgs.get(name, 0) + 1
+        if first is None:
+            first = ex["time"]
+        last = ex["time"] + (ex["latency"] or 0)
+        if ex["msg"] == MsgType.positions.value:
+            frame = ex
+
+        if ex["response"] is None:
+            timeouts += 1
+            continue
+        latencies.setdefault(name, []).append(ex["latency"])
+
+        is_full = ex["response"] == MsgType.bufferFull.value
+        if ex["msg"] == MsgType.positions.value:
+            sent += ex["num"]
+            if ex["response"] == MsgType.positionsRec.value:
+                num = ex["data"][1]
+                accepted += num
+                is_full |= num < ex["num"]
+                if num:
+                    accept_times.append(last)
+        elif ex["response"] == MsgType.sendFrameStatus.value:
+            # the frame whose response got lost was received after all
+            if frame is not None and ex["data"][0] == frame["seq"]:
+                accepted += ex["data"][1]
+                if ex["data"][1]:
+                    accept_times.append(last)
+        elif ex["response"] == MsgType.sendRBuffSize.value:
+            is_full |= ex["data"][0] >= st.SerialCOM.MAX_FRAME_POSITIONS
+
+        if is_full:
+            full += 1
+            burst += 1
+            bursts += burst == 1
+            longest_burst = max(longest_burst, burst)
+        elif ex["msg"] == MsgType.positions.value:
+            burst = 0
+
+    gaps = np.diff(accept_times)
+    idx = np.flatnonzero(gaps > stall_time)
+    longest = idx[np.argsort(gaps[idx])[::-1][:max_stalls]]
+    duration = 0 if first is None else last - first
+
+    return {
+        "duration_s": duration,
+        "msgs": msgs,
+        "positions_sent": sent,
+        "positions_accepted": accepted,
+        "points_per_s": accepted/duration if duration else 0,
+        "timeouts": timeouts,
+        "ack_latency": _distribution(sum(latencies.values(), [])),
+        "ack_latency_by_msg": {name: _distribution(values)
+                               for name, values in latencies.items()},
+        "buffer_full": {"exchanges": full, "bursts": bursts,
+                        "longest_burst": longest_burst},
+        "stalls": {"count": int(idx.size),
+                   "total_s": float(gaps[idx].sum()),
+                   "longest": [{"at_s": accept_times[i] - first,
+                                "duration_s": float(gaps[i])}
+                               for i in longest.tolist()]},
+    }
+
+
+def replay(records: Iterable[CaptureRecord], url: str, speed: float = 1,
+           timeout: float = st.SerialCOM.READ_TIMEOUT
+           ) -> list[CaptureRecord]:
+    """
+    Write the captured msgs to a port and read the response of each like
+    SerialCOM does. The msgs are written as captured, they don't depend
+    on the responses of the replay.
+
+    :param records: records of the session, see read_capture
+    :param url: serial port or sandtable:// url to replay against
+    :param speed: how much faster than captured the msgs are written, 0
+        writes them as fast as the port responds
+    :param timeout: max time in s to wait for a response
+
+    :return: records of the replay
+    """
+    out = []
+
+    def record(kind: CaptureKind, data: bytes) -> None:
+        out.append(CaptureRecord(time=time.monotonic(), kind=kind,
+                                 data=bytes(data)))
+
+    port = CaptureSerial(serial.serial_for_url(
+        url, baudrate=st.SerialCOM.BAUDRATE, timeout=timeout), record)
+    record(CaptureKind.open, url.encode())
+
+    start = t0 = None
+    try:
+        for rec in records:
+            if rec["kind"] != CaptureKind.write:
+                continue
+
+            if start is None:
+                start, t0 = time.monotonic(), rec["time"]
+            elif speed > 0:
+                delay = start + (rec["time"] - t0)/speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            port.write(rec["data"])
+            if port.read_until(st.SerialCOM.HEADER, size=2):
+                msg = port.read(1)
+                if RESPONSE_DATA_SIZE.get(msg, 0):
+                    port.read(RESPONSE_DATA_SIZE[msg])
+    finally:
+        port.close()
+
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("capture", help="file written by SerialCOM capture")
+    parser.add_argument("-o", "--output", help="write report to json file")
+    parser.add_argument("--url", help="serial port or sandtable:// url to "
+                        "replay against, by default a VirtualTable whose "
+                        "motors are sped up like the msgs")
+    parser.add_argument("--speed", type=float, default=1,
+                        help="speed up of the replay, 0 for no waiting")
+    parser.add_argument("--timeout", type=float,
+                        default=st.SerialCOM.READ_TIMEOUT,
+                        help="max time in s to wait for a response")
+    parser.add_argument("--stall-time", type=float, default=0.5,
+                        help="min gap in s between accepted frames that "
+                        "counts as a stall")
+    parser.add_argument("--no-replay", action="store_true",
+                        help="only report the capture")
+    args = parser.parse_args()
+
+    records = list(st.read_capture(args.capture))
+    results = {
+        "capture": args.capture,
+        "records": len(records),
+        "original": summarize(records, args.stall_time),
+    }
+
+    if not args.no_replay:
+        url = args.url or f"sandtable://?time_scale={args.speed or 1e6}"
+        replayed = replay(records, url, args.speed, args.timeout)
+        results["replay"] = {"url": url, "speed": args.speed,
+                             **summarize(replayed, args.stall_time)}
+
+    out = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    main()
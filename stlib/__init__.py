@@ -1,4 +1,20 @@
-from stlib.path_maker import PathMaker, SpiralAboutCenter
+from stlib.path_maker import PathMaker, SpiralAboutCenter, TransitionSpiral
+from stlib.parametric import ParametricPath, Rose, Spirograph, Lissajous, \
+    StarSpiral, ModulatedSpiral
 from stlib.load_svg import get_pts_from_svg
+from stlib.path_order import order_polylines
 from stlib.serial_com import SerialCOM
-from stlib.worker import Worker
\ No newline at end of file
+from stlib.path_cache import PathCache
+from stlib.metrics import REGISTRY, Registry
+from stlib.worker import Worker
+from stlib.async_serial_com import AsyncSerialCOM
+from stlib.async_worker import AsyncWorker
+from stlib.virtual_table import VirtualTable, VirtualSerial
+from stlib.speed_plan import plan_speeds, planned_time, SpeedPlanner, \
+    RIM_SPEED
+from stlib.streaming import StreamingPath
+from stlib.engines import ENGINES, compile_path
+from stlib.journal import Journal
+from stlib.playlist import Playlist, Compiler
+from stlib.tables import TableRegistry, Table
+from stlib.capture import CaptureWriter, read_capture
@@ -0,0 +1,442 @@
+import asyncio
+import concurrent.futures
+import logging
+import time
+import serial
+
+from .capture import CaptureKind, CaptureSerial
+from .metrics import Registry
+from .serial_com import MsgType, RESPONSE_DATA_SIZE, SandTableProtocol, \
+    SendPacket, SerialCOM, encode_pos
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSerialCOM(SandTableProtocol):
+    """
+    asyncio version of SerialCOM. Received bytes are pushed into an
+    asyncio.StreamReader as soon as they arrive, so every ack immediately
+    wakes up the task that sends the next frame instead of waiting for the
+    next loop iteration.
+
+    On POSIX systems the serial port is watched with loop.add_reader. Ports
+    without a file descriptor (Windows COM ports, sandtable:// urls) are
+    read by a single background thread that blocks in read.
+
+    The serial port is opened in the background by begin_com and opened
+    again when the connection is lost, see SerialCOM.
+
+    The queued msgs are sent before the next positions frame and a clear
+    drops the queued positions, see SerialCOM. The protocol itself is
+    implemented by SandTableProtocol, this class only does the reads,
+    writes and waits.
+
+    All methods must be called from the event loop that called begin_com.
+
+    :param COM: serial port or url, see SerialCOM
+    :param registry: where to register the metrics
+    :param capture: file to log the serial traffic to, see SerialCOM
+    """
+
+    READER_TIMEOUT = 0.1 # s the reader thread checks if it should stop
+
+    def __init__(self, COM: str, registry: Registry | None = None,
+                 capture: str | None = None):
+        # set while the sand table answers, see _connect_loop
+        self._connected = asyncio.Event()
+        # set when a clear is confirmed, see wait_cleared
+        self._cleared = asyncio.Event()
+        super().__init__(COM, asyncio.Queue(25), asyncio.Queue(25),
+                         registry, capture)
+        self._is_running = False
+        self._lost = asyncio.Event()
+
+
+    async def begin_com(self) -> None:
+        """
+        Start the tasks that connect to the sand table and send the queued
+        msgs. It returns right away, the port is opened in the background
+        and the msgs wait in the queues until the sand table answered, see
+        wait_ready. A lost connection is opened again.
+        """
+        if self._is_running:
+            logger.warning("The loop is already started")
+            return
+
+        if self.capture is not None:
+            self.capture.start()
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        # only one request and response at a time
+        self._lock = asyncio.Lock()
+        self._reader = asyncio.StreamReader()
+        self._read_task = None
+        self._fd = None
+
+        self._is_running = True
+        self._tasks = [asyncio.create_task(self._connect_loop()),
+                       asyncio.create_task(self._position_loop()),
+                       asyncio.create_task(self._msg_loop())]
+        logger.info("Starting the loop")
+
+
+    async def stop_com(self) -> None:
+        """
+        Stop the tasks and close the serial port.
+        """
+        if not self._is_running:
+            logger.warning("The loop is not active")
+            return
+
+        self._is_running = False
+        for task in self._tasks:
+            task.cancel()
+        # wait_for of python < 3.12 loses the cancel if the response
+        # arrives at the same time, the loops then end with the transaction
+        self._reader.feed_eof()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        await self._disconnect()
+        self._executor.shutdown(wait=True)
+        if self.capture is not None:
+            self.capture.close()
+
+
+    @property
+    def connected(self) -> bool:
+        """
+        Is the serial port open and did the sand table answer?
+        """
+        return self._is_running and self._connected.is_set()
+
+
+    async def wait_ready(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the sand table is connected.
+
+        :param timeout: max time to wait in s, None waits forever
+
+        :return: True if it is connected
+        """
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+
+    async def _connect_loop(self) -> None:
+        """
+        Open the serial port, wait for the sand table to answer and open
+        it again once the connection is lost.
+        """
+        failures = 0
+        while self._is_running:
+            try:
+                await self._connect()
+            except (serial.SerialException, OSError) as e:
+                await self._disconnect()
+                # only the first failure in a row is a warning
+                log = logger.warning if not failures else logger.debug
+                log("Failed to connect to %s: %s", self.COM, e)
+                failures += 1
+                await asyncio.sleep(SerialCOM.RECONNECT_TIME)
+                continue
+
+            failures = 0
+            logger.info("Connected to %s", self.COM)
+            self.metrics.connects.inc()
+            self.metrics.connected.set(1)
+            self._lost.clear()
+            self._connected.set()
+
+            await self._lost.wait()
+            self._connected.clear()
+            self.metrics.connected.set(0)
+            await self._disconnect()
+
+
+    async def _connect(self) -> None:
+        """
+        Open the serial port and probe the sand table until it answers,
+        see SerialCOM.PROBE_TIMEOUT.
+        """
+        loop = asyncio.get_running_loop()
+        self._serial = await loop.run_in_executor(
+            self._executor, lambda: serial.serial_for_url(
+                self.COM, baudrate=self.BAUDRATE, timeout=self.READER_TIMEOUT))
+        if self.capture is not None:
+            self.capture.record(CaptureKind.open, self.COM.encode())
+            self._serial = CaptureSerial(self._serial, self.capture.record)
+
+        self._reader = asyncio.StreamReader()
+        try:
+            self._fd = self._serial.fileno()
+            self._serial.timeout = 0
+            loop.add_reader(self._fd, self._on_readable)
+        except (AttributeError, OSError, NotImplementedError):
+            self._fd = None
+            self._serial.timeout = self.READER_TIMEOUT
+            self._read_task = asyncio.create_task(self._read_loop())
+
+        # the board may reset when the port is opened, so it is asked for
+        # its buffer size until it answers instead of waiting a fixed time
+        end = time.monotonic() + SerialCOM.PROBE_TIMEOUT
+        while time.monotonic() < end:
+            self._serial.reset_input_buffer()
+            if self._on_probe(await self._exchange(
+                    self.HEADER + MsgType.getRBuffSize.value,
+                    SerialCOM.PROBE_INTERVAL)):
+                return
+
+        raise serial.SerialException("The sand table didn't answer")
+
+
+    async def _disconnect(self) -> None:
+        if self._fd is not None:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._fd = None
+
+        if self._read_task is not None:
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+            self._read_task = None
+
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except (serial.SerialException, OSError):
+                pass
+            self._serial = None
+
+
+    def _on_lost(self, e: Exception) -> None:
+        """
+        Start a reconnect after a failed read or write.
+        """
+        if self._connected.is_set():
+            logger.error("Lost the connection to %s: %s", self.COM, e)
+        self._connected.clear()
+        self._lost.set()
+
+
+    def _on_readable(self) -> None:
+        try:
+            data = self._serial.read(self._serial.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            self._fd = None
+            self._on_lost(e)
+            return
+
+        if data:
+            self._reader.feed_data(data)
+
+
+    def _read_blocking(self) -> bytes:
+        return self._serial.read(self._serial.in_waiting or 1)
+
+
+    async def _read_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while self._is_running:
+            try:
+                data = await loop.run_in_executor(self._executor,
+                                                  self._read_blocking)
+            except (serial.SerialException, OSError) as e:
+                self._on_lost(e)
+                return
+
+            if data:
+                self._reader.feed_data(data)
+
+
+    async def _transaction(self, msg: bytes | memoryview
+                           ) -> tuple[bytes, bytes] | None:
+        """
+        Wait until the sand table is connected, send a msg and wait for the
+        response.
+
+        :param msg: full msg with header
+
+        :return: tuple of response msg and its data or None if the response
+            timed out or the connection was lost
+        """
+        await self._connected.wait()
+
+        return await self._exchange(msg, self.READ_TIMEOUT)
+
+
+    async def _exchange(self, msg: bytes | memoryview, timeout: float
+                        ) -> tuple[bytes, bytes] | None:
+        """
+        Send a msg and wait for the response, see _transaction.
+        """
+        async with self._lock:
+            if self._stale:
+                # drop the late response to an earlier msg
+                self._reader = asyncio.StreamReader()
+                self._stale = False
+
+            t_send = time.monotonic()
+            try:
+                self._serial.write(msg)
+            except (serial.SerialException, OSError) as e:
+                self._on_lost(e)
+                return None
+
+            try:
+                ret = await asyncio.wait_for(self._read_response(), timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError):
+                # stop_com ends the read with an EOF
+                if self._is_running:
+                    self._timed_out(msg)
+                return None
+
+        self.metrics.ack_rtt.observe(time.monotonic() - t_send)
+        return ret
+
+
+    async def _read_response(self) -> tuple[bytes, bytes]:
+        await self._reader.readuntil(self.HEADER)
+        ret = await self._reader.readexactly(1)
+        data = await self._reader.readexactly(RESPONSE_DATA_SIZE.get(ret, 0))
+
+        return ret, data
+
+
+    async def _position_loop(self) -> None:
+        """
+        Send the msgs of the position lane, see
+        SerialCOM._serial_send_postion.
+        """
+        while self._is_running:
+            # the msgs go first, so a stop is never behind a frame
+            await self._msg_queue.join()
+            self._flush()
+
+            req = self._position_msg()
+            if req is None:
+                # the item is dropped by _flush if a clear comes first
+                self._take_item(await self._pos_queue.get())
+                continue
+
+            msg, handle = req
+            if not handle(await self._transaction(msg)):
+                await asyncio.sleep(self.BUFF_POLL_TIME)
+
+
+    async def _msg_loop(self) -> None:
+        while self._is_running:
+            packet = await self._msg_queue.get()
+            try:
+                self._on_msg(packet, await self._transaction(
+                    packet["msg_arr"]))
+            finally:
+                self._msg_queue.task_done()
+
+
+    async def send_pos(self, pos: list[int, int]) -> None:
+        """
+        Adds the new position to the queue and waits if the queue is full.
+
+        :param pos: list of [r, phi] as position in steps
+        """
+        await self._pos_queue.put((self.epoch, encode_pos(pos)))
+        self.queued += 1
+
+
+    async def send_packets(self, data: bytes | memoryview,
+                           epoch: int | None = None) -> None:
+        """
+        Adds many encoded positions to the queue, see SerialCOM.send_packets.
+
+        :param data: positions as big endian int32 [r, phi] pairs
+        :param epoch: epoch the positions belong to, see
+            SerialCOM.send_packets
+        """
+        for item in self._chunks(data, epoch):
+            await self._pos_queue.put(item)
+
+
+    async def queue_speed(self, speed: int, epoch: int | None = None) -> None:
+        """
+        Add a speed change to the position queue, see
+        SerialCOM.queue_speed.
+
+        :param speed: speed is defined as steps per second as a uint16
+        :param epoch: see send_packets
+        """
+        await self._pos_queue.put(self._speed_item(speed, epoch))
+
+
+    async def _add_msg(self, packet: SendPacket) -> None:
+        await self._msg_queue.put(packet)
+
+
+    async def update_speed(self, speed: int) -> None:
+        """
+        Update the speed value on the sand table.
+
+        :param speed: speed is defined as steps per second as a uint16
+        """
+        await self._add_msg(self._speed_packet(speed))
+
+
+    async def home(self) -> None:
+        """
+        Send a command to home the sand table.
+        """
+        await self._add_msg(self._home_packet())
+
+
+    async def stop(self, clear: bool = False) -> None:
+        """
+        Stop the sand table, see SerialCOM.stop.
+
+        :param clear: whether to clear the position queue.
+        """
+        for packet in self._stop_packets(clear):
+            await self._add_msg(packet)
+
+
+    async def wait_cleared(self, epoch: int, timeout: float | None = None
+                           ) -> bool:
+        """
+        Wait until the sand table confirmed the clear that started the
+        epoch, see SerialCOM.wait_cleared.
+
+        :param epoch: epoch of the position queue after the clear
+        :param timeout: max time to wait in s, None waits forever
+
+        :return: True if the clear was confirmed
+        """
+        async def confirmed():
+            while self.cleared_epoch < epoch:
+                self._cleared.clear()
+                await self._cleared.wait()
+
+        try:
+            await asyncio.wait_for(confirmed(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+        return True
+
+
+    async def query_buffsize(self) -> None:
+        """
+        Ask the sand table for the number of positions in its buffer, see
+        SerialCOM.query_buffsize.
+        """
+        await self._add_msg(self._packet(MsgType.getRBuffSize))
+
+
+    async def start(self) -> None:
+        """
+        Start the sand table.
+        """
+        await self._add_msg(self._packet(MsgType.start))
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+from .engines import compile_path
+from .metrics import Registry
+from .path_maker import PathMaker
+from .async_serial_com import AsyncSerialCOM
+from .worker import PathSender
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWorker(PathSender):
+    """
+    asyncio version of Worker that runs in the event loop of the caller,
+    for example the one of the FastAPI app. Positions are handed to the
+    AsyncSerialCOM as soon as there is space in its queue.
+
+    :param COM: serial port or url, see SerialCOM
+    :param registry: where to register the metrics
+    :param erase: draw a TransitionSpiral before every PathMaker
+    :param ball_diameter: diameter of the ball in mm
+    :param journal: file to journal the drawn patterns in. If given, an
+        unfinished pattern is resumed when the worker starts, see Journal.
+    :param ball_speed: target speed of the ball in mm/s. If given, the
+        motor speed is planned along every path and queued in between the
+        positions, see plan_speeds. If None, all paths are drawn with the
+        last speed set with update_speed.
+    :param capture: file to log the serial traffic to, see SerialCOM
+    """
+    def __init__(self, COM: str, registry: Registry | None = None,
+                 erase: bool = True, ball_diameter: float = 10,
+                 journal: str | None = None,
+                 ball_speed: float | None = None,
+                 capture: str | None = None):
+        super().__init__(AsyncSerialCOM(COM, registry, capture),
+                         asyncio.Queue(), registry, erase, ball_diameter,
+                         journal, ball_speed)
+        self._task = None
+
+
+    async def add_PathMaker(self, item: PathMaker):
+        await self.q_path.put(item)
+        logger.info("Added to queue")
+
+
+    async def home(self):
+        await self.com.home()
+
+
+    async def stop(self, clear: bool = False):
+        """
+        Stop the sand table, see Worker.stop.
+
+        :param clear: also remove the queued PathMakers and the queued
+            positions
+        """
+        if clear:
+            self._clear_paths()
+
+        await self.com.stop(clear)
+
+        if clear:
+            self.progress.clear()
+            logger.info("Cleared the queue")
+
+
+    async def start(self):
+        await self.com.start()
+
+
+    async def _send_path(self, pm: PathMaker, pattern: bool = True,
+                         start: int = 0, epoch: int | None = None) -> bool:
+        """
+        Add all points of the PathMaker to the position queue, see
+        Worker._send_path.
+
+        :return: True if all points were queued
+        """
+        epoch = self.com.epoch if epoch is None else epoch
+        items = self._path_items(pm, pattern, start, epoch)
+
+        while True:
+            try:
+                item = next(items)
+            except StopIteration as e:
+                return e.value
+
+            if isinstance(item, int):
+                await self.com.queue_speed(item, epoch)
+            else:
+                # wait until a slot gets freed
+                await self.com.send_packets(item, epoch)
+
+
+    async def _resume(self) -> None:
+        """
+        Continue the unfinished pattern of the journal, see Worker._resume.
+        """
+        resume = self._resume_point()
+        if resume is None:
+            return
+        source, index = resume
+
+        try:
+            pm = await asyncio.to_thread(compile_path, source["engine"],
+                                         source["params"])
+            pm.name = source["name"]
+            pm.source = source
+
+            if index == 0:
+                # nothing was drawn yet, so the table can be erased
+                await self.add_PathMaker(pm)
+                return
+
+            self.metrics.start_pattern(pm.name, pm.total)
+            if await self._send_path(pm, start=index):
+                self.metrics.patterns.inc()
+
+        except Exception as e:
+            logger.exception("Failed to resume %s: %s", source["name"], e)
+
+
+    async def _position_worker(self):
+        if self.journal is not None:
+            await self._resume()
+
+        while True:
+            pm = await self.q_path.get()
+            # nothing runs in between in the event loop, so the PathMaker
+            # was queued after the last clear, see stop
+            epoch = self.com.epoch
+            logger.info("Got PathMaker")
+            self._skip = False
+
+            try:
+                if epoch != self._pos_epoch:
+                    self._after_clear(epoch, await self.com.wait_cleared(
+                        epoch, self.CLEAR_TIMEOUT))
+
+                transition = self._transition(pm)
+                if transition is not None:
+                    await self._send_path(transition, pattern=False,
+                                          epoch=epoch)
+
+                self.metrics.start_pattern(pm.name or type(pm).__name__,
+                                           pm.total)
+
+                if await self._send_path(pm, epoch=epoch):
+                    self.metrics.patterns.inc()
+                    logger.info("Path fully added to pos queue")
+
+            except Exception as e:
+                logger.exception("Fail: %s", e)
+
+            finally:
+                self.q_path.task_done()
+
+
+    async def start_worker(self):
+        if self._task is not None:
+            logger.warning("Task already active")
+            return
+
+        await self.com.begin_com()
+        if self.journal is not None:
+            self.journal.open()
+        self._task = asyncio.create_task(self._position_worker())
+        logger.info("Started workers")
+
+
+    async def end_workers(self):
+        if self._task is None:
+            logger.warning("Task not active")
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self.journal is not None:
+            self.journal.close()
+        await self.com.stop_com()
@@ -0,0 +1,168 @@
+import logging
+import queue
+import struct
+import threading
+import time
+from enum import IntEnum
+from typing import Any, Callable, Iterator, TypedDict
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"SANDCAP\x01"
+# monotonic time in s, kind and length of the data that follows
+RECORD = struct.Struct("<dBH")
+
+
+class CaptureKind(IntEnum):
+    write = 0 # bytes written to the sand table
+    read = 1 # bytes read from it, empty if the read timed out
+    open = 2 # the port was opened, the data is its name
+
+
+class CaptureRecord(TypedDict):
+    time: float
+    kind: CaptureKind
+    data: bytes
+
+
+
+class CaptureWriter:
+    """
+    Binary log of the serial traffic. Every record is a monotonic
+    timestamp, its kind and the bytes, see RECORD. record only puts the
+    bytes into a queue, they are written to the file by a background
+    thread, so the serial loop never waits for the disk.
+
+    Available methods:
+    - start() -> open the file and start the writer thread
+    - record() -> add a record
+    - close() -> write the queued records and close the file
+
+    :param filename: file to write the log to, it is overwritten
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._queue: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+        self._thread = None
+
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        self._file = open(self.filename, "wb")
+        self._file.write(MAGIC)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        logger.info("Capturing the serial traffic to %s", self.filename)
+
+
+    def record(self, kind: CaptureKind, data: bytes | memoryview) -> None:
+        """
+        :param kind: direction of the data
+        :param data: written or read bytes, copied as the frame buffers
+            are reused
+        """
+        self._queue.put((time.monotonic(), kind, bytes(data)))
+
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            t, kind, data = item
+            # the length is a uint16, longer reads are split
+            for i in range(0, max(len(data), 1), 2**16 - 1):
+                part = data[i:i + 2**16 - 1]
+                self._file.write(RECORD.pack(t, kind, len(part)) + part)
+
+            if self._queue.empty():
+                self._file.flush()
+
+        self._file.close()
+
+
+    def close(self) -> None:
+        if self._thread is None:
+            return
+
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+
+
+class CaptureSerial:
+    """
+    Wrapper of a serial port that records everything that is written to it
+    and read from it. All other attributes are the ones of the port.
+
+    :param port: serial port, see serial.serial_for_url
+    :param record: called with the kind and the bytes, see
+        CaptureWriter.record
+    """
+    def __init__(self, port: Any,
+                 record: Callable[[CaptureKind, bytes], None]):
+        self._port = port
+        self._record = record
+
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._port, name)
+
+
+    @property
+    def timeout(self) -> float | None:
+        return self._port.timeout
+
+
+    @timeout.setter
+    def timeout(self, value: float | None) -> None:
+        self._port.timeout = value
+
+
+    def write(self, data: bytes | memoryview) -> int | None:
+        self._record(CaptureKind.write, data)
+        return self._port.write(data)
+
+
+    def read(self, size: int = 1) -> bytes:
+        data = self._port.read(size)
+        self._record(CaptureKind.read, data)
+        return data
+
+
+    def read_until(self, expected: bytes = b"\n",
+                   size: int | None = None) -> bytes:
+        data = self._port.read_until(expected, size)
+        self._record(CaptureKind.read, data)
+        return data
+
+
+
+def read_capture(filename: str) -> Iterator[CaptureRecord]:
+    """
+    :param filename: log written by CaptureWriter
+
+    :return: generator of the records
+    """
+    with open(filename, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a capture file!")
+
+        while True:
+            head = file.read(RECORD.size)
+            if len(head) < RECORD.size:
+                # the last record of a crashed capture may be cut off
+                return
+
+            t, kind, size = RECORD.unpack(head)
+            data = file.read(size)
+            if len(data) < size:
+                return
+
+            yield CaptureRecord(time=t, kind=CaptureKind(kind), data=data)
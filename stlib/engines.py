@@ -0,0 +1,59 @@
+from typing import Any, Callable
+
+import numpy as np
+
+from .load_svg import get_pts_from_svg
+from .path_cache import PathCache
+from .parametric import Lissajous, ModulatedSpiral, Rose, Spirograph, \
+    StarSpiral
+from .path_maker import PathMaker, SpiralAboutCenter
+from .streaming import StreamingPath
+
+
+def _svg_path_maker(filename: str, cache_dir: str | None = None,
+                    **kwargs) -> PathMaker:
+    if cache_dir is not None:
+        return PathCache(cache_dir).get_path_maker(filename, **kwargs)
+
+    return PathMaker(get_pts_from_svg(filename), **kwargs)
+
+
+# engine name -> function that creates the PathMaker from the job params.
+# The functions run in a worker process, so they must be importable.
+ENGINES: dict[str, Callable[..., PathMaker]] = {
+    "PathMaker": _svg_path_maker,
+    "SpiralAboutCenter": SpiralAboutCenter,
+    "Rose": Rose,
+    "Spirograph": Spirograph,
+    "Lissajous": Lissajous,
+    "StarSpiral": StarSpiral,
+    "ModulatedSpiral": ModulatedSpiral,
+    # compiled lazily while it is drawn, for very large svg files
+    "StreamingPath": StreamingPath.from_svg,
+}
+
+
+
+def compile_path(engine: str, params: dict[str, Any]) -> PathMaker:
+    """
+    Create the PathMaker of an engine. Arrays loaded from the cache are
+    copied, so the result can be sent between processes.
+
+    :param engine: name of the engine in ENGINES
+    :param params: arguments of the engine
+
+    :return: compiled PathMaker
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}")
+
+    pm = ENGINES[engine](**params)
+
+    # arrays loaded from the cache are memory maps, which can't be sent
+    # back from a worker process
+    if isinstance(getattr(pm, "positions", None), np.memmap):
+        pm.pts = np.array(pm.pts)
+        pm.pts_polar = np.array(pm.pts_polar)
+        pm.positions = np.array(pm.positions)
+
+    return pm
@@ -0,0 +1,231 @@
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+from .path_maker import PathMaker
+
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Append-only journal of the pattern that is drawn, so it can be resumed
+    after a restart. A pattern starts with a record of its id, engine, name
+    and params, followed by records of the last acknowledged index and the
+    iteration. The acknowledged count of the serial communication is only
+    read by a background thread every interval, which writes and fsyncs at
+    most one record, so the send loop never waits for the disk. The
+    journal is truncated at the start of every pattern.
+
+    Records are one json object per line:
+    - {"op": "start", "source": {...}, "total": 1234, "size": 617}
+    - {"i": 500, "it": 0}
+    - {"op": "end"}
+
+    Available methods:
+    - pending() -> source and index of an unfinished pattern
+    - open() -> start the background thread
+    - close() -> write the last index and stop the thread
+    - start() -> start journaling a pattern
+    - end() -> mark the current pattern as finished
+    - set_size() -> number of points of a pattern that is compiled lazily
+
+    :param path: journal file
+    :param com: SerialCOM or AsyncSerialCOM the patterns are sent with
+    :param interval: time between two records in s
+    """
+    def __init__(self, path: str, com, interval: float = 2):
+        self.path = path
+        self.com = com
+        self.interval = interval
+        self._current = None
+        self._index = None
+        self._file = None
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+
+
+    def pending(self) -> dict | None:
+        """
+        Read the journal. A torn last record of a crash is ignored.
+
+        :return: dict with the source of the unfinished pattern and the
+            last acknowledged index or None if all patterns were finished
+        """
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+
+        source, index = None, 0
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Ignoring a broken journal record")
+                break
+
+            match record.get("op"):
+                case "start":
+                    source, index = record["source"], 0
+                case "end":
+                    source = None
+                case _:
+                    index = record["i"]
+
+        if source is None:
+            return None
+
+        return {"source": source, "index": index}
+
+
+    def open(self) -> None:
+        """
+        Open the journal file and start the background thread.
+        """
+        if self._thread is not None:
+            logger.warning("Journal already open")
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a")
+        self._event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def close(self) -> None:
+        """
+        Write the last acknowledged index and stop the background thread.
+        """
+        if self._thread is None:
+            logger.warning("Journal not open")
+            return
+
+        self._event.set()
+        self._thread.join()
+        self._thread = None
+        self._sync()
+        self._file.close()
+
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+    def start(self, source: dict, total: int | None, size: int | None,
+              offset: int = 0) -> None:
+        """
+        Start journaling a pattern. Must be called right before its first
+        point is queued.
+
+        :param source: id, engine, name and params of the pattern, see
+            PathMaker.source
+        :param total: number of points of the pattern, None if it is not
+            known yet, see set_size
+        :param size: number of points of one iteration or None
+        :param offset: index of the first queued point of a resumed pattern
+        """
+        with self._lock:
+            self._file.truncate(0)
+            self._write({"op": "start", "source": source, "total": total,
+                         "size": size})
+            self._current = {"start": self.com.queued - offset,
+                             "offset": offset, "total": total, "size": size}
+            self._index = offset
+
+
+    def set_size(self, total: int, size: int) -> None:
+        """
+        Set the number of points of the current pattern once all of them
+        were queued, see StreamingPath. Until then the pattern doesn't end.
+
+        :param total: number of points of the pattern
+        :param size: number of points of one iteration
+        """
+        with self._lock:
+            if self._current is not None:
+                self._current.update(total=total, size=size)
+
+
+    def end(self) -> None:
+        """
+        Mark the current pattern as finished, for example when it is
+        skipped.
+        """
+        with self._lock:
+            if self._current is not None:
+                self._write({"op": "end"})
+                self._current = None
+
+
+    def _sync(self) -> None:
+        """
+        Write the acknowledged index of the current pattern if it changed.
+        """
+        with self._lock:
+            if self._current is None:
+                return
+
+            cur = self._current
+            # the points before the offset were drawn before a restart
+            index = max(self.com.acked - cur["start"], cur["offset"])
+            if cur["total"] is not None:
+                index = min(index, cur["total"])
+            if index == self._index:
+                return
+
+            self._index = index
+            if index == cur["total"]:
+                self._write({"op": "end"})
+                self._current = None
+            else:
+                # the rotation between the iterations is one more point
+                it = None if cur["size"] is None \
+                    else index // (cur["size"] + 1)
+                self._write({"i": index, "it": it})
+
+
+    def _run(self) -> None:
+        while not self._event.wait(self.interval):
+            try:
+                self._sync()
+            except OSError as e:
+                logger.error("Failed to write the journal: %s", e)
+
+
+
+def resume_positions(pts: np.ndarray, index: int, phi0: float,
+                     phi: int) -> np.ndarray:
+    """
+    Positions to continue a pattern at an index. The first position moves
+    straight from the current position to the point at the index instead
+    of erasing the table with a TransitionSpiral, so the part that was
+    already drawn is kept.
+
+    :param pts: encoded positions of the PathMaker as np.array([N, 2]),
+        or the chunk of them that contains the index
+    :param index: index of the first point to draw in pts
+    :param phi0: absolute phi in steps before pts. A pattern starts at the
+        angle of its first point, see PathMaker.start_point, and phi is
+        relative from there on.
+    :param phi: sum of all phi steps sent since homing
+
+    :return: positions from the index on as np.array([N - index, 2])
+    """
+    full = 2*np.pi*PathMaker.ANGLE_STEPS_RAD
+    target = phi0 + pts[:index+1, 1].sum(dtype=np.int64)
+    # shorter way around the center
+    d = (target - phi + full/2) % full - full/2
+
+    resumed = np.array(pts[index:])
+    resumed[0, 1] = round(d)
+
+    return resumed
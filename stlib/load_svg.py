@@ -1,5 +1,10 @@
 import xml.etree.ElementTree as ET
 import re
+import math
+from typing import Iterator
+import numpy as np
+
+from .path_order import order_polylines
 
 
 def get_path_from_svg(filename: str) -> str | None:
@@ -33,82 +38,422 @@ def get_path_from_svg(filename: str) -> str | None:
 
 
 
-def get_pts_from_svg(filename: str) -> list:
+_SVG_NS = "{http://www.w3.org/2000/svg}"
+# elements whose content isn't drawn directly
+_SKIP_TAGS = {"defs", "clipPath", "mask", "marker", "pattern", "symbol",
+              "metadata"}
+_HIDDEN_RE = re.compile(r"(?:^|;)\s*(?:display\s*:\s*none"
+                        r"|visibility\s*:\s*hidden)")
+
+
+
+def _is_hidden(elem: ET.Element) -> bool:
+    if elem.get("display") == "none" or elem.get("visibility") == "hidden":
+        return True
+
+    return _HIDDEN_RE.search(elem.get("style", "")) is not None
+
+
+
+def get_paths_from_svg(filename: str) -> list[str]:
     """
-    Get points from paths in svg file.
+    Get data of all visible paths in svg file in document order. Paths
+    inside hidden elements or definitions are skipped.
 
-    :param filename: path to svg file.
+    :param filename: path to svg file
 
-    :return ret_list: path data as [[x0,y0], [x1,y1], ...] If
-        no paths are available it returns an empty list.
+    :return ret: list of path data
     """
-    path = get_path_from_svg(filename)
+    ret = []
 
-    if path is None:
-        print(f"No paths were found in {filename}")
+    def walk(elem):
+        tag = elem.tag.removeprefix(_SVG_NS)
+        if tag in _SKIP_TAGS or _is_hidden(elem):
+            return
+        if tag == "path" and elem.get("d"):
+            ret.append(elem.get("d"))
+
+        for child in elem:
+            walk(child)
+
+    walk(ET.parse(filename).getroot())
+
+    return ret
+
+
+
+# increase when the parsed points change, the cached paths are then
+# compiled again, see PathCache
+PARSER_VERSION = 2
+
+# https://www.w3.org/TR/SVG11/paths.html#PathDataBNF
+_NUM = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_CMD_RE = re.compile(r"([MmZzLlHhVvCcSsQqTtAa])")
+_NUM_RE = re.compile(_NUM)
+# arc flags are single digits and may be written without separators
+_ARC_RE = re.compile(
+    rf"({_NUM})[\s,]*({_NUM})[\s,]*({_NUM})[\s,]*([01])[\s,]*([01])"
+    rf"[\s,]*({_NUM})[\s,]*({_NUM})")
+
+# number of arguments per command
+_NUM_ARGS = {
+    "m": 2, "l": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4, "t": 2, "a": 7,
+    "z": 0
+}
+
+
+
+def _tokenize(path: str) -> tuple[list[str], list[float], list[int]]:
+    """
+    Split the path data into commands and their arguments.
+
+    :param path: svg path data
+
+    :return cmds: list of commands
+    :return vals: all arguments as floats
+    :return offsets: start index of the arguments of each command in vals.
+        The last value is the total number of arguments.
+    """
+    parts = _CMD_RE.split(path)
+
+    if parts[0].strip():
+        print(f"Path data must start with a command, ignoring {parts[0]}")
+
+    cmds = []
+    args = []
+    for cmd, arg in zip(parts[1::2], parts[2::2]):
+        # repeated commands are the same as implicit repeats, except for
+        # moveto where the following pairs are treated as lineto
+        if cmds and cmd == cmds[-1] and cmd not in "mMzZ":
+            args[-1] += " " + arg
+        else:
+            cmds.append(cmd)
+            args.append(arg)
+
+    tokens = []
+    offsets = [0]
+    for cmd, arg in zip(cmds, args):
+        if cmd in "aA":
+            found = [val for item in _ARC_RE.findall(arg) for val in item]
+        else:
+            found = _NUM_RE.findall(arg)
+
+        tokens.extend(found)
+        offsets.append(len(tokens))
+
+    return cmds, list(map(float, tokens)), offsets
+
+
+
+def _arc_to_cubics(x0: float, y0: float, rx: float, ry: float,
+                   angle: float, large_arc: bool, sweep: bool, x1: float,
+                   y1: float) -> list[float]:
+    """
+    Convert an elliptical arc to cubic Bézier curves with at most 45° each.
+    https://www.w3.org/TR/SVG11/implnote.html#ArcImplementationNotes
+
+    :param x0, y0: start point
+    :param rx, ry: radii of the ellipse
+    :param angle: x axis rotation of the ellipse in degrees
+    :param large_arc: large arc flag
+    :param sweep: sweep flag
+    :param x1, y1: end point
+
+    :return: control points of the curves as [x0, y0, ..., x3, y3, x0, ...]
+        where every curve is defined by 8 values.
+    """
+    rx, ry = abs(rx), abs(ry)
+
+    if x0 == x1 and y0 == y1:
         return []
-    
-    def next_float():
-        nonlocal idx
-        val = float(tokens[idx])
-        idx += 1
-        return val
-    
-    # https://www.rexegg.com/regex-quickstart.php
-    tokens = re.findall(r'[a-zA-Z]|-?\d+(?:\.\d+)?', path)
-    idx = 0
-    positions = []
-    cur_pos = [0, 0]
-    cmd = None
-
-    while idx < len(tokens):
-        val = tokens[idx]
-
-        if re.match(r"[a-zA-Z]", val):
-            cmd = val
-            idx += 1
-
-        match cmd:
-            case "m":
-                cur_pos[0] += next_float()
-                cur_pos[1] += next_float()
-                # the following tokens are treated as relative lineto values
-                cmd = "l"
-                positions.append(cur_pos.copy())
-            case "M":
-                cur_pos[0] = next_float()
-                cur_pos[1] = next_float()
-                # the following tokens are treated as absolute lineto values
-                cmd = "L"
-                positions.append(cur_pos.copy())
-            case "l":
-                cur_pos[0] += next_float()
-                cur_pos[1] += next_float()
-                positions.append(cur_pos.copy())
-            case "L":
-                cur_pos[0] = next_float()
-                cur_pos[1] = next_float()
-                positions.append(cur_pos.copy())
-            case "v":
-                cur_pos[1] += next_float()
-                positions.append(cur_pos.copy())
-            case "V":
-                cur_pos[1] = next_float()
-                positions.append(cur_pos.copy())
-            case "h":
-                cur_pos[0] += next_float()
-                positions.append(cur_pos.copy())
-            case "H":
-                cur_pos[0] = next_float()
-                positions.append(cur_pos.copy())
-            case "z":
-                cur_pos = positions[0]
-                positions.append(cur_pos.copy())
-            case "Z":
-                cur_pos = positions[0]
-                positions.append(cur_pos.copy())
-            case _:
-                print(f"Received unsupported command {cmd}")
+    if rx == 0 or ry == 0:
+        return [x0, y0, x0, y0, x1, y1, x1, y1]
+
+    cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    dx, dy = (x0 - x1)/2, (y0 - y1)/2
+    x1p = cos*dx + sin*dy
+    y1p = -sin*dx + cos*dy
+
+    # scale up radii that are too small to reach the end point
+    lam = x1p**2/rx**2 + y1p**2/ry**2
+    if lam > 1:
+        rx, ry = rx*math.sqrt(lam), ry*math.sqrt(lam)
+
+    num = rx**2*ry**2 - rx**2*y1p**2 - ry**2*x1p**2
+    den = rx**2*y1p**2 + ry**2*x1p**2
+    coef = math.sqrt(max(0, num/den))
+    if large_arc == sweep:
+        coef = -coef
+
+    cxp, cyp = coef*rx*y1p/ry, -coef*ry*x1p/rx
+    cx = cos*cxp - sin*cyp + (x0 + x1)/2
+    cy = sin*cxp + cos*cyp + (y0 + y1)/2
+
+    theta = math.atan2((y1p - cyp)/ry, (x1p - cxp)/rx)
+    theta2 = math.atan2((-y1p - cyp)/ry, (-x1p - cxp)/rx)
+    dtheta = theta2 - theta
+    if sweep and dtheta < 0:
+        dtheta += 2*math.pi
+    elif not sweep and dtheta > 0:
+        dtheta -= 2*math.pi
+
+    def point(ux, uy):
+        return (cx + rx*ux*cos - ry*uy*sin, cy + rx*ux*sin + ry*uy*cos)
+
+    n = max(1, math.ceil(abs(dtheta)/(math.pi/4)))
+    d = dtheta/n
+    k = 4/3*math.tan(d/4)
+    ret = []
+    px, py = x0, y0
+    for i in range(n):
+        c0, s0 = math.cos(theta), math.sin(theta)
+        theta += d
+        c1, s1 = math.cos(theta), math.sin(theta)
+
+        ex, ey = point(c1, s1) if i < n-1 else (x1, y1)
+        ret.extend((px, py, *point(c0 - k*s0, s0 + k*c0),
+                    *point(c1 + k*s1, s1 - k*c1), ex, ey))
+        px, py = ex, ey
+
+    return ret
+
+
+
+def _flatten(segs: np.ndarray, curve: np.ndarray, tol: float) -> np.ndarray:
+    """
+    Flatten cubic Bézier curves into lines. The number of lines for each
+    curve is based on the bound of its second derivative, so that the
+    deviation from the curve stays below tol. Segments that aren't curves
+    are kept as a single line.
+
+    :param segs: control points as np.array([N, 4, 2])
+    :param curve: is the segment a curve as np.array([N])
+    :param tol: max allowed deviation in mm
+
+    :return: points without the start point as np.array([M, 2]) and the
+        number of points of every segment as np.array([N])
+    """
+    p0, p1, p2, p3 = segs[:, 0], segs[:, 1], segs[:, 2], segs[:, 3]
+
+    dd = np.maximum(np.hypot(*(p0 - 2*p1 + p2).T),
+                    np.hypot(*(p1 - 2*p2 + p3).T))
+    n = np.ceil(np.sqrt(0.75*dd/tol))
+    n = np.where(curve, np.maximum(n, 1), 1).astype(np.intp)
+
+    idx = np.repeat(np.arange(n.shape[0]), n)
+    t = np.arange(idx.shape[0]) - np.repeat(np.cumsum(n) - n, n) + 1
+    t = (t/n[idx])[:, None]
+    mt = 1 - t
+
+    # t == 1 returns exactly p3
+    pts = (mt**3*p0[idx] + 3*mt**2*t*p1[idx] + 3*mt*t**2*p2[idx]
+           + t**3*p3[idx])
+
+    return pts, n
+
+
+
+def parse_subpaths(path: str, tol: float = 0.1) -> list[np.ndarray]:
+    """
+    Convert svg path data to one polyline per subpath. Every moveto starts
+    a new subpath. All path commands are supported. Curves and arcs are
+    flattened into lines.
+
+    :param path: svg path data
+    :param tol: max allowed deviation of the flattened curves in mm
+
+    :return ret: list of points as np.array([N, 2]). Subpaths without any
+        segment are left out.
+    """
+    cmds, vals, offsets = _tokenize(path)
+
+    # every segment is stored as a cubic curve [x0, y0, ..., x3, y3]
+    segs = []
+    curve = []
+    # index of the first segment and start point of every subpath
+    sub_idx = []
+    sub_first = []
+    first = None
+    x = y = 0.
+    sx = sy = 0.
+    # last control point and type of the previous command, used by S and T
+    qx = qy = 0.
+    prev = None
+
+    def begin():
+        nonlocal first
+
+        # a subpath starts at the first segment after a moveto
+        if first is None:
+            first = (x, y)
+            sub_idx.append(len(curve))
+            sub_first.append(first)
+
+    def add(x1, y1, c=None):
+        begin()
+        if c is None:
+            segs.extend((x, y, x, y, x1, y1, x1, y1))
+            curve.append(False)
+        else:
+            segs.extend((x, y, *c, x1, y1))
+            curve.append(True)
+
+    for i, cmd in enumerate(cmds):
+        key = cmd.lower()
+        rel = cmd.islower()
+        n_args = _NUM_ARGS[key]
+        args = vals[offsets[i]:offsets[i+1]]
+
+        if key == "z":
+            add(sx, sy)
+            x, y = sx, sy
+            prev = key
+            continue
+
+        if len(args) == 0 or len(args) % n_args:
+            print(f"Invalid number of arguments for command {cmd}")
+            args = args[:len(args) - len(args) % n_args]
+            if len(args) == 0:
                 break
-    
-    return positions
\ No newline at end of file
+
+        for j in range(0, len(args), n_args):
+            a = args[j:j+n_args]
+            ox, oy = (x, y) if rel else (0., 0.)
+
+            match key:
+                case "m" | "l":
+                    x1, y1 = ox + a[0], oy + a[1]
+                    if key == "m" and j == 0:
+                        sx, sy = x1, y1
+                        first = None
+                        x, y = x1, y1
+                        prev = key
+                        continue
+                    add(x1, y1)
+                case "h":
+                    x1, y1 = ox + a[0], y
+                    add(x1, y1)
+                case "v":
+                    x1, y1 = x, oy + a[0]
+                    add(x1, y1)
+                case "c":
+                    x1, y1 = ox + a[4], oy + a[5]
+                    qx, qy = ox + a[2], oy + a[3]
+                    add(x1, y1, (ox + a[0], oy + a[1], qx, qy))
+                case "s":
+                    if prev not in ("c", "s"):
+                        qx, qy = x, y
+                    c1 = (2*x - qx, 2*y - qy)
+                    x1, y1 = ox + a[2], oy + a[3]
+                    qx, qy = ox + a[0], oy + a[1]
+                    add(x1, y1, (*c1, qx, qy))
+                case "q" | "t":
+                    if key == "q":
+                        qx, qy = ox + a[0], oy + a[1]
+                    elif prev in ("q", "t"):
+                        qx, qy = 2*x - qx, 2*y - qy
+                    else:
+                        qx, qy = x, y
+                    x1, y1 = ox + a[-2], oy + a[-1]
+                    # elevate to a cubic curve
+                    add(x1, y1, (x + 2/3*(qx - x), y + 2/3*(qy - y),
+                                 x1 + 2/3*(qx - x1), y1 + 2/3*(qy - y1)))
+                case "a":
+                    x1, y1 = ox + a[5], oy + a[6]
+                    begin()
+                    ret = _arc_to_cubics(x, y, a[0], a[1], a[2], bool(a[3]),
+                                         bool(a[4]), x1, y1)
+                    segs.extend(ret)
+                    curve.extend([True]*(len(ret)//8))
+
+            x, y = x1, y1
+            prev = key
+
+    if not curve:
+        return []
+
+    segs = np.array(segs, dtype=np.float64).reshape(-1, 4, 2)
+    pts, n = _flatten(segs, np.array(curve, dtype=bool), tol)
+    # index of the first flattened point of every segment
+    pt_idx = np.concatenate(([0], np.cumsum(n)))
+    bounds = [*sub_idx, len(curve)]
+
+    ret = []
+    for k, start in enumerate(sub_first):
+        sub = pts[pt_idx[bounds[k]]:pt_idx[bounds[k+1]]]
+        if sub.shape[0] == 0:
+            continue
+        ret.append(np.vstack((start, sub)))
+
+    return ret
+
+
+
+def parse_path(path: str, tol: float = 0.1) -> np.ndarray:
+    """
+    Convert svg path data to points. The subpaths are joined in the order
+    they appear in.
+
+    :param path: svg path data
+    :param tol: max allowed deviation of the flattened curves in mm
+
+    :return ret: points as np.array([N, 2])
+    """
+    subpaths = parse_subpaths(path, tol)
+
+    if not subpaths:
+        return np.empty((0, 2))
+
+    return np.vstack(subpaths)
+
+
+
+def iter_polylines_from_svg(filename: str,
+                            tol: float = 0.1) -> Iterator[np.ndarray]:
+    """
+    Same as get_polylines_from_svg, but the paths are flattened one by one
+    while the polylines are consumed.
+
+    :param filename: path to svg file.
+    :param tol: max allowed deviation of the flattened curves in mm
+
+    :return ret: generator of points as np.array([N, 2]) in document order
+    """
+    for path in get_paths_from_svg(filename):
+        yield from parse_subpaths(path, tol)
+
+
+
+def get_polylines_from_svg(filename: str,
+                           tol: float = 0.1) -> list[np.ndarray]:
+    """
+    Get one polyline for every subpath of all visible paths in svg file.
+
+    :param filename: path to svg file.
+    :param tol: max allowed deviation of the flattened curves in mm
+
+    :return ret: list of points as np.array([N, 2]) in document order
+    """
+    return list(iter_polylines_from_svg(filename, tol))
+
+
+
+def get_pts_from_svg(filename: str, tol: float = 0.1) -> np.ndarray:
+    """
+    Get points from paths in svg file. All visible paths and their subpaths
+    are loaded and joined in the order that minimizes the moves between
+    them, see order_polylines.
+
+    :param filename: path to svg file.
+    :param tol: max allowed deviation of the flattened curves in mm
+
+    :return ret: path data as np.array([[x0,y0], [x1,y1], ...]) If
+        no paths are available it returns an empty array.
+    """
+    polylines = get_polylines_from_svg(filename, tol)
+
+    if not polylines:
+        print(f"No paths were found in {filename}")
+        return np.empty((0, 2))
+
+    return np.vstack(order_polylines(polylines))
@@ -0,0 +1,353 @@
+import bisect
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+
+    items = []
+    for key, val in labels.items():
+        val = str(val).replace("\\", "\\\\").replace("\n", "\\n") \
+            .replace('"', '\\"')
+        items.append(f'{key}="{val}"')
+
+    return "{" + ",".join(items) + "}"
+
+
+
+class _Metric:
+    """
+    Base of all metrics. Every metric has a fixed set of labels, for
+    example the serial port, to tell apart the same metric of several
+    instances.
+
+    :param name: metric name
+    :param help: description of the metric
+    :param labels: constant labels of this metric
+    """
+    TYPE = "untyped"
+
+    def __init__(self, name: str, help: str,
+                 labels: dict[str, str] | None = None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self._lock = threading.Lock()
+
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        """
+        :return: list of (name, labels, value) samples
+        """
+        raise NotImplementedError
+
+
+
+class Counter(_Metric):
+    """
+    Value that only goes up.
+    """
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str,
+                 labels: dict[str, str] | None = None):
+        super().__init__(name, help, labels)
+        self.value = 0
+
+
+    def inc(self, num: float = 1) -> None:
+        with self._lock:
+            self.value += num
+
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down. If func is given, the value is read from
+    it whenever the metric is rendered.
+
+    :param func: returns the current value
+    """
+    TYPE = "gauge"
+
+    def __init__(self, name: str, help: str,
+                 labels: dict[str, str] | None = None,
+                 func: Callable[[], float] | None = None):
+        super().__init__(name, help, labels)
+        self.value = 0
+        self.func = func
+
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+    def samples(self):
+        value = self.func() if self.func is not None else self.value
+        return [(self.name, self.labels, value)]
+
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets.
+
+    :param buckets: upper bounds of the buckets
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name: str, help: str,
+                 labels: dict[str, str] | None = None,
+                 buckets: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01,
+                                               0.025, 0.05, 0.1, 0.25, 0.5,
+                                               1, 2.5)):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0]*(len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+
+    def samples(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self.sum, self.count
+
+        ret = []
+        cum = 0
+        for bound, num in zip((*self.buckets, "+Inf"), counts):
+            cum += num
+            ret.append((f"{self.name}_bucket", {**self.labels, "le": bound},
+                        cum))
+        ret.append((f"{self.name}_sum", self.labels, total))
+        ret.append((f"{self.name}_count", self.labels, count))
+
+        return ret
+
+
+
+class RateMeter:
+    """
+    Events per second over a sliding time window.
+
+    :param window: length of the window in s
+    """
+    def __init__(self, window: float = 10):
+        self.window = window
+        self._events: deque[tuple[float, int]] = deque()
+        self._lock = threading.Lock()
+
+
+    def mark(self, num: int = 1) -> None:
+        with self._lock:
+            self._events.append((time.monotonic(), num))
+
+
+    def rate(self) -> float:
+        with self._lock:
+            t_min = time.monotonic() - self.window
+            while self._events and self._events[0][0] < t_min:
+                self._events.popleft()
+
+            return sum(num for _, num in self._events)/self.window
+
+
+
+class Registry:
+    """
+    Collection of metrics that can be rendered in the Prometheus text
+    format. A metric with the same name and labels as an already registered
+    one replaces it.
+    """
+    def __init__(self):
+        self._metrics: dict[tuple, _Metric] = {}
+        self._lock = threading.Lock()
+
+
+    def register(self, metric: _Metric) -> _Metric:
+        key = (metric.name, tuple(sorted(metric.labels.items())))
+        with self._lock:
+            self._metrics[key] = metric
+
+        return metric
+
+
+    def unregister(self, metric: _Metric) -> None:
+        key = (metric.name, tuple(sorted(metric.labels.items())))
+        with self._lock:
+            if self._metrics.get(key) is metric:
+                del self._metrics[key]
+
+
+    def render(self) -> str:
+        """
+        :return: all metrics in the Prometheus text format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+
+        lines = []
+        last_name = None
+        for metric in metrics:
+            if metric.name != last_name:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+                last_name = metric.name
+
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+# used when no other registry is given
+REGISTRY = Registry()
+
+
+
+class ComMetrics:
+    """
+    Metrics of a SerialCOM or AsyncSerialCOM.
+
+    :param port: serial port, used as label
+    :param pos_queue: returns the number of queued position chunks
+    :param msg_queue: returns the number of queued msgs
+    :param registry: where to register the metrics
+    """
+    def __init__(self, port: str, pos_queue: Callable[[], int],
+                 msg_queue: Callable[[], int],
+                 registry: Registry | None = None):
+        registry = REGISTRY if registry is None else registry
+        labels = {"port": port}
+        self.rate = RateMeter()
+
+        self.sent = registry.register(Counter(
+            "sandtable_positions_sent_total",
+            "Positions sent to the sand table", labels))
+        self.acked = registry.register(Counter(
+            "sandtable_positions_acked_total",
+            "Positions accepted by the sand table", labels))
+        self.denied = registry.register(Counter(
+            "sandtable_positions_denied_total",
+            "Positions that were sent but not accepted", labels))
+        self.buffer_full = registry.register(Counter(
+            "sandtable_buffer_full_total",
+            "Frames that didn't fit into the buffer of the sand table",
+            labels))
+        self.dropped = registry.register(Counter(
+            "sandtable_positions_dropped_total",
+            "Queued positions that were removed by a clear", labels))
+        self.retransmits = registry.register(Counter(
+            "sandtable_retransmits_total",
+            "Positions that were sent more than once", labels))
+        self.speed_changes = registry.register(Counter(
+            "sandtable_speed_changes_total",
+            "Speeds sent in order with the positions", labels))
+        self.timeouts = registry.register(Counter(
+            "sandtable_timeouts_total",
+            "Responses that timed out", labels))
+        self.connects = registry.register(Counter(
+            "sandtable_connects_total",
+            "Times the serial port was opened and the sand table answered",
+            labels))
+        self.connected = registry.register(Gauge(
+            "sandtable_connected", "1 while the sand table is connected",
+            labels))
+        self.ack_rtt = registry.register(Histogram(
+            "sandtable_ack_rtt_seconds",
+            "Time between sending a msg and receiving its response", labels))
+        self.control_latency = registry.register(Histogram(
+            "sandtable_control_latency_seconds",
+            "Time between queuing a msg like stop and receiving its "
+            "response", labels))
+        registry.register(Gauge(
+            "sandtable_pos_queue_depth",
+            "Chunks of positions waiting to be sent",
+            labels, pos_queue))
+        registry.register(Gauge(
+            "sandtable_msg_queue_depth", "Msgs waiting to be sent",
+            labels, msg_queue))
+        registry.register(Gauge(
+            "sandtable_points_per_second",
+            f"Accepted positions per second over {self.rate.window} s",
+            labels, self.rate.rate))
+
+
+    def positions_acked(self, num: int) -> None:
+        self.acked.inc(num)
+        self.rate.mark(num)
+
+
+
+class WorkerMetrics:
+    """
+    Metrics of a Worker or AsyncWorker.
+
+    :param port: serial port, used as label
+    :param path_queue: returns the number of queued PathMakers
+    :param registry: where to register the metrics
+    """
+    def __init__(self, port: str, path_queue: Callable[[], int],
+                 registry: Registry | None = None):
+        registry = REGISTRY if registry is None else registry
+        labels = {"port": port}
+        self._registry = registry
+        self._labels = labels
+        self._info = None
+
+        registry.register(Gauge(
+            "sandtable_path_queue_depth", "PathMakers waiting to be drawn",
+            labels, path_queue))
+        self.patterns = registry.register(Counter(
+            "sandtable_patterns_done_total",
+            "PathMakers fully added to the position queue", labels))
+        self.points_total = registry.register(Gauge(
+            "sandtable_pattern_points", "Points of the current pattern",
+            labels))
+        self.points_sent = registry.register(Gauge(
+            "sandtable_pattern_points_queued",
+            "Points of the current pattern added to the position queue",
+            labels))
+        registry.register(Gauge(
+            "sandtable_pattern_progress",
+            "Part of the current pattern added to the position queue",
+            labels, self._progress))
+
+
+    def _progress(self) -> float:
+        if not self.points_total.value:
+            return 0
+        return self.points_sent.value/self.points_total.value
+
+
+    def start_pattern(self, name: str, num_points: int | None) -> None:
+        """
+        :param name: name of the pattern, used as label of the info metric
+        :param num_points: number of points of the pattern, None if it is
+            not known, see StreamingPath
+        """
+        if self._info is not None:
+            self._registry.unregister(self._info)
+
+        self._info = self._registry.register(Gauge(
+            "sandtable_pattern_info", "Name of the current pattern",
+            {**self._labels, "pattern": name}))
+        self._info.set(1)
+        self.points_total.set(float("nan") if num_points is None
+                              else num_points)
+        self.points_sent.set(0)
@@ -0,0 +1,286 @@
+import math
+import numpy as np
+
+from .path_maker import PathMaker, _polar_error, _round_positions
+
+
+def _to_polar(x: np.ndarray, y: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :return: tuple of r and unwrapped phi of cartesian points
+    """
+    return np.hypot(x, y), np.unwrap(np.atan2(y, x))
+
+
+
+class ParametricPath(PathMaker):
+    """
+    Base class of the patterns that are given by an analytic curve. Like
+    SpiralAboutCenter, the polar points are calculated directly, there is
+    no svg to parse and nothing to subdivide.
+
+    The curve is evaluated on a dense grid of t and sampled adaptively.
+    Between two positions the sand table moves linearly in r and phi, which
+    deviates from the curve by about |(r'', r*phi'')|*dt^2/8 in mm, so the
+    samples are placed densest where the curve bends the most in polar
+    coordinates and a straight spiral needs only its two ends.
+
+    The sampling from the curvature misses corners, so every segment is
+    then checked against the dense curve with _polar_error and split at its
+    worst point until all of them are within eps.
+
+    Subclasses set t_end and implement _curve().
+
+    :param eps: max deviation of the sand table from the curve in mm
+    :param rot_angle: rotate the path for this angle for the next run in
+        degrees
+    :param num_iterations: repeat the path n times
+    """
+
+    DENSITY = 2048 # dense samples per 2*pi of t
+
+    t_end: float = 2*np.pi # end of the curve parameter, it starts at 0
+
+    def __init__(self, eps: float = 0.5, rot_angle: float = 0,
+                 num_iterations: int = 1):
+        if eps <= 0:
+            raise ValueError("eps must be positive!")
+
+        num = max(int(self.DENSITY*self.t_end/(2*np.pi)), 2) + 1
+        self._dt = self.t_end/(num - 1)
+        r, phi = self._curve(np.linspace(0, self.t_end, num))
+
+        if np.any(r < 0):
+            raise ValueError("The curve has a negative radius")
+
+        # the dense curve as polar points, they are sampled in _get_new_pts
+        super().__init__(np.column_stack((r, phi)), eps=eps,
+                         rot_angle=rot_angle, num_iterations=num_iterations)
+
+
+    def _curve(self, t: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :param t: curve parameter from 0 to t_end
+
+        :return: tuple of r in mm and continuous phi in radians
+        """
+        raise NotImplementedError
+
+
+    def _get_new_pts(self):
+        """
+        Sample the dense curve so the deviation stays within eps.
+        """
+        r, phi = self.pts[:, 0], self.pts[:, 1]
+        d2r = np.gradient(np.gradient(r, self._dt), self._dt)
+        d2phi = np.gradient(np.gradient(phi, self._dt), self._dt)
+
+        # samples per unit of t that keep the deviation at eps
+        density = np.sqrt(np.hypot(d2r, r*d2phi)/(8*self.eps))
+        count = np.concatenate((
+            [0], np.cumsum((density[1:] + density[:-1])/2*self._dt)))
+
+        # a sample wherever the count passes the next integer
+        idx = np.flatnonzero(np.diff(np.floor(count)) > 0) + 1
+        keep = np.zeros(r.shape[0], dtype=bool)
+        keep[idx] = True
+        keep[[0, -1]] = True
+
+        x, y = r*np.cos(phi), r*np.sin(phi)
+        k = np.arange(r.shape[0])
+        while True:
+            idx = np.flatnonzero(keep)
+            # segment of every dense point, the last one has none
+            seg = np.searchsorted(idx, k[:-1], side="right") - 1
+            err = _polar_error(r, phi, x, y, idx[seg], idx[seg+1], k[:-1])
+
+            worst = np.maximum.reduceat(err, idx[:-1])
+            bad = np.flatnonzero(worst > self.eps)
+            if not bad.size:
+                break
+
+            hit = np.flatnonzero((err == worst[seg]) & np.isin(seg, bad))
+            keep[hit] = True
+
+        self.pts_polar = self.pts[keep]
+
+
+    def _calc_positions(self):
+        """
+        Based on self.pts_polar the required positions in steps are
+        calculated, see _round_positions.
+        """
+        self.positions = _round_positions(self.pts_polar)
+
+        self._pts_size = self.positions.shape[0]
+        self._current_idx = 0
+
+
+    def __repr__(self):
+        return f"{type(self).__name__} object:\n" \
+                f"- {self._pts_size} calculated points\n" \
+                f"- {self.num_iterations} iterations\n"
+
+
+
+class Rose(ParametricPath):
+    """
+    Rose curve r = radius*|cos(n/d*t)|. The negative radii of the classic
+    rose are mirrored, so it has 2*n petals for d = 1 and overlapping
+    petals for d > 1.
+
+    :param radius: outer radius in mm
+    :param n, d: numerator and denominator of the angular frequency
+    :param r0: inner radius in mm, the petals start there instead of at
+        the center
+    """
+    def __init__(self, radius: float = 200, n: int = 3, d: int = 1,
+                 r0: float = 0, **kwargs):
+        if n < 1 or d < 1:
+            raise ValueError("n and d must be positive!")
+
+        self.radius = radius
+        self.k = n/d
+        self.r0 = r0
+        self.t_end = 2*np.pi*d
+        super().__init__(**kwargs)
+
+
+    def _curve(self, t):
+        r = self.r0 + (self.radius - self.r0)*np.abs(np.cos(self.k*t))
+
+        return r, t
+
+
+
+class Spirograph(ParametricPath):
+    """
+    Hypotrochoid of a gear rolling inside a fixed ring, scaled to the
+    radius. The curve closes after rolling/gcd(fixed, rolling) turns.
+
+    :param radius: outer radius in mm
+    :param fixed: teeth of the fixed ring
+    :param rolling: teeth of the rolling gear, less than fixed
+    :param pen: distance of the pen from the center of the rolling gear
+        relative to its radius
+    """
+    def __init__(self, radius: float = 200, fixed: int = 96,
+                 rolling: int = 35, pen: float = 0.8, **kwargs):
+        if not 0 < rolling < fixed:
+            raise ValueError("The rolling gear must be smaller than the "
+                             "fixed ring!")
+
+        self.radius = radius
+        self.fixed = fixed
+        self.rolling = rolling
+        self.pen = pen
+        self.t_end = 2*np.pi*rolling/math.gcd(fixed, rolling)
+        super().__init__(**kwargs)
+
+
+    def _curve(self, t):
+        R, r, d = self.fixed, self.rolling, self.pen*self.rolling
+        scale = self.radius/(R - r + d)
+
+        x = (R - r)*np.cos(t) + d*np.cos((R - r)/r*t)
+        y = (R - r)*np.sin(t) - d*np.sin((R - r)/r*t)
+
+        return _to_polar(x*scale, y*scale)
+
+
+
+class Lissajous(ParametricPath):
+    """
+    Lissajous curve x = sin(a*t + phase), y = sin(b*t) that fits into the
+    radius.
+
+    :param radius: outer radius in mm
+    :param a, b: frequencies of x and y
+    :param phase: phase of x in degrees
+    """
+    def __init__(self, radius: float = 200, a: int = 3, b: int = 4,
+                 phase: float = 90, **kwargs):
+        if a < 1 or b < 1:
+            raise ValueError("a and b must be positive!")
+
+        self.radius = radius
+        self.a = a
+        self.b = b
+        self.phase = phase*np.pi/180
+        super().__init__(**kwargs)
+
+
+    def _curve(self, t):
+        amp = self.radius/np.sqrt(2)
+        x = amp*np.sin(self.a*t + self.phase)
+        y = amp*np.sin(self.b*t)
+
+        return _to_polar(x, y)
+
+
+
+class StarSpiral(ParametricPath):
+    """
+    Spiral of stars with sharp tips that grow from r0 to r1.
+
+    :param r0: radius of the first star tips in mm
+    :param r1: radius of the last star tips in mm
+    :param points: tips of each star
+    :param depth: depth of the notches between the tips relative to the
+        radius of the tips
+    :param turns: number of stars
+    """
+    def __init__(self, r0: float = 20, r1: float = 200, points: int = 5,
+                 depth: float = 0.4, turns: int = 20, **kwargs):
+        if not 0 <= depth < 1:
+            raise ValueError("depth must be in [0, 1)!")
+
+        self.r0 = r0
+        self.r1 = r1
+        self.points = points
+        self.depth = depth
+        self.t_end = 2*np.pi*turns
+        super().__init__(**kwargs)
+
+
+    def _curve(self, t):
+        base = self.r0 + (self.r1 - self.r0)*t/self.t_end
+        # triangle wave, 0 at the tips and 1 between them
+        notch = 1 - 2*np.abs((self.points*t/(2*np.pi)) % 1 - 0.5)
+
+        return base*(1 - self.depth*notch), t
+
+
+
+class ModulatedSpiral(ParametricPath):
+    """
+    Archimedean or Fermat spiral with a sine wave on the radius.
+
+    :param r0: start radius in mm
+    :param r1: end radius in mm
+    :param turns: number of revolutions
+    :param fermat: grow with the square root of the angle, so the grooves
+        get denser outwards, instead of linearly
+    :param amplitude: amplitude of the wave in mm
+    :param waves: number of waves per revolution
+    """
+    def __init__(self, r0: float = 0, r1: float = 200, turns: int = 20,
+                 fermat: bool = False, amplitude: float = 0,
+                 waves: float = 0, **kwargs):
+        self.r0 = r0
+        self.r1 = r1
+        self.fermat = fermat
+        self.amplitude = amplitude
+        self.waves = waves
+        self.t_end = 2*np.pi*turns
+        super().__init__(**kwargs)
+
+
+    def _curve(self, t):
+        s = t/self.t_end
+        if self.fermat:
+            s = np.sqrt(s)
+
+        r = self.r0 + (self.r1 - self.r0)*s \
+            + self.amplitude*np.sin(self.waves*t)
+
+        return r, t
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import shutil
+import threading
+import numpy as np
+
+from .load_svg import PARSER_VERSION, get_pts_from_svg
+from .path_maker import PathMaker
+
+
+class PathCache:
+    """
+    On disk cache of compiled PathMaker arrays. Every entry is a directory
+    with one .npy file per array so a repeated load is just a memory map of
+    the stored arrays instead of parsing and compiling the svg again.
+
+    Entries are keyed by the svg content, eps, the versions of the svg
+    parser and of the cache and the step constants of PathMaker. When the
+    cache grows over max_bytes the least recently used entries are
+    removed.
+
+    Available methods:
+    - get_key() -> key of an svg file and compile parameters
+    - has() -> whether a key is cached
+    - load() -> load cached arrays or None
+    - store() -> store the arrays of a PathMaker
+    - get_path_maker() -> load or compile a PathMaker for an svg file
+
+    :param directory: where to store the cached entries
+    :param max_bytes: max size of all entries together in bytes
+    """
+
+    ARRAYS = ("pts", "pts_polar", "positions")
+    # increase when the loading or compiling changes the output, the path
+    # parser has its own PARSER_VERSION
+    VERSION = 3
+
+    def __init__(self, directory: str, max_bytes: int = 256*2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    @staticmethod
+    def get_key(svg: bytes, eps: float | None,
+                tol: float | None = None) -> str:
+        """
+        Calculate the cache key.
+
+        :param svg: content of the svg file
+        :param eps: desired accuracy the path is compiled with
+        :param tol: tolerance the path is simplified with
+
+        :return: hex digest of the key
+        """
+        h = hashlib.sha256(svg)
+        h.update(f"|{PathCache.VERSION}|{PARSER_VERSION}|{eps!r}|{tol!r}"
+                 f"|{PathMaker.RADIUS_STEPS_MM!r}"
+                 f"|{PathMaker.ANGLE_STEPS_RAD!r}".encode())
+
+        return h.hexdigest()
+
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+
+    def has(self, key: str) -> bool:
+        """
+        :param key: cache key
+
+        :return: True if the entry is stored, it can still be evicted
+            before it is loaded
+        """
+        return os.path.isdir(self._entry_dir(key))
+
+
+    def load(self, key: str) -> dict[str, np.ndarray] | None:
+        """
+        Load the cached arrays as read only memory maps.
+
+        :param key: cache key
+
+        :return: dict with pts, pts_polar and positions or None if the key
+            is not cached
+        """
+        path = self._entry_dir(key)
+
+        try:
+            ret = {name: np.load(os.path.join(path, f"{name}.npy"),
+                                 mmap_mode="r")
+                   for name in self.ARRAYS}
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # mark as recently used
+        os.utime(path)
+        return ret
+
+
+    def store(self, key: str, pm: PathMaker) -> None:
+        """
+        Store the compiled arrays of a PathMaker and evict old entries if
+        the cache is too big.
+
+        :param key: cache key
+        :param pm: compiled PathMaker
+        """
+        path = self._entry_dir(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, "pts.npy"),
+                np.asarray(pm.pts, dtype=np.float64))
+        np.save(os.path.join(tmp_path, "pts_polar.npy"),
+                np.asarray(pm.pts_polar, dtype=np.float64))
+        np.save(os.path.join(tmp_path, "positions.npy"),
+                np.asarray(pm.positions, dtype=np.int32))
+
+        with self._lock:
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                # an other process already stored the same entry
+                shutil.rmtree(tmp_path, ignore_errors=True)
+
+            self._evict(keep=key)
+
+
+    def _evict(self, keep: str | None = None) -> None:
+        """
+        Remove the least recently used entries until the cache fits into
+        max_bytes.
+
+        :param keep: key that must not be removed
+        """
+        entries = []
+        total = 0
+
+        for name in os.listdir(self.directory):
+            path = self._entry_dir(name)
+            if name.endswith(".tmp") or not os.path.isdir(path):
+                continue
+
+            size = sum(f.stat().st_size for f in os.scandir(path))
+            entries.append((os.stat(path).st_mtime, size, name))
+            total += size
+
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+            total -= size
+
+
+    def get_path_maker(self, filename: str, eps: float | None = 1,
+                       rot_angle: float = 5,
+                       num_iterations: int = 1,
+                       tol: float | None = None) -> PathMaker:
+        """
+        Get a PathMaker for the svg file. If the file was already compiled
+        with the same parameters, the arrays are loaded from the cache.
+
+        :param filename: path to svg file
+        :param eps: desired accuracy of the output trajectory
+        :param rot_angle: rotate the path for this angle for the next run in
+            degrees
+        :param num_iterations: repeat the input path n times
+        :param tol: simplification tolerance in mm, see PathMaker
+
+        :return: PathMaker instance
+        """
+        with open(filename, "rb") as f:
+            key = self.get_key(f.read(), eps, tol)
+
+        arrays = self.load(key)
+        if arrays is not None:
+            return PathMaker.from_compiled(**arrays, eps=eps,
+                                           rot_angle=rot_angle,
+                                           num_iterations=num_iterations,
+                                           tol=tol)
+
+        pts = np.array(get_pts_from_svg(filename))
+        pm = PathMaker(pts, eps=eps, rot_angle=rot_angle,
+                       num_iterations=num_iterations, tol=tol)
+        self.store(key, pm)
+
+        return pm
@@ -1,3 +1,4 @@
+from typing import Iterator
 import numpy as np
 
 
@@ -6,7 +7,8 @@ def _calc_triag(pt0: tuple, pt1: tuple, pt2: tuple) -> float:
     Triangle area based on points.
     https://en.wikipedia.org/wiki/Area_of_a_triangle
 
-    :param pt: tuple of position
+    :param pt: tuple of position. Coordinates may also be arrays, in which
+        case the areas are calculated element wise.
 
     :return: area of triangle
     """
@@ -15,7 +17,7 @@ def _calc_triag(pt0: tuple, pt1: tuple, pt2: tuple) -> float:
     xb, yb = pt1
     xc, yc = pt2
 
-    return 0.5*abs((xa-xc)*(yb-ya) - (xa-xb)*(yc-ya))
+    return 0.5*np.abs((xa-xc)*(yb-ya) - (xa-xb)*(yc-ya))
 
 
 
@@ -72,6 +74,200 @@ def _calc_trajectory(pt0, pt1, eps: float = 5) -> list[list[float]]:
 
 
 
+def _segment_error(p0: np.ndarray, p1: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of the accuracy check in _calc_trajectory.
+
+    :param p0: start points of the segments as np.array([N, 2])
+    :param p1: end points of the segments as np.array([N, 2])
+
+    :return: triangle area for every segment as np.array([N])
+    """
+    x0, y0 = p0[:, 0], p0[:, 1]
+    x1, y1 = p1[:, 0], p1[:, 1]
+    r0, phi0 = np.sqrt(x0**2+y0**2), np.atan2(y0, x0)
+    r1, phi1 = np.sqrt(x1**2+y1**2), np.atan2(y1, x1)
+
+    r01 = (r0+r1)/2
+    phi01 = _average_angle(phi0, phi1)
+    x01p, y01p = r01*np.cos(phi01), r01*np.sin(phi01)
+
+    return _calc_triag((x0, y0), (x01p, y01p), (x1, y1))
+
+
+
+def _subdivide(pts: np.ndarray, eps: float = 5) -> np.ndarray:
+    """
+    Non recursive equivalent of calling _calc_trajectory on every segment
+    of the input path. All segments are processed at once and in each round
+    only the segments that still exceed eps are split in half.
+
+    :param pts: input points as np.array([N, 2])
+    :param eps: desired accuracy, see _calc_trajectory
+
+    :return: positions as np.array([M, 2])
+    """
+    pts = np.asarray(pts, dtype=np.float64)
+    if pts.shape[0] < 2:
+        return pts.copy()
+
+    p0 = pts[:-1]
+    p1 = pts[1:]
+    active = np.ones(p0.shape[0], dtype=bool)
+
+    while True:
+        idx = np.flatnonzero(active)
+        split = np.zeros(p0.shape[0], dtype=bool)
+        split[idx[_segment_error(p0[idx], p1[idx]) > eps]] = True
+
+        if not split.any():
+            break
+
+        # every split segment is replaced by two children in place, so the
+        # ordering of the segments along the path is kept
+        counts = split.astype(np.intp) + 1
+        first = (np.cumsum(counts) - counts)[split]
+        mid = (p0[split] + p1[split])/2
+
+        p0 = np.repeat(p0, counts, axis=0)
+        p1 = np.repeat(p1, counts, axis=0)
+        p1[first] = mid
+        p0[first+1] = mid
+
+        active = np.zeros(p0.shape[0], dtype=bool)
+        active[first] = True
+        active[first+1] = True
+
+    # each final segment contributes its start and middle point
+    ret = np.empty((2*p0.shape[0]+1, 2))
+    ret[0:-1:2] = p0
+    ret[1:-1:2] = (p0 + p1)/2
+    ret[-1] = p1[-1]
+
+    return ret
+
+
+
+def _polar_error(r: np.ndarray, phi: np.ndarray, x: np.ndarray,
+                 y: np.ndarray, a: np.ndarray, b: np.ndarray,
+                 k: np.ndarray) -> np.ndarray:
+    """
+    Deviation of points from the trajectory the sand table drives between
+    two other points. MultiStepper moves r and phi linearly in step space,
+    so the trajectory is a spiral segment and not a straight line. Each
+    point is compared to the trajectory point that is closest in step
+    space, which is never closer than the true distance.
+
+    :param r, phi: polar coordinates of all points, phi unwrapped
+    :param x, y: cartesian coordinates of all points
+    :param a: indices of the trajectory start points
+    :param b: indices of the trajectory end points
+    :param k: indices of the checked points
+
+    :return: deviation in mm as np.array([len(k)])
+    """
+    sr, sp = PathMaker.RADIUS_STEPS_MM, PathMaker.ANGLE_STEPS_RAD
+    dr = r[b] - r[a]
+    dphi = phi[b] - phi[a]
+
+    num = (r[k] - r[a])*dr*sr**2 + (phi[k] - phi[a])*dphi*sp**2
+    den = dr**2*sr**2 + dphi**2*sp**2
+    t = np.divide(num, den, out=np.zeros_like(num), where=den > 0)
+    t = np.clip(t, 0, 1)
+
+    rt = r[a] + t*dr
+    phit = phi[a] + t*dphi
+
+    return np.hypot(rt*np.cos(phit) - x[k], rt*np.sin(phit) - y[k])
+
+
+
+def _round_positions(pts_polar: np.ndarray) -> np.ndarray:
+    """
+    Convert polar points to positions in steps. Phi is rounded before the
+    difference so the rounding errors don't add up.
+
+    :param pts_polar: points as np.array([N, 2]) of r in mm and unwrapped
+        phi in radians
+
+    :return: positions as int32 np.array([N, 2]) of absolute r and
+        relative phi
+    """
+    steps = np.round(pts_polar*[PathMaker.RADIUS_STEPS_MM,
+                                PathMaker.ANGLE_STEPS_RAD])
+
+    positions = np.zeros_like(steps)
+    positions[:, 0] = steps[:, 0]
+    positions[1:, 1] = np.diff(steps[:, 1])
+
+    return positions.astype(np.int32)
+
+
+
+def _simplify(pts: np.ndarray, tol: float) -> np.ndarray:
+    """
+    Vectorized Ramer-Douglas-Peucker simplification for the sand table.
+    Points are removed as long as the trajectory the table drives between
+    the remaining points stays within tol of the input path, see
+    _polar_error. The input path is checked at every point and at the
+    middle of every line. Two remaining points are always less than pi
+    apart in phi, otherwise unwrapping phi of the remaining points would
+    lose or reverse the rotation between them.
+
+    :param pts: input points as np.array([N, 2]) in mm
+    :param tol: max allowed deviation in mm
+
+    :return: mask of the points to keep as np.array([N])
+    """
+    n = pts.shape[0]
+    if n < 3:
+        return np.ones(n, dtype=bool)
+
+    # check points, the input points are at the even indices
+    q = np.empty((2*n - 1, 2))
+    q[0::2] = pts
+    q[1::2] = (pts[:-1] + pts[1:])/2
+    x, y = q[:, 0], q[:, 1]
+    r = np.hypot(x, y)
+    phi = np.unwrap(np.atan2(y, x))
+
+    keep = np.zeros(q.shape[0], dtype=bool)
+    keep[[0, -1]] = True
+    a = np.array([0])
+    b = np.array([q.shape[0] - 1])
+
+    # all segments are processed at once and split at their worst input
+    # point until every one of them is within tol
+    while a.size:
+        num = b - a - 1
+        first = np.cumsum(num) - num
+        seg = np.repeat(np.arange(a.size), num)
+        k = np.arange(seg.size) - first[seg] + a[seg] + 1
+
+        err = _polar_error(r, phi, x, y, a[seg], b[seg], k)
+        over = np.maximum.reduceat(err, first) > tol
+        split = over | (np.abs(phi[b] - phi[a]) >= np.pi)
+        # a segment between two neighbouring input points can't be split
+        split &= num > 1
+
+        err[k % 2 == 1] = -1
+        best = np.maximum.reduceat(err, first)
+        hit = np.flatnonzero(split[seg] & (err == best[seg]))
+        seg_hit, idx = np.unique(seg[hit], return_index=True)
+        mid = k[hit[idx]]
+        # a segment that is only split because of phi is split at its
+        # middle input point
+        turn = ~over[seg_hit]
+        mid[turn] = a[seg_hit[turn]] + (b - a)[seg_hit[turn]]//4*2
+
+        keep[mid] = True
+        a = np.concatenate((a[seg_hit], mid))
+        b = np.concatenate((mid, b[seg_hit]))
+
+    return keep[0::2]
+
+
+
 class PathMaker:
     """
     A Generator class that holds the trajectory points. Once instantiated
@@ -93,16 +289,27 @@ class PathMaker:
         degrees
     :param num_iterations: Repeat the input path n times. When the end is
         reached the generator will yield a None value.
+    :param tol: remove points as long as the path of the sand table stays
+        within tol in mm of the calculated trajectory. If None, all points
+        are kept. The removed part of the points is stored in reduction.
     """
 
     RADIUS_LIMIT_MM = 251 # max allowed r distance in mm
     RADIUS_STEPS_MM = 81.82 # steps per mm for the radial position
     ANGLE_STEPS_RAD = 4169.86 # steps per radian of rotation
+    INIT_SPEED = 800 # steps per second of the motors after homing
+
+    name: str | None = None # name of the pattern used in logs and metrics
+    reduction: float | None = None # part of the points removed by tol
+    # engine, name and params to compile the path again, see Journal
+    source: dict | None = None
 
     def __init__(self, pts: np.ndarray, eps: float = None, 
-                 rot_angle: float = 5, num_iterations: int = 1):
+                 rot_angle: float = 5, num_iterations: int = 1,
+                 tol: float = None):
         self.pts = pts
         self.eps = eps
+        self.tol = tol
         # convert angle in degree to radians and then to number of steps
         self.rot_steps = int(rot_angle*np.pi/180*self.ANGLE_STEPS_RAD)
         self.num_iterations = num_iterations
@@ -114,7 +321,43 @@ class PathMaker:
         
         self._get_new_pts()
         self._calc_positions()
-    
+
+
+    @classmethod
+    def from_compiled(cls, pts: np.ndarray, pts_polar: np.ndarray,
+                      positions: np.ndarray, eps: float = None,
+                      rot_angle: float = 5, num_iterations: int = 1,
+                      tol: float = None):
+        """
+        Create an instance from already calculated points and skip the
+        trajectory calculation. Used when loading a path from PathCache.
+
+        :param pts: input points as np.array([N,2]) in mm
+        :param pts_polar: calculated points in polar CS
+        :param positions: calculated positions in steps as int32
+        :param eps: accuracy the points were calculated with
+        :param rot_angle: rotate the path for this angle for the next run in
+            degrees
+        :param num_iterations: repeat the input path n times
+        :param tol: tolerance the points were simplified with
+
+        :return: PathMaker instance
+        """
+        obj = cls.__new__(cls)
+        obj.pts = pts
+        obj.eps = eps
+        obj.tol = tol
+        obj.rot_steps = int(rot_angle*np.pi/180*cls.ANGLE_STEPS_RAD)
+        obj.num_iterations = num_iterations
+        obj._iter_counter = 0
+
+        obj.pts_polar = pts_polar
+        obj.positions = positions
+        obj._pts_size = positions.shape[0]
+        obj._current_idx = 0
+
+        return obj
+
 
     def _get_new_pts(self) -> None:
         """
@@ -123,18 +366,16 @@ class PathMaker:
         if self.eps is None:
             calc_pts = self.pts
         elif isinstance(self.eps, (float, int)):
-            for i in range(self.pts.shape[0]-1):
-                ret = _calc_trajectory(self.pts[i], self.pts[i+1], self.eps)
-                ret = np.array(ret)
-
-                if i == 0:
-                    calc_pts = ret
-                else:
-                    calc_pts = np.vstack((calc_pts, ret[1:]))
+            calc_pts = _subdivide(self.pts, self.eps)
         else:
             raise TypeError(f"eps can only be of type int, float or None" \
                             f" and not {type(self.eps)}")
 
+        if self.tol is not None:
+            keep = _simplify(calc_pts, self.tol)
+            self.reduction = 1 - np.count_nonzero(keep)/keep.shape[0]
+            calc_pts = calc_pts[keep]
+
         r = np.sqrt(calc_pts[:,0]**2 + calc_pts[:,1]**2)
         phi = np.atan2(calc_pts[:,1], calc_pts[:,0]).T
 
@@ -175,12 +416,107 @@ class PathMaker:
 
     def __iter__(self):
         return self
+
+
+    def __len__(self) -> int:
+        """
+        Number of points over all iterations including the rotations
+        between them.
+        """
+        return self._pts_size*self.num_iterations + self.num_iterations - 1
     
 
+    def encode(self) -> bytes:
+        """
+        Encode all points of all iterations at once, including the rotation
+        points between the iterations, as payload for
+        SerialCOM.send_packets. Every point is [r, phi] as big endian int32,
+        the same as encode_pos. The state of the iterator is ignored.
+
+        :return: encoded points in one contiguous buffer
+        """
+        block = np.empty((self._pts_size + 1, 2), dtype=">i4")
+        block[:-1] = self.positions
+        block[-1] = self.positions[0, 0], self.rot_steps
+
+        # the last iteration ends without a rotation
+        return np.tile(block, (self.num_iterations, 1))[:-1].tobytes()
+
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        """
+        Encoded points in chunks as they are sent by the workers. The path
+        is already compiled, so it is a single chunk of encode(), see
+        StreamingPath for a path that is compiled while it is sent.
+
+        :return: generator of positions as big endian int32
+            np.array([N, 2])
+        """
+        yield np.frombuffer(self.encode(), dtype=">i4").reshape(-1, 2)
+
+
+    def start_point(self) -> tuple[float, float]:
+        """
+        :return: tuple of r in mm and phi in radians of the first point,
+            which is where the path starts, see TransitionSpiral.between
+        """
+        return self.positions[0, 0]/self.RADIUS_STEPS_MM, \
+            float(self.pts_polar[0, 1])
+
+
+    @property
+    def total(self) -> int | None:
+        """
+        Number of points over all iterations, see __len__. None if it is
+        not known yet.
+        """
+        return len(self)
+
+
+    @property
+    def iteration_size(self) -> int | None:
+        """
+        Number of points of one iteration. None if it is not known yet.
+        """
+        return self._pts_size
+
+
+    def estimate_time(self, speed: float = INIT_SPEED) -> float:
+        """
+        Estimate how long the sand table needs to draw the path. MultiStepper
+        moves both motors at constant speed, so that they arrive at the same
+        time and the one with the longer move runs at max speed. Every move
+        therefore takes max(|dr|, |dphi|)/speed. Acceleration and the
+        transfer time of the positions are neglected.
+
+        :param speed: max speed of the motors in steps per second, see
+            SerialCOM.update_speed
+
+        :return: drawing time in s without the move to the first point
+        """
+        if speed <= 0:
+            raise ValueError(f"Speed must be positive and not {speed}!")
+
+        # int64 so the sums can't overflow
+        pos = self.positions.astype(np.int64)
+        # r is absolute and phi is relative
+        steps = np.maximum(np.abs(np.diff(pos[:, 0])),
+                           np.abs(pos[1:, 1])).sum() + abs(pos[0, 1])
+        # between the iterations r returns to the first point while phi
+        # rotates, after that the first point is reached again
+        rot = max(abs(int(pos[0, 0] - pos[-1, 0])), abs(self.rot_steps))
+
+        total = steps*self.num_iterations + rot*(self.num_iterations - 1)
+
+        return float(total/speed)
+
+
     def __repr__(self):
         return f"PathMaker object:\n- {self.pts.shape[0]} initial points\n" \
                 f"- {self._pts_size} calculated points\n" \
-                f"- {self.num_iterations} iterations\n"
+                f"- {self.num_iterations} iterations\n" + \
+                (f"- {self.reduction:.1%} removed by tol\n"
+                 if self.reduction is not None else "")
     
 
 
@@ -288,4 +624,91 @@ class SpiralAboutCenter(PathMaker):
     def __repr__(self):
         return f"SpiralAboutCenter object:\n- r0 -> {self.pts[0,0]}\n" \
                 f"- r1 -> {self.pts[1,0]}\n" \
-                f"- {self.num_revolutions} of revolutions"
\ No newline at end of file
+                f"- {self.num_revolutions} of revolutions"
+
+
+class TransitionSpiral(PathMaker):
+    """
+    Erase spiral from the current position of the sand table to the start
+    of the next pattern. Between two positions MultiStepper moves r and phi
+    linearly, which is exactly an Archimedean spiral, so the spiral is
+    calculated directly in steps with one position per revolution.
+
+    The spiral turns in the direction that reaches the start angle of the
+    next pattern with the smallest total rotation while its pitch stays
+    below the ball diameter times PITCH_FACTOR.
+
+    :param r0, phi0: current position in mm and radians
+    :param r1, phi1: start of the next pattern in mm and radians
+    :param ball_diameter: diameter of the ball in mm
+    """
+
+    PITCH_FACTOR = 0.8 # neighbouring grooves overlap a bit
+
+    def __init__(self, r0: float, phi0: float, r1: float, phi1: float,
+                 ball_diameter: float = 10):
+        if ball_diameter <= 0:
+            raise ValueError("Ball diameter must be positive!")
+
+        pts = np.array([
+            [r0, r1],
+            [phi0, phi1]
+        ]).T
+        self.ball_diameter = ball_diameter
+        super().__init__(pts, eps=None, rot_angle=0, num_iterations=1)
+
+
+    @classmethod
+    def between(cls, pos: list[int], pm: PathMaker,
+                ball_diameter: float = 10):
+        """
+        Create the spiral from a position in steps to the start of a
+        PathMaker.
+
+        :param pos: current [r, phi] position in steps, phi is the sum of
+            all sent phi steps
+        :param pm: next pattern
+        :param ball_diameter: diameter of the ball in mm
+
+        :return: TransitionSpiral instance
+        """
+        return cls(pos[0]/cls.RADIUS_STEPS_MM, pos[1]/cls.ANGLE_STEPS_RAD,
+                   *pm.start_point(), ball_diameter)
+
+
+    def _get_new_pts(self):
+        """
+        Calculate the total rotation and one point per revolution.
+        """
+        (r0, phi0), (r1, phi1) = self.pts
+        full = 2*np.pi
+        min_angle = full*abs(r1 - r0)/(self.ball_diameter*self.PITCH_FACTOR)
+
+        # remaining angle to the start in [-pi, pi) and the smallest full
+        # rotations in both directions to keep the pitch
+        d = (phi1 - phi0 + np.pi) % full - np.pi
+        angle_pos = d + full*np.ceil((min_angle - d)/full)
+        angle_neg = d - full*np.ceil((min_angle + d)/full)
+        angle = angle_pos if angle_pos <= -angle_neg else angle_neg
+
+        num = max(1, int(np.ceil(abs(angle)/full)))
+        t = np.linspace(0, 1, num + 1)
+
+        self.pts_polar = np.vstack((r0 + t*(r1 - r0), phi0 + t*angle)).T
+
+
+    def _calc_positions(self):
+        """
+        Based on self.pts_polar the required positions in steps are
+        calculated, see _round_positions.
+        """
+        self.positions = _round_positions(self.pts_polar)
+
+        self._pts_size = self.positions.shape[0]
+        self._current_idx = 0
+
+
+    def __repr__(self):
+        return f"TransitionSpiral object:\n- r -> {self.pts[0,0]:.1f} to " \
+                f"{self.pts[1,0]:.1f}\n" \
+                f"- {self._pts_size - 1} revolutions"
@@ -0,0 +1,168 @@
+import numpy as np
+
+from .path_maker import PathMaker
+
+
+def _to_steps(pts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convert points in mm to r and phi in steps.
+
+    :param pts: points as np.array([N, 2])
+
+    :return: tuple of r and phi in steps, both as np.array([N])
+    """
+    r = np.hypot(pts[:, 0], pts[:, 1])*PathMaker.RADIUS_STEPS_MM
+    phi = np.atan2(pts[:, 1], pts[:, 0])*PathMaker.ANGLE_STEPS_RAD
+
+    return r, phi
+
+
+def travel_cost(r0: np.ndarray, phi0: np.ndarray, r1: np.ndarray,
+                phi1: np.ndarray) -> np.ndarray:
+    """
+    Cost of a straight move between two points in polar step space. Both
+    motors arrive at the same time, so the move takes as long as the longer
+    of the two axes, see PathMaker.estimate_time. Phi takes the shorter way
+    around the center.
+
+    :param r0, phi0: start points in steps
+    :param r1, phi1: end points in steps
+
+    :return: cost in steps, element wise for arrays
+    """
+    full = 2*np.pi*PathMaker.ANGLE_STEPS_RAD
+    dphi = np.abs(phi1 - phi0) % full
+
+    return np.maximum(np.abs(r1 - r0), np.minimum(dphi, full - dphi))
+
+
+def _nearest_neighbour(start: tuple[np.ndarray, np.ndarray],
+                       end: tuple[np.ndarray, np.ndarray]
+                       ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Greedy tour that always continues with the closest free end of a
+    polyline. The first polyline is kept as the start in its direction.
+
+    :param start: r and phi of the first point of every polyline
+    :param end: r and phi of the last point of every polyline
+
+    :return: tuple of the order and of the reversed flag of each position
+    """
+    num = start[0].shape[0]
+    free = np.ones(num, dtype=bool)
+    free[0] = False
+    order = np.zeros(num, dtype=np.intp)
+    rev = np.zeros(num, dtype=bool)
+    cur = end[0][0], end[1][0]
+
+    for i in range(1, num):
+        idx = np.flatnonzero(free)
+        c_fwd = travel_cost(*cur, start[0][idx], start[1][idx])
+        c_rev = travel_cost(*cur, end[0][idx], end[1][idx])
+
+        k_fwd = np.argmin(c_fwd)
+        k_rev = np.argmin(c_rev)
+        if c_rev[k_rev] < c_fwd[k_fwd]:
+            k, rev[i] = idx[k_rev], True
+            cur = start[0][k], start[1][k]
+        else:
+            k = idx[k_fwd]
+            cur = end[0][k], end[1][k]
+
+        order[i] = k
+        free[k] = False
+
+    return order, rev
+
+
+def _two_opt(start: tuple[np.ndarray, np.ndarray],
+             end: tuple[np.ndarray, np.ndarray], order: np.ndarray,
+             rev: np.ndarray, max_passes: int
+             ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Improve the tour by reversing parts of it. Reversing the polylines i to
+    j also flips the direction of every one of them, so only the moves
+    into i and out of j change, the moves in between keep their cost.
+
+    :param start: r and phi of the first point of every polyline
+    :param end: r and phi of the last point of every polyline
+    :param order: order of the polylines
+    :param rev: reversed flag of each position
+    :param max_passes: max number of passes over the whole tour
+
+    :return: tuple of the improved order and reversed flags
+    """
+    num = order.shape[0]
+    order = order.copy()
+    rev = rev.copy()
+
+    def ends():
+        # points where each polyline of the tour is entered and left
+        r_in = np.where(rev, end[0][order], start[0][order])
+        phi_in = np.where(rev, end[1][order], start[1][order])
+        r_out = np.where(rev, start[0][order], end[0][order])
+        phi_out = np.where(rev, start[1][order], end[1][order])
+
+        return r_in, phi_in, r_out, phi_out
+
+    for _ in range(max_passes):
+        improved = False
+        r_in, phi_in, r_out, phi_out = ends()
+
+        for i in range(1, num):
+            j = np.arange(i, num)
+            old = travel_cost(r_out[i-1], phi_out[i-1], r_in[i], phi_in[i])
+            new = travel_cost(r_out[i-1], phi_out[i-1], r_out[j], phi_out[j])
+
+            # the move out of j into j+1 doesn't exist for the last one
+            nxt = np.minimum(j + 1, num - 1)
+            has_next = j + 1 < num
+            old = old + np.where(has_next, travel_cost(
+                r_out[j], phi_out[j], r_in[nxt], phi_in[nxt]), 0)
+            new = new + np.where(has_next, travel_cost(
+                r_in[i], phi_in[i], r_in[nxt], phi_in[nxt]), 0)
+
+            gain = old - new
+            k = np.argmax(gain)
+            if gain[k] > 1e-9:
+                j = j[k]
+                order[i:j+1] = order[i:j+1][::-1]
+                rev[i:j+1] = ~rev[i:j+1][::-1]
+                r_in, phi_in, r_out, phi_out = ends()
+                improved = True
+
+        if not improved:
+            break
+
+    return order, rev
+
+
+def order_polylines(polylines: list[np.ndarray],
+                    max_passes: int = 5) -> list[np.ndarray]:
+    """
+    Order the polylines and choose their directions so that the moves
+    between them are as short as possible on the sand table. The moves are
+    measured in polar step space, see travel_cost. A nearest neighbour tour
+    is improved with 2-opt.
+
+    The first polyline stays first and keeps its direction, so a single
+    polyline is returned unchanged.
+
+    :param polylines: list of points as np.array([N, 2]) in mm
+    :param max_passes: max number of 2-opt passes
+
+    :return: list of the reordered polylines, some of them reversed
+    """
+    if len(polylines) < 2:
+        return list(polylines)
+
+    first = np.array([pl[0] for pl in polylines])
+    last = np.array([pl[-1] for pl in polylines])
+    start = _to_steps(first)
+    end = _to_steps(last)
+
+    order, rev = _nearest_neighbour(start, end)
+    order, rev = _two_opt(start, end, order, rev, max_passes)
+
+    return [polylines[k][::-1] if r else polylines[k]
+            for k, r in zip(order, rev)]
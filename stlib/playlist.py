@@ -0,0 +1,420 @@
+import asyncio
+import concurrent.futures
+import copy
+import itertools
+import json
+import logging
+import multiprocessing
+from collections import OrderedDict
+from typing import Any, TypedDict
+
+import numpy as np
+
+from .async_worker import AsyncWorker
+from .engines import ENGINES, compile_path
+from .path_maker import PathMaker
+from .speed_plan import planned_time
+
+
+logger = logging.getLogger(__name__)
+
+
+class Job(TypedDict):
+    id: int
+    engine: str
+    name: str
+    params: dict[str, Any]
+    # None until the job is compiled
+    estimated_time: float | None
+
+
+
+def job_path(job: Job, pm: PathMaker) -> PathMaker:
+    """
+    PathMaker of a job from a compiled path that may be shared with the
+    jobs of other playlists. The arrays are shared, only the name and the
+    source are set on a copy.
+
+    :param job: job the path was compiled for
+    :param pm: compiled PathMaker
+
+    :return: PathMaker of the job
+    """
+    pm = copy.copy(pm)
+    pm.name = job["name"]
+    # lets the worker journal the job, see Journal
+    pm.source = {key: job[key] for key in ("id", "engine", "name", "params")}
+
+    return pm
+
+
+
+class Compiler:
+    """
+    Process pool that compiles the jobs of one or several playlists, see
+    compile_path. A job with the same engine and params as one that is
+    compiled or was compiled recently is not compiled again, so a pattern
+    that is sent to several tables is compiled once.
+
+    Available methods:
+    - start() -> start the process pool
+    - stop() -> cancel the compiles and shut down the pool
+    - compile() -> compiled PathMaker of an engine and its params
+
+    :param max_workers: number of worker processes
+    :param cache_size: number of compiled paths that are kept
+    """
+    def __init__(self, max_workers: int = 2, cache_size: int = 4):
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._futures: OrderedDict[str, asyncio.Future] = OrderedDict()
+        self._pool = None
+
+
+    def start(self) -> None:
+        if self._pool is not None:
+            logger.warning("Compiler already started")
+            return
+
+        # spawn doesn't copy the threads of the serial communication
+        self._pool = concurrent.futures.ProcessPoolExecutor(
+            self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+    def stop(self) -> None:
+        if self._pool is None:
+            logger.warning("Compiler not started")
+            return
+
+        for fut in self._futures.values():
+            fut.cancel()
+        self._futures.clear()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+
+    def compile(self, engine: str, params: dict[str, Any]) -> asyncio.Future:
+        """
+        Compile a path in the pool. Must be called from a running event
+        loop.
+
+        :param engine: name of the engine in ENGINES
+        :param params: arguments of the engine
+
+        :return: future of the compiled PathMaker, which is shared with
+            the other callers and must not be modified. Cancelling it
+            doesn't cancel the compile for them.
+        """
+        key = json.dumps([engine, params], sort_keys=True)
+        fut = self._futures.get(key)
+        if fut is None or fut.cancelled() \
+                or (fut.done() and fut.exception() is not None):
+            loop = asyncio.get_running_loop()
+            fut = asyncio.ensure_future(loop.run_in_executor(
+                self._pool, compile_path, engine, params))
+            self._futures[key] = fut
+        self._futures.move_to_end(key)
+
+        # the compiles that are still running are kept
+        done = [k for k, f in self._futures.items() if f.done()]
+        for k in done[:max(len(done) - self.cache_size, 0)]:
+            del self._futures[k]
+
+        return asyncio.shield(fut)
+
+
+
+class Playlist:
+    """
+    Queue of lightweight jobs in front of an AsyncWorker. The next
+    lookahead jobs are compiled ahead of time in a process pool, so neither
+    the event loop nor the table waits for a compile. Every job is handed
+    to the worker only after the previous one was fully added to the
+    position queue, so the order can be changed until then.
+
+    Available methods:
+    - add() -> add a job to the end
+    - remove() -> remove a waiting job
+    - move() -> move a waiting job to another place
+    - skip() -> stop adding the points of the current job
+    - clear() -> remove all jobs and clear the table
+    - status() -> current and waiting jobs
+    - estimate() -> wait for the estimated time of a job
+
+    :param worker: worker that draws the compiled jobs
+    :param lookahead: number of waiting jobs that are compiled ahead
+    :param max_workers: number of worker processes, if the playlist has
+        its own compiler
+    :param compiler: compiler that is shared with other playlists, see
+        TableRegistry. It is started and stopped by its owner. If None, the
+        playlist has its own.
+    """
+    def __init__(self, worker: AsyncWorker, lookahead: int = 2,
+                 max_workers: int = 2, compiler: Compiler | None = None):
+        if lookahead < 1:
+            raise ValueError("At least the next job must be compiled ahead")
+
+        self.worker = worker
+        self.lookahead = lookahead
+        self.max_workers = max_workers
+        self.jobs: list[Job] = []
+        self.current: Job | None = None
+
+        self._own_compiler = compiler is None
+        self.compiler = Compiler(max_workers) if compiler is None \
+            else compiler
+        self._ids = itertools.count(1)
+        self._compiled: dict[int, asyncio.Future] = {}
+        self._changed = asyncio.Event()
+        self._task = None
+
+
+    def start(self) -> None:
+        """
+        Start the compiler and the task that feeds the worker. Must be
+        called from a running event loop.
+        """
+        if self._task is not None:
+            logger.warning("Playlist already started")
+            return
+
+        if self._own_compiler:
+            self.compiler.start()
+        self._task = asyncio.create_task(self._run())
+        self._schedule()
+
+
+    async def stop(self) -> None:
+        if self._task is None:
+            logger.warning("Playlist not started")
+            return
+
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        for fut in self._compiled.values():
+            fut.cancel()
+        self._compiled.clear()
+        if self._own_compiler:
+            self.compiler.stop()
+
+
+    def add(self, engine: str, name: str, params: dict[str, Any]) -> Job:
+        """
+        Add a job to the end of the playlist.
+
+        :param engine: name of the engine in ENGINES
+        :param name: name of the pattern
+        :param params: arguments of the engine
+
+        :return: the new job
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine}")
+
+        job = Job(id=next(self._ids), engine=engine, name=name,
+                  params=params, estimated_time=None)
+        self.jobs.append(job)
+        self._schedule()
+
+        return job
+
+
+    def _index(self, job_id: int) -> int:
+        for i, job in enumerate(self.jobs):
+            if job["id"] == job_id:
+                return i
+
+        raise KeyError(f"No waiting job with id {job_id}")
+
+
+    def remove(self, job_id: int) -> Job:
+        """
+        Remove a waiting job.
+
+        :param job_id: id of the job
+
+        :return: the removed job
+        """
+        job = self.jobs.pop(self._index(job_id))
+        self._schedule()
+
+        return job
+
+
+    def move(self, job_id: int, index: int) -> None:
+        """
+        Move a waiting job to a new place in the playlist.
+
+        :param job_id: id of the job
+        :param index: new index, 0 is the next job
+        """
+        job = self.jobs.pop(self._index(job_id))
+        self.jobs.insert(max(0, index), job)
+        self._schedule()
+
+
+    def skip(self) -> None:
+        """
+        Stop adding the points of the current job to the position queue.
+        The points that are already queued are still drawn.
+        """
+        if self.current is not None:
+            self.worker.skip()
+
+
+    async def clear(self) -> None:
+        """
+        Remove the current and the waiting jobs and stop the table with a
+        clear, so neither the positions that are queued nor the next job
+        are drawn.
+        """
+        if self._task is not None:
+            # the next job might be handed to the worker right now
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = asyncio.create_task(self._run())
+
+        self.jobs.clear()
+        for fut in self._compiled.values():
+            fut.cancel()
+        self._compiled.clear()
+        self.current = None
+        self._changed.set()
+
+        await self.worker.stop(clear=True)
+
+
+    def status(self) -> dict:
+        """
+        :return: dict with the current job, the waiting jobs and which of
+            them are compiled
+        """
+        return {
+            "current": self.current,
+            "jobs": self.jobs,
+            "compiled": [job_id for job_id, fut in self._compiled.items()
+                         if fut.done() and not fut.cancelled()
+                         and fut.exception() is None],
+        }
+
+
+    async def estimate(self, job: Job, timeout: float) -> float | None:
+        """
+        Wait for the compile of a job and set its estimated time. A job
+        outside the look ahead window is compiled now and picked up from
+        the compiler later, see Compiler.compile.
+
+        :param job: job of this playlist
+        :param timeout: max time to wait in s
+
+        :return: estimated time in s or None if the compile didn't finish
+            in time or failed
+        """
+        if self._task is None:
+            return None
+
+        try:
+            pm = await asyncio.wait_for(
+                self.compiler.compile(job["engine"], job["params"]), timeout)
+        except Exception:
+            # a failed compile is reported once the job is drawn, see _next
+            return None
+
+        self._set_estimate(job, pm)
+
+        return job["estimated_time"]
+
+
+    def _schedule(self) -> None:
+        """
+        Start compiling the jobs in the look ahead window and drop the
+        compiled jobs that moved out of it.
+        """
+        self._changed.set()
+        if self._task is None:
+            return
+
+        window = {job["id"]: job for job in self.jobs[:self.lookahead]}
+
+        for job_id in list(self._compiled):
+            if job_id not in window:
+                self._compiled.pop(job_id).cancel()
+
+        for job_id, job in window.items():
+            if job_id not in self._compiled:
+                fut = self.compiler.compile(job["engine"], job["params"])
+                fut.add_done_callback(
+                    lambda fut, job=job: self._on_compiled(job, fut))
+                self._compiled[job_id] = fut
+
+
+    def _on_compiled(self, job: Job, fut: asyncio.Future) -> None:
+        if fut.cancelled() or fut.exception() is not None:
+            return
+
+        self._set_estimate(job, fut.result())
+
+
+    def _set_estimate(self, job: Job, pm: PathMaker) -> None:
+        if pm.total is None:
+            # a StreamingPath would have to be compiled completely
+            return
+
+        if self.worker.ball_speed is None:
+            job["estimated_time"] = pm.estimate_time(self.worker.com.speed)
+        else:
+            pts = np.frombuffer(pm.encode(), dtype=">i4").reshape(-1, 2)
+            job["estimated_time"] = planned_time(
+                pts, ball_speed=self.worker.ball_speed)
+
+
+    async def _next(self) -> tuple[Job, PathMaker | None]:
+        """
+        Wait for the first job and its compiled PathMaker.
+
+        :return: tuple of job and PathMaker or None if the compile failed
+        """
+        while True:
+            if not self.jobs:
+                self._changed.clear()
+                await self._changed.wait()
+                continue
+
+            job = self.jobs[0]
+            fut = self._compiled[job["id"]]
+            self._changed.clear()
+            # the playlist may change while the job is compiled
+            changed = asyncio.create_task(self._changed.wait())
+            await asyncio.wait((fut, changed),
+                               return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+
+            if not self.jobs or self.jobs[0] is not job or not fut.done():
+                continue
+
+            self.jobs.pop(0)
+            del self._compiled[job["id"]]
+            self._schedule()
+
+            try:
+                return job, job_path(job, fut.result())
+            except Exception as e:
+                logger.error("Failed to compile %s: %s", job["name"], e)
+                return job, None
+
+
+    async def _run(self) -> None:
+        while True:
+            job, pm = await self._next()
+            if pm is None:
+                continue
+
+            self.current = job
+            logger.info("Playing %s", job["name"])
+
+            await self.worker.add_PathMaker(pm)
+            # the next job is handed over once this one is fully queued
+            await self.worker.q_path.join()
+            self.current = None
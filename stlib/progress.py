@@ -0,0 +1,190 @@
+import itertools
+import threading
+from collections import deque
+import numpy as np
+
+from .path_maker import PathMaker
+
+
+class ProgressTracker:
+    """
+    Follows which point of which path the sand table has reached. The
+    workers register every path before its points are queued, the position
+    is then derived from the number of positions the sand table
+    acknowledged, see SerialCOM.acked. A path that is sent in chunks is
+    registered chunk by chunk under the same id, see PathMaker.chunks, so
+    only the last max_paths chunks are kept.
+
+    Available methods:
+    - add() -> register a path before it is queued
+    - set_total() -> number of points of a path once all of them are queued
+    - clear() -> forget all paths after the position queue was cleared
+    - status() -> current path, progress, position and ETA
+    - trace() -> reached points between two acknowledged counts
+
+    :param com: SerialCOM or AsyncSerialCOM the paths are sent with
+    :param max_paths: number of registered paths that are kept
+    """
+    def __init__(self, com, max_paths: int = 8):
+        self.com = com
+        self._paths: deque[dict] = deque(maxlen=max_paths)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+
+    def add(self, name: str, pts: np.ndarray, phi0: int,
+            pattern: bool = True, path_id: int | None = None,
+            offset: int = 0, total: int | None = None) -> int:
+        """
+        Register a path or the next chunk of it. Must be called right
+        before its first point is queued.
+
+        :param name: name of the path
+        :param pts: positions as they are sent as np.array([N, 2])
+        :param phi0: sum of all phi steps sent before the path
+        :param pattern: False for transitions between the patterns
+        :param path_id: id of the path the chunk continues. If None, a new
+            path starts.
+        :param offset: index of the first point of the chunk in the path
+        :param total: number of points of the path, None if it is not
+            known yet, see set_total
+
+        :return: id of the path
+        """
+
+        r = pts[:, 0]/PathMaker.RADIUS_STEPS_MM
+        phi = (phi0 + np.cumsum(pts[:, 1], dtype=np.int64)) \
+            / PathMaker.ANGLE_STEPS_RAD
+        # steps of the move to every point, see PathMaker.estimate_time
+        steps = np.maximum(np.abs(np.diff(pts[:, 0], prepend=pts[0, 0])),
+                           np.abs(pts[:, 1]))
+
+        with self._lock:
+            if path_id is None:
+                path_id = next(self._ids)
+            self._paths.append({
+                "id": path_id,
+                "name": name,
+                "pattern": pattern,
+                "start": self.com.queued,
+                "offset": offset,
+                "total": total,
+                "r": r,
+                "phi": phi,
+                "xy": np.column_stack((r*np.cos(phi), r*np.sin(phi))),
+                "steps": np.cumsum(steps, dtype=np.int64),
+            })
+
+        return path_id
+
+
+    def set_total(self, path_id: int, total: int) -> None:
+        """
+        Set the number of points of a path that was registered in chunks
+        without it, see StreamingPath.
+
+        :param path_id: id of the path, see add
+        :param total: number of points of the path
+        """
+        with self._lock:
+            for path in self._paths:
+                if path["id"] == path_id:
+                    path["total"] = total
+
+
+    def clear(self) -> None:
+        """
+        Forget all registered paths, their points that were not drawn yet
+        are dropped and count as acknowledged, see SerialCOM.stop.
+        """
+        with self._lock:
+            self._paths.clear()
+
+
+    def _current(self, acked: int) -> tuple[dict | None, int]:
+        """
+        :return: tuple of the path with the last acknowledged point and the
+            number of its acknowledged points
+        """
+        for path in reversed(self._paths):
+            if path["start"] < acked:
+                return path, min(acked - path["start"], path["r"].shape[0])
+
+        if self._paths:
+            return self._paths[0], 0
+
+        return None, 0
+
+
+    def status(self) -> dict:
+        """
+        :return: dict with the current path, its progress, the last
+            acknowledged position and the remaining time of the path in s.
+            The progress and time are None while the number of points of
+            the path is not known or not all of them are queued.
+        """
+        with self._lock:
+            path, num = self._current(self.com.acked)
+
+        if path is None:
+            return {"id": None}
+
+        total = path["total"]
+        index = path["offset"] + num
+        last = max(num - 1, 0)
+        steps = path["steps"]
+        left = steps[-1] - (steps[num-1] if num else 0)
+        # only known once the chunk with the end of the path is queued
+        eta = None
+        if total == path["offset"] + path["r"].shape[0]:
+            eta = float(left/self.com.speed)
+
+        return {
+            "id": path["id"],
+            "name": path["name"],
+            "pattern": path["pattern"],
+            "index": index,
+            "total": total,
+            "progress": index/total if total else None,
+            "r": float(path["r"][last]),
+            "phi": float(path["phi"][last]),
+            "eta": eta,
+        }
+
+
+    def trace(self, since: int | None, until: int,
+              max_points: int) -> np.ndarray:
+        """
+        Reached points in cartesian coordinates. Long traces are downsampled
+        to max_points, the last point is always included.
+
+        :param since: acknowledged count of the last call. If None, the
+            trace starts at the beginning of the current path.
+        :param until: acknowledged count to trace to
+        :param max_points: max number of returned points
+
+        :return: points in mm as np.array([N, 2])
+        """
+        with self._lock:
+            if since is None:
+                path, _ = self._current(until)
+                since = until if path is None else min(
+                    p["start"] for p in self._paths if p["id"] == path["id"])
+
+            parts = []
+            for path in self._paths:
+                start = path["start"]
+                a = max(since - start, 0)
+                b = min(until - start, path["r"].shape[0])
+                if a < b:
+                    parts.append(path["xy"][a:b])
+
+        if not parts:
+            return np.empty((0, 2))
+
+        pts = np.concatenate(parts)
+        if pts.shape[0] > max_points:
+            idx = np.linspace(0, pts.shape[0] - 1, max_points).astype(np.intp)
+            pts = pts[idx]
+
+        return pts
@@ -0,0 +1 @@
+from .virtual_table import VirtualSerial as Serial
@@ -1,9 +1,18 @@
+import logging
 import serial
+import struct
 import time
-from queue import Queue
+from queue import Empty, Queue
+from collections import deque
 from enum import Enum, auto
 import threading
-from typing import TypedDict
+from typing import Callable, Iterator, TypedDict
+
+from .capture import CaptureKind, CaptureSerial, CaptureWriter
+from .metrics import ComMetrics, Registry
+
+
+logger = logging.getLogger(__name__)
 
 
 class MsgType(Enum):
@@ -21,6 +30,10 @@ class MsgType(Enum):
     getRBuffSize = b"\x71"
     sendRBuffSize = b"\x72"
     bufferFull = b"\x73"
+    positions = b"\x74"
+    positionsRec = b"\x75"
+    getFrameStatus = b"\x76"
+    sendFrameStatus = b"\x77"
 
 
 class SerialStates(Enum):
@@ -32,91 +45,709 @@ class SerialStates(Enum):
 class SendPacket(TypedDict):
     msg: bytes
     msg_arr: bytes
+    time: float # when the msg was queued
+    epoch: int # epoch of the position queue when the msg was queued
+
+
+
+def encode_pos(pos: list[int, int]) -> bytes:
+    """
+    Encode a position as payload of a position or positions msg.
+
+    :param pos: list of [r, phi] as position in steps. R and Phi must be
+        as int32!
+
+    :return: r and phi as big endian int32
+    """
+    if len(pos) != 2:
+        raise ValueError("Invalid position")
+
+    r = int(pos[0])
+    phi = int(pos[1])
+
+    return r.to_bytes(4, "big", signed=True) + \
+        phi.to_bytes(4, "big", signed=True)
+
+
+
+def encode_speed(speed: int) -> bytes:
+    """
+    Encode the payload of a speed msg.
 
+    :param speed: speed is defined as steps per second as a uint16
 
-class SerialCOM:
+    :return: speed as big endian uint16
+    """
+    if not isinstance(speed, int):
+        raise TypeError(f"Speed must be an int not {type(speed)}!")
+
+    if speed < 0 or speed >= 2**16:
+        raise ValueError("Speed must be a uint16!")
+
+    return speed.to_bytes(2, "big", signed=False)
+
+
+
+class PositionBuffer:
+    """
+    Encoded positions that were taken from the position queue but aren't
+    accepted by the sand table yet. The positions stay in the chunks they
+    were queued in and are only copied once, into the frame that is sent.
+    """
+
+    POS_SIZE = 8 # bytes of an encoded position
+
+    def __init__(self):
+        self._chunks: deque[memoryview] = deque()
+        # bytes of the first chunk that were already accepted
+        self._offset = 0
+        self._size = 0
+
+
+    def __len__(self) -> int:
+        return self._size//self.POS_SIZE
+
+
+    def append(self, chunk: bytes | memoryview) -> None:
+        """
+        :param chunk: encoded positions, see encode_pos
+        """
+        chunk = memoryview(chunk).cast("B")
+        if chunk.nbytes % self.POS_SIZE:
+            raise ValueError("Chunk must contain whole positions")
+
+        self._chunks.append(chunk)
+        self._size += chunk.nbytes
+
+
+    def copy_to(self, out: memoryview, num: int) -> int:
+        """
+        Copy the first positions into out.
+
+        :param out: where to copy the positions to
+        :param num: number of positions
+
+        :return: number of copied bytes
+        """
+        left = min(num, len(self))*self.POS_SIZE
+        pos = 0
+        offset = self._offset
+
+        for chunk in self._chunks:
+            if left <= 0:
+                break
+
+            n = min(left, chunk.nbytes - offset)
+            out[pos:pos+n] = chunk[offset:offset+n]
+            pos += n
+            left -= n
+            offset = 0
+
+        return pos
+
+
+    def consume(self, num: int) -> int:
+        """
+        Remove the first positions.
+
+        :param num: number of positions
+
+        :return: number of chunks that were fully removed
+        """
+        left = min(num, len(self))*self.POS_SIZE
+        self._size -= left
+        done = 0
+
+        while left > 0:
+            n = self._chunks[0].nbytes - self._offset
+            if left < n:
+                self._offset += left
+                break
+
+            left -= n
+            self._chunks.popleft()
+            self._offset = 0
+            done += 1
+
+        return done
+
+
+
+# number of data bytes that follow a response msg
+RESPONSE_DATA_SIZE = {
+    MsgType.sendRBuffSize.value: 1,
+    # frame id, accepted positions and buffer size
+    MsgType.positionsRec.value: 3,
+    MsgType.sendFrameStatus.value: 3,
+}
+
+
+
+class SandTableProtocol:
+    """
+    State of the serial protocol that SerialCOM and AsyncSerialCOM share.
+    It builds the msgs and the positions frames, tracks the free space in
+    the buffer of the sand table and drops the positions and speeds of a
+    cleared epoch, but it never reads or writes the port. The subclasses
+    send the msgs with their _transaction and hand the response to the
+    matching _on_* method:
+    - the msgs of the msg queue, see _on_msg
+    - the msgs of the position lane, see _position_msg
+    - the buffer size query that probes a new connection, see _on_probe
+
+    The queues are a queue.Queue or an asyncio.Queue, only the methods that
+    don't block are used here.
+
+    :param COM: serial port or url like sandtable:// for the VirtualTable
+    :param pos_queue: queue of the chunks of encoded positions and speeds
+        with the epoch they were queued in, see queue_speed
+    :param msg_queue: queue of the msgs, see SendPacket
+    :param registry: where to register the metrics
+    :param capture: file to log every written and read byte to, see
+        CaptureWriter and replay.py. If None, nothing is logged.
+    """
     BAUDRATE = 115200
-    LOOP_SLEEP_TIME = 0.05 # s
+    READ_TIMEOUT = 2 # s
     HEADER = MsgType.headerA.value + MsgType.headerB.value
-    BUFF_FULL_TIMEOUT = 1
+    BUFF_POLL_TIME = 0.02 # s between buffer size queries when it is full
+    RBUFF_SIZE = 10 # size of the RollingBuffer on the sand table
+    # the RollingBuffer keeps one slot empty
+    MAX_FRAME_POSITIONS = RBUFF_SIZE - 1
+    INIT_SPEED = 800 # steps per second of the motors after homing
+
+    def __init__(self, COM: str, pos_queue, msg_queue,
+                 registry: Registry | None = None,
+                 capture: str | None = None):
+        self.COM = COM
+        self._serial = None
+        self.capture = None if capture is None else CaptureWriter(capture)
+        self._pos_queue = pos_queue
+        self._msg_queue = msg_queue
+        # number of clears, the positions queued before the last clear are
+        # dropped by the loop, see _flush
+        self.epoch = 0
+        self._cur_epoch = 0
+
+        self._cur_pos = PositionBuffer()
+        # speed taken from the position queue, it is sent once _cur_pos is
+        # empty
+        self._next_speed = None
+        # every positions frame is built in the same buffer, the header
+        # is followed by the id of the frame and the number of positions
+        self._frame = bytearray(self.HEADER + MsgType.positions.value +
+                                bytes(2 + self.MAX_FRAME_POSITIONS*8))
+        # id and number of positions of the last frame that was sent
+        self._seq = 0
+        self._frame_num = 0
+        # set when the response to the last frame got lost. The sand table
+        # is asked whether it received the frame before anything is sent
+        # again, see _on_frame_status.
+        self._frame_lost = False
+        # set when a response timed out or didn't belong to its msg, the
+        # input is dropped before the next msg, so a late response isn't
+        # taken for the answer to the next msg
+        self._stale = False
+        # positions in the buffer on the sand table and how many can still
+        # be sent without overflowing it
+        self._buffsize = 0
+        self._credits = 0
+        # number of positions at the start of _cur_pos that were already
+        # sent at least once
+        self._sent_before = 0
+        # [r, phi] of the last accepted positions, phi is the sum of all
+        # accepted phi steps. The oldest ones are the positions the sand
+        # table already took from its buffer, see _on_clear.
+        self._accepted_pos = deque([(0, 0)], maxlen=self.RBUFF_SIZE + 1)
+        # [r, phi] of the last position the sand table took from its buffer
+        # before the last confirmed clear, the next position is relative to
+        # it. The epoch is the one the clear started.
+        self.clear_position = [0, 0]
+        self.cleared_epoch = 0
+        # last speed sent to the sand table, used for time estimates
+        self.speed = self.INIT_SPEED
+        # total number of queued and acknowledged positions
+        self.queued = 0
+        self.acked = 0
+
+        self.metrics = ComMetrics(COM, self._pos_queue.qsize,
+                                  self._msg_queue.qsize, registry)
+
+
+    def _packet(self, msg: MsgType, data: bytes = b"") -> SendPacket:
+        msg = self.HEADER + msg.value + data
+        return SendPacket(msg=msg[2], msg_arr=msg, time=time.monotonic(),
+                          epoch=self.epoch)
+
+
+    def _speed_packet(self, speed: int) -> SendPacket:
+        packet = self._packet(MsgType.speed, encode_speed(speed))
+        self.speed = speed
+        return packet
+
+
+    def _home_packet(self) -> SendPacket:
+        # homing resets the speed of the motors
+        self.speed = self.INIT_SPEED
+        return self._packet(MsgType.home)
+
+
+    def _stop_packets(self, clear: bool) -> list[SendPacket]:
+        """
+        :return: the stop msg and if clear is set a frame status query and
+            the clear msg, see SerialCOM.stop. The sand table doesn't take
+            positions from its buffer once it stopped, so the buffer size
+            of the status tells where it stands after the clear.
+        """
+        if not clear:
+            return [self._packet(MsgType.stop)]
+
+        # the epoch changes first, so nothing that was queued before the
+        # stop can be sent after it
+        self.epoch += 1
+        return [self._packet(MsgType.stop),
+                self._packet(MsgType.getFrameStatus),
+                self._packet(MsgType.clear)]
+
+
+    def _chunks(self, data: bytes | memoryview, epoch: int | None
+                ) -> Iterator[tuple[int, memoryview]]:
+        """
+        Split encoded positions into items of the position queue of one
+        frame each without copying them. The positions of an item count as
+        queued once the next item is requested.
+
+        :param data: positions as big endian int32 [r, phi] pairs
+        :param epoch: see SerialCOM.send_packets
+        """
+        data = memoryview(data).cast("B")
+        size = self.MAX_FRAME_POSITIONS*PositionBuffer.POS_SIZE
+        epoch = self.epoch if epoch is None else epoch
+
+        for i in range(0, data.nbytes, size):
+            chunk = data[i:i+size]
+            yield epoch, chunk
+            self.queued += chunk.nbytes//PositionBuffer.POS_SIZE
+
+
+    def _speed_item(self, speed: int, epoch: int | None) -> tuple[int, int]:
+        encode_speed(speed)
+        return self.epoch if epoch is None else epoch, speed
+
+
+    def _timed_out(self, msg: bytes | memoryview) -> None:
+        self._stale = True
+        # the probes of a new connection time out until the board is ready
+        if self._connected.is_set():
+            logger.warning("Response to %s timed out!", bytes(msg[2:3]))
+            self.metrics.timeouts.inc()
+
+
+    def _set_buffsize(self, size: int) -> None:
+        """
+        Update the number of positions in the buffer on the sand table and
+        the number of positions that can still be sent.
+
+        :param size: number of positions in the buffer
+        """
+        self._buffsize = size
+        self._credits = max(0, self.MAX_FRAME_POSITIONS - size)
+
+
+    def _on_probe(self, ret: tuple[bytes, bytes] | None) -> bool:
+        """
+        Handle the response to the buffer size query that probes a new
+        connection.
+
+        :return: True if the sand table answered
+        """
+        if ret is None or ret[0] != MsgType.sendRBuffSize.value:
+            return False
+
+        self._set_buffsize(ret[1][0])
+        # the positions that weren't acknowledged are sent again
+        self._sent_before = 0
+        return True
+
+
+    def _on_msg(self, packet: SendPacket,
+                ret: tuple[bytes, bytes] | None) -> None:
+        """
+        Handle the response to a msg of the msg queue.
+        """
+        if ret is None:
+            return
+
+        self.metrics.control_latency.observe(time.monotonic() -
+                                             packet["time"])
+        match ret[0]:
+            case MsgType.confirmRec.value:
+                logger.debug("Msg confirmed %s", packet["msg_arr"])
+                if packet["msg"] == MsgType.clear.value[0]:
+                    self._on_clear(packet["epoch"])
+            case MsgType.failedRec.value:
+                logger.warning("Msg was denied")
+            case MsgType.sendRBuffSize.value:
+                self._set_buffsize(ret[1][0])
+            case MsgType.sendFrameStatus.value:
+                self._on_frame_status(ret)
+            case _:
+                logger.warning("Received unexpected return msg %s", ret[0])
+                self._stale = True
+
+
+    def _on_clear(self, epoch: int) -> None:
+        """
+        Handle the confirmed clear, the positions that were still in the
+        buffer on the sand table are dropped.
+
+        :param epoch: epoch of the position queue the clear started
+        """
+        taken = len(self._accepted_pos) - 1 - self._buffsize
+        self.clear_position = list(self._accepted_pos[max(taken, 0)])
+        self._accepted_pos.clear()
+        self._accepted_pos.append(tuple(self.clear_position))
+        self._set_buffsize(0)
+        self.cleared_epoch = epoch
+        self._cleared.set()
+
+
+    def _position_msg(self) -> tuple[bytes | memoryview, Callable[
+            [tuple[bytes, bytes] | None], bool]] | None:
+        """
+        Next msg of the position lane: the speed that was queued with the
+        positions, a frame status query after the response to a frame got
+        lost, a buffer size query while the buffer on the sand table is
+        full or a positions frame with as many positions as there are free
+        slots.
+
+        :return: tuple of the msg and the method that handles its response
+            or None if nothing is queued. The method returns False if the
+            loop should wait BUFF_POLL_TIME before the next msg.
+        """
+        while not self._cur_pos:
+            if self._next_speed is not None:
+                return self.HEADER + MsgType.speed.value + \
+                    encode_speed(self._next_speed), self._on_speed
+            if self._pos_queue.empty():
+                return None
+            self._take_item(self._pos_queue.get_nowait())
+
+        if self._frame_lost:
+            return self.HEADER + MsgType.getFrameStatus.value, \
+                self._on_frame_status
+
+        if self._credits <= 0:
+            return self.HEADER + MsgType.getRBuffSize.value, \
+                self._on_buffsize
+
+        while len(self._cur_pos) < self._credits and \
+                self._next_speed is None and not self._pos_queue.empty():
+            self._take_item(self._pos_queue.get_nowait())
+
+        num = min(len(self._cur_pos), self._credits)
+        self._seq = (self._seq + 1) % 256
+        frame = memoryview(self._frame)
+        frame[3] = self._seq
+        frame[4] = num
+        size = self._cur_pos.copy_to(frame[5:], num)
+        self._frame_num = num
+        self._credits -= num
+
+        self.metrics.sent.inc(num)
+        self.metrics.retransmits.inc(min(num, self._sent_before))
+        self._sent_before = max(self._sent_before, num)
+        logger.debug("Sent %d positions", num)
+
+        return frame[:5+size], self._on_positions
+
+
+    def _on_buffsize(self, ret: tuple[bytes, bytes] | None) -> bool:
+        """
+        :return: True if there is free space in the buffer
+        """
+        if ret is None or ret[0] != MsgType.sendRBuffSize.value:
+            logger.warning("Failed to receive buff size")
+            self._stale |= ret is not None
+            return False
+
+        self._set_buffsize(ret[1][0])
+        return self._credits > 0
+
+
+    def _on_positions(self, ret: tuple[bytes, bytes] | None) -> bool:
+        """
+        :return: True if all positions of the frame were accepted
+        """
+        if ret is None or ret[0] != MsgType.positionsRec.value or \
+                ret[1][0] != self._seq:
+            if ret is None:
+                pass
+            elif ret[0] == MsgType.failedRec.value:
+                logger.warning("Pos was denied")
+            else:
+                logger.warning("Received unexpected return pos msg %s",
+                               ret[0])
+            self._stale |= ret is not None
+            # phi is relative, so resending a frame that was accepted
+            # would turn the rest of the pattern. The frame is only sent
+            # again once the sand table reported that it didn't get it.
+            self._frame_lost = True
+            self._credits = 0
+            return False
+
+        self._set_buffsize(ret[1][2])
+        return self._accept(ret[1][1])
+
+
+    def _on_frame_status(self, ret: tuple[bytes, bytes] | None) -> bool:
+        """
+        Handle the id and the accepted positions of the last frame the
+        sand table received, see _on_positions.
+
+        :return: True if there is free space in the buffer
+        """
+        if ret is None or ret[0] != MsgType.sendFrameStatus.value:
+            logger.warning("Failed to receive the frame status")
+            self._stale |= ret is not None
+            return False
+
+        seq, accepted, size = ret[1]
+        if self._frame_lost and seq == self._seq:
+            logger.info("Frame %d was received with %d positions", seq,
+                        accepted)
+            self._accept(accepted)
+        elif self._frame_lost:
+            logger.info("Frame %d was lost, it is sent again", self._seq)
+        self._frame_lost = False
+        self._set_buffsize(size)
 
-    def __init__(self, COM: str):
-        self._serial = serial.Serial(COM, baudrate=self.BAUDRATE, timeout=2)
-        self._serial.flush()
-        # wait a bit to establish COM
-        time.sleep(1)
+        return self._credits > 0
 
-        self._pos_queue: Queue[bytes] = Queue(25)
-        self._msg_queue: Queue[SendPacket] = Queue(25)
+
+    def _accept(self, accepted: int) -> bool:
+        """
+        Remove the accepted positions of the last frame from _cur_pos.
+
+        :param accepted: number of positions the sand table accepted
+
+        :return: True if all positions of the frame were accepted
+        """
+        num = self._frame_num
+        r, phi = self._accepted_pos[-1]
+        pos = memoryview(self._frame)[5:5 + accepted*PositionBuffer.POS_SIZE]
+        for r, step in struct.iter_unpack(">ii", pos):
+            phi += step
+            self._accepted_pos.append((r, phi))
+
+        self._sent_before -= accepted
+        for _ in range(self._cur_pos.consume(accepted)):
+            self._pos_queue.task_done()
+        self.acked += accepted
+        self.metrics.positions_acked(accepted)
+
+        if accepted < num:
+            logger.info("Buffer is full -> %d not accepted", num - accepted)
+            self.metrics.buffer_full.inc()
+            self.metrics.denied.inc(num - accepted)
+            self._credits = 0
+            return False
+
+        return True
+
+
+    def _on_speed(self, ret: tuple[bytes, bytes] | None) -> bool:
+        """
+        :return: True if the speed was answered, a timed out speed is sent
+            again, which is harmless
+        """
+        if ret is None:
+            return False
+
+        if ret[0] == MsgType.confirmRec.value:
+            self.speed = self._next_speed
+            self.metrics.speed_changes.inc()
+        else:
+            logger.warning("Speed %d was denied", self._next_speed)
+
+        self._next_speed = None
+        self._pos_queue.task_done()
+        return True
+
+
+    def _take_item(self, item: tuple[int, bytes | memoryview | int]
+                   ) -> None:
+        """
+        Move an item of the position queue to _cur_pos or _next_speed.
+        """
+        epoch, item = item
+        if epoch != self.epoch:
+            self._drop(item)
+        elif isinstance(item, int):
+            self._next_speed = item
+        else:
+            self._cur_pos.append(item)
+
+
+    def _drop(self, item: bytes | memoryview | int) -> None:
+        """
+        Drop an item of the position queue of a cleared epoch. Its
+        positions count as acknowledged, see SerialCOM.stop.
+        """
+        if not isinstance(item, int):
+            num = len(item)//PositionBuffer.POS_SIZE
+            self.acked += num
+            self.metrics.dropped.inc(num)
+
+        self._pos_queue.task_done()
+
+
+    def _flush(self) -> None:
+        """
+        Drop the positions and speeds that were queued before the last
+        clear, see SerialCOM.stop.
+        """
+        if self._cur_epoch == self.epoch:
+            return
+        self._cur_epoch = self.epoch
+
+        num = len(self._cur_pos)
+        for _ in range(self._cur_pos.consume(num)):
+            self._pos_queue.task_done()
+        self.acked += num
+        self.metrics.dropped.inc(num)
+        self._sent_before = 0
+        # the clear also removed the frame from the buffer of the table
+        self._frame_lost = False
+
+        if self._next_speed is not None:
+            self._next_speed = None
+            self._pos_queue.task_done()
+
+        while not self._pos_queue.empty():
+            self._drop(self._pos_queue.get_nowait()[1])
+
+        logger.info("Cleared the position queue")
+
+
+
+class SerialCOM(SandTableProtocol):
+    """
+    Sends the queued positions and msgs to the sand table from a
+    background thread. The serial port is only opened by begin_com, once
+    the sand table answers a buffer size query, and it is opened again
+    when the connection is lost. Until then the positions and msgs wait in
+    the queues.
+
+    Msgs like stop and home are a priority lane: all queued msgs are sent
+    before the next positions frame and a msg wakes the loop from its
+    sleep, so a msg reaches the sand table once the frame that is in flight
+    was answered, within one round trip. A clear also drops the positions
+    and speeds that are still queued, see stop.
+
+    The protocol itself is implemented by SandTableProtocol, this class
+    only does the blocking reads and writes.
+
+    :param COM: serial port or url like sandtable:// for the VirtualTable
+    :param registry: where to register the metrics
+    :param capture: file to log every written and read byte to, see
+        CaptureWriter and replay.py. If None, nothing is logged.
+    """
+    LOOP_SLEEP_TIME = 0.05 # s
+    RECONNECT_TIME = 2 # s between the attempts to open the serial port
+    # the board may reset when the port is opened, it is probed every
+    # PROBE_INTERVAL until it answers
+    PROBE_INTERVAL = 0.2 # s
+    PROBE_TIMEOUT = 5 # s
+
+    def __init__(self, COM: str, registry: Registry | None = None,
+                 capture: str | None = None):
+        # set while the sand table answers, see _connect
+        self._connected = threading.Event()
+        # set when a clear is confirmed, see wait_cleared
+        self._cleared = threading.Event()
+        super().__init__(COM, Queue(25), Queue(25), registry, capture)
+        # failed connects in a row
+        self._failures = 0
+        # interrupts the sleep of the loop when a msg is queued
+        self._wake = threading.Event()
 
         self._ser_state = SerialStates.read_header
         self._last_msg = MsgType.confirmRec.value
         self._header_buff = [0, 0]
         self._is_running = False
-        self._active_pos = False
-        self._cur_pos = None
-        self._last_pos_time = time.monotonic()
-
 
-    def _add_item(self, msg: bytes):
-        packet = SendPacket(msg=msg[2], msg_arr=msg)
 
+    def _add_item(self, packet: SendPacket):
         self._msg_queue.put(packet)
-        
+        self._wake.set()
+
 
     def send_pos(self, pos: list[int, int]) -> None:
         """
         Adds the new position to a queue. The main loop handles the msg
-        transaction.
+        transaction and packs several positions into one frame.
 
         :param pos: list of [r, phi] as position in steps. R and Phi must be
             as int32!
 
         """
-        if len(pos) != 2:
-            raise ValueError("Invalid position")
-        # if not (isinstance(pos[0], (int, np.int32)) and 
-        # isinstance(pos[1], (int, np.int32))):
-        #     raise ValueError("Values must be ints")
-        r = int(pos[0])
-        phi = int(pos[1])
+        self._pos_queue.put((self.epoch, encode_pos(pos)), block=True,
+                            timeout=20)
+        self.queued += 1
 
-        pos_r = r.to_bytes(4, "big", signed=True)
-        pos_phi = phi.to_bytes(4, "big", signed=True)
 
-        msg = self.HEADER + MsgType.position.value + pos_r + pos_phi
+    def send_packets(self, data: bytes | memoryview,
+                     epoch: int | None = None) -> None:
+        """
+        Adds many encoded positions to the queue, for example the output of
+        PathMaker.encode. The data is split into chunks of one frame
+        without copying it and waits until they fit into the queue.
 
-        print(f"Added to queue {msg}")
-        self._pos_queue.put(msg, block=True, timeout=20)
+        :param data: positions as big endian int32 [r, phi] pairs
+        :param epoch: epoch the positions belong to, they are dropped if
+            the queue was cleared since then. If None, the current epoch.
+        """
+        for item in self._chunks(data, epoch):
+            self._pos_queue.put(item, block=True, timeout=20)
 
 
-    def update_speed(self, speed: int) -> None:
+    def queue_speed(self, speed: int, epoch: int | None = None) -> None:
         """
-        Update the speed value on the sand table. Adds the msg to the msg 
-        queue.
+        Add a speed change to the position queue. Unlike update_speed, the
+        msg is sent in order with the positions, once all positions queued
+        before it were accepted by the sand table, see plan_speeds.
 
         :param speed: speed is defined as steps per second as a uint16
+        :param epoch: see send_packets
         """
+        self._pos_queue.put(self._speed_item(speed, epoch), block=True,
+                            timeout=20)
 
-        if not isinstance(speed, int):
-            raise TypeError(f"Speed must be an int not {type(speed)}!")
-        
-        if speed < 0 and speed > 2**16:
-            raise ValueError("Speed must be a uint16!")
-        
-        val = speed.to_bytes(2, "big", signed=False)
 
-        msg = self.HEADER + MsgType.speed.value + val
+    def update_speed(self, speed: int) -> None:
+        """
+        Update the speed value on the sand table. Adds the msg to the msg 
+        queue.
 
-        self._add_item(msg)
+        :param speed: speed is defined as steps per second as a uint16
+        """
+        self._add_item(self._speed_packet(speed))
 
 
     def home(self) -> None:
         """
         Send a command to home the sand table.
         """
-        msg = self.HEADER + MsgType.home.value
-        self._add_item(msg)
+        self._add_item(self._home_packet())
+
+
+    def query_buffsize(self) -> None:
+        """
+        Ask the sand table for the number of positions in its buffer. The
+        msg is sent ahead of the queued positions and the answer updates
+        the credits, see _set_buffsize.
+        """
+        self._add_item(self._packet(MsgType.getRBuffSize))
 
     
     def is_homed(self) -> bool:
@@ -129,136 +760,228 @@ class SerialCOM:
 
     def stop(self, clear: bool = False) -> None:
         """
-        Stop the sand table.
+        Stop the sand table. The msg is sent ahead of the queued positions.
+
+        :param clear: whether to clear the position queue. The positions
+            and speeds that are queued but not accepted yet are dropped,
+            they count as acknowledged so the positions queued later keep
+            their index, see acked. The buffer of the sand table is cleared
+            with a clear msg, see wait_cleared.
+        """
+        for packet in self._stop_packets(clear):
+            self._add_item(packet)
+
 
-        :param clear: whether to clear the position queue.
+    def wait_cleared(self, epoch: int, timeout: float | None = None
+                     ) -> bool:
         """
-        msg = self.HEADER + MsgType.stop.value
-        self._add_item(msg)
+        Wait until the sand table confirmed the clear that started the
+        epoch. clear_position is then the position the next one is
+        relative to.
 
-        if clear:
-            msg = self.HEADER + MsgType.clear.value
-            self._add_item(msg)
+        :param epoch: epoch of the position queue after the clear
+        :param timeout: max time to wait in s, None waits forever
+
+        :return: True if the clear was confirmed
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while self.cleared_epoch < epoch:
+            self._cleared.clear()
+            # the clear may be confirmed in between
+            if self.cleared_epoch >= epoch:
+                break
+            wait = None if end is None else end - time.monotonic()
+            if wait is not None and wait <= 0 or not self._cleared.wait(wait):
+                return False
+
+        return True
 
     
     def start(self) -> None:
         """
         Start the sand table.
         """
-        msg = self.HEADER + MsgType.start.value
-        self._add_item(msg)
+        self._add_item(self._packet(MsgType.start))
 
 
-    def _loop(self) -> None:
+    @property
+    def connected(self) -> bool:
         """
-        We need a start off sequence -> is homed, stopped, buffer status
+        Is the serial port open and did the sand table answer?
+        """
+        return self._connected.is_set()
+
 
-        state machine to keep track?
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the sand table is connected.
 
-        let's just first see if this shit even works as expected.
+        :param timeout: max time to wait in s, None waits forever
 
-        fokus... rabis posiljat msge in jih sproti tudi pobirati
+        :return: True if it is connected
         """
-        
-        if self._serial.in_waiting > 0:
-            rec = self._serial.read_all()
-            print("Ignoring all available msgs at startup:")
-            print(f"\t{rec}\n")
+        return self._connected.wait(timeout)
 
-        print("Starting the loop")
-        while self._event.is_set():
-            self._serial_send_postion()
-            self._serial_send_msg()
 
-            time.sleep(self.LOOP_SLEEP_TIME)
+    def _connect(self) -> bool:
+        """
+        Open the serial port and probe the sand table until it answers.
 
+        :return: True if the sand table answered
+        """
+        try:
+            self._serial = serial.serial_for_url(
+                self.COM, baudrate=self.BAUDRATE, timeout=self.PROBE_INTERVAL)
+            if self.capture is not None:
+                self.capture.record(CaptureKind.open, self.COM.encode())
+                self._serial = CaptureSerial(self._serial,
+                                             self.capture.record)
+
+            end = time.monotonic() + self.PROBE_TIMEOUT
+            while self._event.is_set() and time.monotonic() < end:
+                # drops the msgs from before and the noise of a reset
+                self._serial.reset_input_buffer()
+                if self._on_probe(self._transaction(
+                        self.HEADER + MsgType.getRBuffSize.value)):
+                    break
+            else:
+                raise serial.SerialException("The sand table didn't answer")
+
+        except (serial.SerialException, OSError) as e:
+            self._disconnect()
+            # only the first failure in a row is a warning
+            log = logger.warning if not self._failures else logger.debug
+            log("Failed to connect to %s: %s", self.COM, e)
+            self._failures += 1
+            return False
+
+        self._serial.timeout = self.READ_TIMEOUT
+        self._failures = 0
+
+        logger.info("Connected to %s", self.COM)
+        self.metrics.connects.inc()
+        self.metrics.connected.set(1)
+        self._connected.set()
+        return True
+
+
+    def _disconnect(self) -> None:
+        self._connected.clear()
+        self.metrics.connected.set(0)
+        if self._serial is not None:
+            try:
+                self._serial.close()
+            except (serial.SerialException, OSError):
+                pass
+            self._serial = None
 
-    def _serial_send_postion(self):
-        if self._pos_queue.empty() and not self._active_pos:
-            return
-    
-        if self._active_pos:
-            t_ = time.monotonic()
-            if (t_ - self._last_pos_time) < self.BUFF_FULL_TIMEOUT:
-                return
-        else:
-            self._cur_pos = self._pos_queue.get()
 
-        print(f"Sending msg: {self._cur_pos}")
-        self._serial.write(self._cur_pos)
+    def _loop(self) -> None:
+        """
+        Connect to the sand table and send the queued positions and msgs
+        until stop_com is called. A lost connection is opened again.
+        """
+        logger.info("Starting the loop")
+        while self._event.is_set():
+            if not self._connected.is_set() and not self._connect():
+                end = time.monotonic() + self.RECONNECT_TIME
+                while self._event.is_set() and time.monotonic() < end:
+                    time.sleep(self.LOOP_SLEEP_TIME)
+                continue
+
+            try:
+                # the msgs go first, so a stop is never behind a frame
+                self._serial_send_msgs()
+                self._flush()
+                busy = self._serial_send_postion()
+            except (serial.SerialException, OSError) as e:
+                logger.error("Lost the connection to %s: %s", self.COM, e)
+                self._disconnect()
+                continue
+
+            # keep the buffer on the sand table topped up and only sleep
+            # when there is nothing to send or the buffer is full. A queued
+            # msg ends the sleep.
+            if busy or not self._msg_queue.empty():
+                continue
+            elif self._cur_pos or not self._pos_queue.empty():
+                self._wake.wait(self.BUFF_POLL_TIME)
+            else:
+                self._wake.wait(self.LOOP_SLEEP_TIME)
+            self._wake.clear()
+
+
+    def _transaction(self, msg: bytes | memoryview
+                     ) -> tuple[bytes, bytes] | None:
+        """
+        Send a msg and wait for the response. Errors of the port are
+        raised, the loop then connects again.
+
+        :param msg: full msg with header
+
+        :return: tuple of response msg and its data or None if the response
+            timed out
+        """
+        if self._stale:
+            # drop the late response to an earlier msg
+            self._serial.reset_input_buffer()
+            self._stale = False
+
+        t_send = time.monotonic()
+        self._serial.write(msg)
 
         ret = self._serial.read_until(self.HEADER, size=2)
-        if not ret:
-            print("Response pos timed out!")
-            return
+        code = self._serial.read(1) if ret else b""
+        size = RESPONSE_DATA_SIZE.get(code, 0)
+        data = self._serial.read(size) if code and size else b""
+        if not code or len(data) < size:
+            self._timed_out(msg)
+            return None
 
-        msg = self._serial.read(1)
-        if not msg:
-            print("Response pos timed out!")
-            return
-        
-        match msg:
-            case MsgType.confirmRec.value:
-                self._active_pos = False
-                self._pos_queue.task_done()
-                print(f"Msg confirmed {msg}")
-            case MsgType.failedRec.value:
-                print("Pos was denied")
-                self._active_pos = True
-            case MsgType.bufferFull.value:
-                print("Buffer is full -> resend msg")
-                self._active_pos = True
-            case _:
-                print(f"Received unexpected return pos msg {msg}")
-                #TODO kaj res naredit v tem primeru?
-                self._pos_queue.task_done()
+        self.metrics.ack_rtt.observe(time.monotonic() - t_send)
+        return code, data
 
-        self._last_pos_time = time.monotonic()
 
+    def _serial_send_postion(self) -> bool:
+        """
+        Send the next msg of the position lane, see _position_msg. Nothing
+        is sent while the buffer on the sand table is full, instead its
+        size is queried every BUFF_POLL_TIME.
 
-    def _serial_send_msg(self):
-        if self._msg_queue.empty():
-            return
-        
-        item = self._msg_queue.get()
-        print(f"Sending msg: {item['msg_arr']}")
-        self._serial.write(item["msg_arr"])
+        :return: True if the next msg can be sent right away
+        """
+        req = self._position_msg()
+        if req is None:
+            return False
 
-        ret = self._serial.read_until(self.HEADER, size=2)
-        if not ret:
-            print("Response msg time out")
-            return
-        msg = self._serial.read(1)
-        if not msg:
-            print("Reponse msg timed out!")
+        msg, handle = req
+        return handle(self._transaction(msg))
 
-        match msg:
-            case MsgType.confirmRec.value:
-                print(f"Msg confirmed {msg}")
-                self._msg_queue.task_done()
-                return
-            case MsgType.failedRec.value:
-                print("Msg was denied")
-                #TODO send a retry msg?
-                self._msg_queue.task_done()
-                return
-            case MsgType.sendRBuffSize.value:
-                ret = self._serial.read(1)
-                if not ret:
-                    print("Failed to receive buff size")
-                self._buffsize = int.from_bytes(ret)
-                self._msg_queue.task_done()
+
+    def _serial_send_msgs(self) -> None:
+        """
+        Send all queued msgs.
+        """
+        while True:
+            try:
+                packet = self._msg_queue.get_nowait()
+            except Empty:
                 return
-            case _:
-                print(f"Received unexpected return msg {msg}")
+
+            logger.debug("Sending msg: %s", packet["msg_arr"])
+            try:
+                self._on_msg(packet, self._transaction(packet["msg_arr"]))
+            finally:
                 self._msg_queue.task_done()
 
 
     def begin_com(self):
         if self._is_running:
-            print("The loop is already started")
+            logger.warning("The loop is already started")
             return
         
+        if self.capture is not None:
+            self.capture.start()
         self._thread = threading.Thread(target=self._loop)
         self._event = threading.Event()
         self._event.set()
@@ -268,9 +991,12 @@ class SerialCOM:
     
     def stop_com(self):
         if not self._is_running:
-            print("The loop is not active")
+            logger.warning("The loop is not active")
             return
         
         self._event.clear()
         self._thread.join()
+        self._disconnect()
+        if self.capture is not None:
+            self.capture.close()
         self._is_running = False
@@ -0,0 +1,194 @@
+import numpy as np
+
+from .path_maker import PathMaker
+
+
+# ball speed in mm/s of a rotation at the rim with the speed after homing,
+# which is what the patterns were drawn with before the speed was planned
+RIM_SPEED = PathMaker.RADIUS_LIMIT_MM*PathMaker.INIT_SPEED \
+    / PathMaker.ANGLE_STEPS_RAD
+MAX_SPEED = 3000 # steps per second the motors can run reliably
+
+
+def _window_min(a: np.ndarray, before: int, after: int) -> np.ndarray:
+    """
+    Sliding minimum over a[i - before:i + after + 1], the edges are padded
+    with the first and last value.
+    """
+    padded = np.pad(a, (before, after), mode="edge")
+    view = np.lib.stride_tricks.sliding_window_view(padded,
+                                                    before + after + 1)
+
+    return view.min(axis=1)
+
+
+def move_speeds(pts: np.ndarray, r0: int | None,
+                ball_speed: float) -> np.ndarray:
+    """
+    Motor speed of every move that drives the ball at ball_speed.
+    MultiStepper runs the axis with the longer move at the motor speed, see
+    PathMaker.estimate_time, so the move takes max(|dr|, |dphi|)/speed,
+    while the ball travels along the spiral segment between the positions.
+
+    :param pts: positions in steps as np.array([N, 2]) of absolute r and
+        relative phi
+    :param r0: r in steps before the first position. If None, the first
+        move is a pure rotation.
+    :param ball_speed: speed of the ball in mm/s
+
+    :return: speed in steps per second of every move as np.array([N]),
+        inf for moves that don't move the ball
+    """
+    r = pts[:, 0].astype(np.float64)
+    dr = np.diff(r, prepend=r[0] if r0 is None else r0)
+    dphi = pts[:, 1].astype(np.float64)
+
+    steps = np.maximum(np.abs(dr), np.abs(dphi))
+    r_mid = (r - dr/2)/PathMaker.RADIUS_STEPS_MM
+    length = np.hypot(dr/PathMaker.RADIUS_STEPS_MM,
+                      r_mid*dphi/PathMaker.ANGLE_STEPS_RAD)
+
+    return np.divide(ball_speed*steps, length,
+                     out=np.full(steps.shape, np.inf), where=length > 0)
+
+
+def plan_speeds(pts: np.ndarray, r0: int | None = None,
+                ball_speed: float = RIM_SPEED,
+                min_speed: int = 100, max_speed: int = MAX_SPEED,
+                tolerance: float = 0.25, lag: int = 9, min_run: int = 16
+                ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Plan the motor speed along a path, so the ball moves at about
+    ball_speed instead of a single motor speed that has to suit the rim.
+
+    A speed msg is applied by the sand table once the current move is
+    finished, so it reaches up to lag buffered positions before the one it
+    is queued in front of. Every position therefore gets the min speed of
+    itself and the lag positions before it. The speeds are rounded down to
+    steps of tolerance and runs shorter than min_run are lowered to their
+    neighbours, so only the speed changes that matter are sent. No move
+    is ever faster than its own speed.
+
+    :param pts: positions in steps as np.array([N, 2]) of absolute r and
+        relative phi
+    :param r0: r in steps before the first position, see move_speeds
+    :param ball_speed: target speed of the ball in mm/s
+    :param min_speed: lowest motor speed in steps per second
+    :param max_speed: highest motor speed in steps per second
+    :param tolerance: relative difference of neighbouring speed steps
+    :param lag: positions that may be in the buffer of the sand table, see
+        SerialCOM.MAX_FRAME_POSITIONS
+    :param min_run: min number of positions between two speed changes,
+        except when the speed has to drop
+
+    :return: tuple of the indices of the positions the speed changes at
+        and the speeds as int, the first index is always 0
+    """
+    if not 0 < min_speed <= max_speed < 2**16:
+        raise ValueError("Speeds must be uint16 and min_speed <= max_speed")
+
+    if pts.shape[0] == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.int64)
+
+    speed = np.clip(move_speeds(pts, r0, ball_speed), min_speed, max_speed)
+    speed = _window_min(speed, lag, 0)
+
+    # speed steps of min_speed*(1 + tolerance)**level
+    base = np.log1p(tolerance)
+    level = np.floor(np.log(speed/min_speed)/base + 1e-9)
+    # opening removes the peaks shorter than min_run and never raises
+    level = _window_min(level, min_run//2, min_run - 1 - min_run//2)
+    level = -_window_min(-level, min_run - 1 - min_run//2, min_run//2)
+
+    idx = np.flatnonzero(np.diff(level, prepend=np.nan))
+    speeds = np.minimum(min_speed*np.exp(level[idx]*base), max_speed)
+
+    return idx, speeds.astype(np.int64)
+
+
+class SpeedPlanner:
+    """
+    plan_speeds for a path that is sent in chunks, see PathMaker.chunks.
+    A speed change at the start of a chunk reaches back into the previous
+    chunk, so the last lag positions of every chunk are planned again with
+    the next one. Speed changes to the speed that is already set are
+    dropped.
+
+    :param ball_speed: target speed of the ball in mm/s
+    :param lag: positions that may be in the buffer of the sand table
+    :param kwargs: other arguments of plan_speeds
+    """
+    def __init__(self, ball_speed: float = RIM_SPEED, lag: int = 9,
+                 **kwargs):
+        self.ball_speed = ball_speed
+        self.lag = lag
+        self.kwargs = kwargs
+        self._tail = None
+        self._r0 = None
+        self._speed = None
+
+
+    def plan(self, pts: np.ndarray, r0: int | None = None) -> dict[int, int]:
+        """
+        :param pts: next chunk of positions, see plan_speeds
+        :param r0: r in steps before the first chunk, ignored for the
+            following chunks
+
+        :return: dict of the indices in the chunk the speed changes at and
+            the speeds
+        """
+        if pts.shape[0] == 0:
+            return {}
+
+        n = 0
+        if self._tail is not None:
+            n = self._tail.shape[0]
+            pts = np.concatenate((self._tail, pts))
+            r0 = self._r0
+
+        idx, speeds = plan_speeds(pts, r0, self.ball_speed, lag=self.lag,
+                                  **self.kwargs)
+        # the run the first position of the chunk belongs to
+        first = np.searchsorted(idx, n, side="right") - 1
+        idx = np.concatenate(([n], idx[first+1:])) - n
+        speeds = np.concatenate((speeds[first:first+1], speeds[first+1:]))
+
+        keep = max(pts.shape[0] - self.lag, 0)
+        self._r0 = int(pts[keep-1, 0]) if keep else r0
+        self._tail = np.array(pts[keep:])
+
+        ret = {}
+        for i, speed in zip(idx.tolist(), speeds.tolist()):
+            if speed != self._speed:
+                ret[i] = self._speed = speed
+
+        return ret
+
+
+
+def planned_time(pts: np.ndarray, r0: int | None = None,
+                 ball_speed: float = RIM_SPEED, **kwargs) -> float:
+    """
+    Estimate the drawing time with planned speeds, see
+    PathMaker.estimate_time.
+
+    :param pts: positions in steps as np.array([N, 2]) of absolute r and
+        relative phi, for example from PathMaker.encode
+    :param r0: r in steps before the first position, see move_speeds
+    :param ball_speed: target speed of the ball in mm/s
+    :param kwargs: other arguments of plan_speeds
+
+    :return: drawing time in s
+    """
+    idx, speeds = plan_speeds(pts, r0, ball_speed, **kwargs)
+    if not idx.size:
+        return 0.0
+
+    r = pts[:, 0].astype(np.int64)
+    dr = np.diff(r, prepend=r[0] if r0 is None else r0)
+    steps = np.maximum(np.abs(dr), np.abs(pts[:, 1].astype(np.int64)))
+    # speed of the run every move belongs to
+    speed = speeds[np.searchsorted(idx, np.arange(steps.shape[0]),
+                                   side="right") - 1]
+
+    return float((steps/speed).sum())
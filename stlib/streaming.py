@@ -0,0 +1,283 @@
+from functools import partial
+from typing import Callable, Iterable, Iterator
+import numpy as np
+
+from .load_svg import iter_polylines_from_svg
+from .path_maker import PathMaker, _round_positions, _simplify, _subdivide
+from .path_order import order_polylines
+
+
+def _array_chunks(pts: np.ndarray, size: int) -> Iterator[np.ndarray]:
+    for i in range(0, pts.shape[0], size):
+        yield pts[i:i+size]
+
+
+def _order_window(batch: list[np.ndarray],
+                  end: np.ndarray | None) -> np.ndarray:
+    """
+    Order the polylines of one window, see order_polylines. The window
+    starts at the end of the previous window, which is kept first as a
+    polyline of one point.
+    """
+    if end is None:
+        return np.vstack(order_polylines(batch))
+
+    return np.vstack(order_polylines([end[None], *batch])[1:])
+
+
+def _svg_chunks(filename: str, tol: float, size: int) -> Iterator[np.ndarray]:
+    """
+    Polylines of an svg file, see get_pts_from_svg, joined to chunks of
+    about size points. The polylines are flattened while they are read and
+    ordered within every chunk instead of all at once, so only one chunk is
+    held in memory. The moves between the chunks can therefore be longer
+    than with get_pts_from_svg.
+    """
+    batch, num, end = [], 0, None
+    for pl in iter_polylines_from_svg(filename, tol):
+        batch.append(pl)
+        num += pl.shape[0]
+        if num >= size:
+            chunk = _order_window(batch, end)
+            end = chunk[-1]
+            yield chunk
+            batch, num = [], 0
+
+    if batch:
+        yield _order_window(batch, end)
+
+
+
+class StreamingPath(PathMaker):
+    """
+    PathMaker that is compiled lazily in chunks while it is sent, for
+    patterns that are too large to compile at once. Every chunk of input
+    points is subdivided, simplified and converted to positions on its own,
+    so the memory stays bounded by the chunk size and the first positions
+    are ready after one chunk instead of the whole pattern. The arrays of
+    PathMaker, pts, pts_polar and positions, are therefore None.
+
+    The state at the chunk boundaries is carried over: the last input point
+    is subdivided and simplified together with the next chunk, phi is
+    unwrapped from the last angle and the phi steps are rounded from the
+    last absolute step, see _round_positions, so the result is the same as
+    compiling the points at once up to the points kept at the boundaries.
+
+    The source is called again for every iteration, nothing is stored in
+    between. The number of points is unknown until the first iteration is
+    sent, until then len() raises TypeError and total and reduction are
+    None.
+
+    :param source: function that returns an iterable of chunks of input
+        points as np.array([N, 2]) in mm, it must be picklable to compile
+        the path in a worker process
+    :param eps: desired accuracy, see PathMaker
+    :param rot_angle: rotate the path for this angle for the next run in
+        degrees
+    :param num_iterations: repeat the path n times
+    :param tol: simplification tolerance in mm, see PathMaker
+    """
+    def __init__(self, source: Callable[[], Iterable[np.ndarray]],
+                 eps: float = None, rot_angle: float = 5,
+                 num_iterations: int = 1, tol: float = None):
+        # the arrays are never calculated, see from_compiled for the
+        # attributes of PathMaker
+        self.pts = None
+        self.eps = eps
+        self.tol = tol
+        self.rot_steps = int(rot_angle*np.pi/180*self.ANGLE_STEPS_RAD)
+        self.num_iterations = num_iterations
+        self._iter_counter = 0
+        self.pts_polar = None
+        self.positions = None
+        self._pts_size = None
+        self._current_idx = 0
+        self.reduction = None
+
+        self._source = source
+        self._start = None
+        self._rows = None
+
+
+    @classmethod
+    def from_array(cls, pts: np.ndarray, chunk_size: int = 4096, **kwargs):
+        """
+        :param pts: input points as np.array([N, 2]) in mm
+        :param chunk_size: input points per chunk
+        :param kwargs: arguments of StreamingPath
+
+        :return: StreamingPath of the points
+        """
+        return cls(partial(_array_chunks, pts, chunk_size), **kwargs)
+
+
+    @classmethod
+    def from_svg(cls, filename: str, svg_tol: float = 0.1,
+                 chunk_size: int = 4096, **kwargs):
+        """
+        The svg file is parsed again for every iteration and its
+        polylines are ordered chunk by chunk, see _svg_chunks. Only the
+        path data of the file is held in memory besides the current chunk.
+
+        :param filename: path to svg file
+        :param svg_tol: max deviation of the flattened curves in mm, see
+            get_pts_from_svg
+        :param chunk_size: input points per chunk
+        :param kwargs: arguments of StreamingPath
+
+        :return: StreamingPath of the svg file
+        """
+        return cls(partial(_svg_chunks, filename, svg_tol, chunk_size),
+                   **kwargs)
+
+
+    def _compile(self) -> Iterator[np.ndarray]:
+        """
+        Compile one iteration chunk by chunk.
+
+        :return: generator of positions as int32 np.array([N, 2]) of
+            absolute r and relative phi, the first position of the path has
+            phi 0
+        """
+        prev = None # last input point of the previous chunk
+        phi_prev = None # its unwrapped phi in radians
+        steps_prev = None # and its absolute phi in steps
+        num_sub = num_kept = 0 # points before and after simplifying
+
+        for chunk in self._source():
+            chunk = np.asarray(chunk, dtype=np.float64)
+            if chunk.shape[0] == 0:
+                continue
+
+            if not np.all(chunk[:, 0] < self.RADIUS_LIMIT_MM):
+                raise ValueError(
+                    f"Max allowed R value is {self.RADIUS_LIMIT_MM}")
+
+            pts = chunk if prev is None else np.vstack((prev, chunk))
+            if self.eps is not None:
+                pts = _subdivide(pts, self.eps)
+            num_sub += pts.shape[0]
+            if self.tol is not None:
+                pts = pts[_simplify(pts, self.tol)]
+            # the first point was already sent with the previous chunk
+            if prev is not None:
+                num_sub -= 1
+                pts = pts[1:]
+            num_kept += pts.shape[0]
+            prev = chunk[-1]
+
+            r = np.hypot(pts[:, 0], pts[:, 1])
+            phi = np.atan2(pts[:, 1], pts[:, 0])
+            if phi_prev is None:
+                phi = np.unwrap(phi)
+                self._start = r[0], phi[0]
+            else:
+                phi = np.unwrap(np.concatenate(([phi_prev], phi)))[1:]
+            phi_prev = phi[-1]
+
+            positions = _round_positions(np.column_stack((r, phi)))
+            steps = round(phi[0]*self.ANGLE_STEPS_RAD)
+            if steps_prev is not None:
+                positions[0, 1] = steps - steps_prev
+            steps_prev = steps + int(positions[1:, 1].sum(dtype=np.int64))
+
+            yield positions
+
+        if self.tol is not None and num_sub:
+            self.reduction = 1 - num_kept/num_sub
+
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        """
+        Compile and encode the path chunk by chunk, including the rotation
+        points between the iterations, see PathMaker.chunks.
+
+        :return: generator of positions as big endian int32
+            np.array([N, 2])
+        """
+        num = 0
+        for it in range(self.num_iterations):
+            first = None
+            for positions in self._compile():
+                if first is None:
+                    first = positions[0, 0]
+                num += positions.shape[0]
+                yield positions.astype(">i4")
+
+            if first is None:
+                raise ValueError("The source has no points!")
+
+            if it == 0:
+                self._pts_size = num
+
+            if it < self.num_iterations - 1:
+                yield np.array([[first, self.rot_steps]], dtype=">i4")
+
+
+    def start_point(self) -> tuple[float, float]:
+        """
+        Compiles the first chunk if the path wasn't sent yet.
+        """
+        if self._start is None:
+            next(self._compile(), None)
+            if self._start is None:
+                raise ValueError("The source has no points!")
+
+        r, phi = self._start
+
+        return round(r*self.RADIUS_STEPS_MM)/self.RADIUS_STEPS_MM, phi
+
+
+    @property
+    def total(self) -> int | None:
+        if self._pts_size is None:
+            return None
+
+        return super().__len__()
+
+
+    def __len__(self) -> int:
+        if self._pts_size is None:
+            raise TypeError("The length is unknown until the path was sent")
+
+        return super().__len__()
+
+
+    def __next__(self) -> np.ndarray:
+        if self._rows is None:
+            self._rows = (row for chunk in self.chunks() for row in chunk)
+
+        return next(self._rows)
+
+
+    def encode(self) -> bytes:
+        """
+        Compiles the whole path into one buffer, see PathMaker.encode. Use
+        chunks() to keep the memory bounded.
+        """
+        return b"".join(chunk.tobytes() for chunk in self.chunks())
+
+
+    def estimate_time(self, speed: float = PathMaker.INIT_SPEED) -> float:
+        """
+        Compiles the whole path once chunk by chunk, see
+        PathMaker.estimate_time.
+        """
+        if speed <= 0:
+            raise ValueError(f"Speed must be positive and not {speed}!")
+
+        steps, r_prev = 0, None
+        for chunk in self.chunks():
+            pos = chunk.astype(np.int64)
+            dr = np.diff(pos[:, 0], prepend=pos[0, 0] if r_prev is None
+                         else r_prev)
+            steps += int(np.maximum(np.abs(dr), np.abs(pos[:, 1])).sum())
+            r_prev = pos[-1, 0]
+
+        return float(steps/speed)
+
+
+    def __repr__(self):
+        return f"StreamingPath object:\n" \
+                f"- {self._pts_size} calculated points\n" \
+                f"- {self.num_iterations} iterations\n"
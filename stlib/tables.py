@@ -0,0 +1,143 @@
+import logging
+import os
+from typing import TypedDict
+
+from .async_worker import AsyncWorker
+from .metrics import Registry
+from .playlist import Compiler, Playlist
+
+
+logger = logging.getLogger(__name__)
+
+
+class Table(TypedDict):
+    id: str
+    COM: str
+    worker: AsyncWorker
+    playlist: Playlist
+
+
+
+class TableRegistry:
+    """
+    Several sand tables that are driven from one process. Every table has
+    its own AsyncWorker, serial port, journal and Playlist, so the tables
+    draw independently. All playlists share one Compiler, so a pattern
+    that is sent to several tables is compiled once and the compiled path
+    is streamed to each of them. The svg patterns are also shared through
+    the PathCache, if it is in the params of the jobs.
+
+    Available methods:
+    - add() -> add a table before the registry is started
+    - get() -> table by its id
+    - start() -> start all tables
+    - stop() -> stop all tables
+    - status() -> progress and playlist of all tables
+
+    :param registry: where to register the metrics of the workers, they
+        are labeled with the port of the table
+    :param journal_dir: directory of the journals, one file per table. If
+        None, the tables are not journaled.
+    :param max_workers: number of compile processes for all tables
+    :param worker_kwargs: other arguments of AsyncWorker for all tables
+    """
+    def __init__(self, registry: Registry | None = None,
+                 journal_dir: str | None = None, max_workers: int = 2,
+                 **worker_kwargs):
+        self.registry = registry
+        self.journal_dir = journal_dir
+        self.worker_kwargs = worker_kwargs
+        self.compiler = Compiler(max_workers)
+        self.tables: dict[str, Table] = {}
+        self._started = False
+
+
+    def add(self, table_id: str, COM: str, **kwargs) -> Table:
+        """
+        Add a table. The first table is the default of get.
+
+        :param table_id: id of the table used in the routes and logs
+        :param COM: serial port or url, see AsyncSerialCOM
+        :param kwargs: arguments of AsyncWorker for this table
+
+        :return: the new table
+        """
+        if self._started:
+            raise RuntimeError("Tables must be added before the start!")
+        if table_id in self.tables:
+            raise ValueError(f"Table {table_id} already exists!")
+        if any(table["COM"] == COM for table in self.tables.values()):
+            raise ValueError(f"Port {COM} is already used!")
+
+        journal = None
+        if self.journal_dir is not None:
+            journal = os.path.join(self.journal_dir,
+                                   f"journal-{table_id}.jsonl")
+
+        worker = AsyncWorker(COM, self.registry, journal=journal,
+                             **(self.worker_kwargs | kwargs))
+        table = Table(id=table_id, COM=COM, worker=worker,
+                      playlist=Playlist(worker, compiler=self.compiler))
+        self.tables[table_id] = table
+
+        return table
+
+
+    def get(self, table_id: str | None = None) -> Table:
+        """
+        :param table_id: id of the table. If None, the first table.
+
+        :return: the table
+        """
+        if table_id is None:
+            if not self.tables:
+                raise KeyError("No tables")
+            return next(iter(self.tables.values()))
+
+        if table_id not in self.tables:
+            raise KeyError(f"No table with id {table_id}")
+
+        return self.tables[table_id]
+
+
+    async def start(self, home: bool = True) -> None:
+        """
+        Start the compiler and the workers and playlists of all tables.
+        Must be called from a running event loop. It doesn't wait for the
+        hardware, the tables are connected in the background and the
+        start and home msgs are sent once they answer.
+
+        :param home: home all tables
+        """
+        self.compiler.start()
+        for table in self.tables.values():
+            worker = table["worker"]
+            await worker.start_worker()
+            await worker.start()
+            if home:
+                await worker.home()
+            table["playlist"].start()
+            logger.info("Started table %s on %s", table["id"], table["COM"])
+
+        self._started = True
+
+
+    async def stop(self) -> None:
+        for table in self.tables.values():
+            await table["playlist"].stop()
+            await table["worker"].end_workers()
+
+        self.compiler.stop()
+        self._started = False
+
+
+    def status(self) -> list[dict]:
+        """
+        :return: list of dicts with the id, port, connection, progress and
+            playlist of every table
+        """
+        return [{"id": table["id"], "COM": table["COM"],
+                 "connected": table["worker"].com.connected,
+                 "progress": table["worker"].progress.status(),
+                 "playlist": table["playlist"].status()}
+                for table in self.tables.values()]
@@ -0,0 +1,592 @@
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+import serial
+
+from .serial_com import MsgType
+
+
+# make "sandtable://" urls available to serial.serial_for_url
+if __package__ not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append(__package__)
+
+
+class VirtualTable:
+    """
+    Simulation of the firmware in SandTableArduino. It parses the same
+    messages as SerialCom.cpp, keeps the positions in a rolling buffer of
+    the same size and moves the motors like MotorDrive, where MultiStepper
+    moves both motors at constant speed so that they arrive at the same
+    time as the slower one running at max speed.
+
+    The simulation is event driven and is advanced to the current time
+    whenever the host reads or writes, so no extra thread is needed.
+
+    Available attributes
+    - position -> current [r, phi] position in steps
+    - buffer -> positions waiting in the rolling buffer
+    - done -> number of positions that were reached
+    - trace -> reached positions if keep_trace is set
+
+    :param latency: delay in s of every transfer in both directions
+    :param time_scale: how much faster than real time the motors move
+    :param drop_rate: probability that a response gets lost
+    :param corrupt_rate: probability that a byte of a received chunk is
+        corrupted
+    :param baudrate: used to calculate the transfer time of the bytes
+    :param seed: seed for the error injection
+    :param keep_trace: store every reached position
+    """
+
+    RBUFF_SIZE = 10
+    POS_TIMEOUT = 0.1 # s without new bytes after which a frame is aborted
+    R_MIN_STEP_LIMIT = 0
+    R_MAX_STEP_LIMIT = 20700
+    HOMING_SPEED = 600
+    INIT_SPEED = 800
+    R_OFFSET = -300
+
+    def __init__(self, latency: float = 0, time_scale: float = 1,
+                 drop_rate: float = 0, corrupt_rate: float = 0,
+                 baudrate: int = 115200, seed: int | None = None,
+                 keep_trace: bool = False):
+        self.latency = latency
+        self.time_scale = time_scale
+        self.drop_rate = drop_rate
+        self.corrupt_rate = corrupt_rate
+        # start bit + 8 data bits + stop bit
+        self.byte_time = 10/baudrate
+        self.keep_trace = keep_trace
+
+        self._rand = random.Random(seed)
+        self._lock = threading.RLock()
+        # notified when the host writes
+        self._written = threading.Condition(self._lock)
+        self._rx: deque[tuple[float, bytes]] = deque()
+        self._tx: deque[tuple[float, bytes]] = deque()
+
+        # SerialCom.cpp
+        self._buffer: deque[tuple[int, int]] = deque()
+        self._state = "readHeader"
+        self._header = [0, 0]
+        self._data = bytearray()
+        self._pos_left = -1
+        self._pos_seq = None
+        self._pos_accepted = 0
+        # positions of the current frame until it is complete
+        self._frame: list[tuple[int, int]] = []
+        self._pos_timeout = float("inf")
+        # id and accepted positions of the last complete frame
+        self._last_seq = 0
+        self._last_accepted = 0
+        self._speed = 1000
+        self._speed_update = False
+
+        # MotorDrive.cpp
+        self._m_state = "home"
+        self._move_active = False
+        self._move_finished = False
+        self._max_speed = self.INIT_SPEED
+        self._command = [0, 0]
+        self._pos = [0, 0]
+        self._target = [0, 0]
+        self._move_start = 0.
+        self._move_end = float("inf")
+        # is the current move to a position from the buffer
+        self._from_buffer = False
+
+        self._done = 0
+        self._trace: list[tuple[int, int]] = []
+
+        now = time.monotonic()
+        self._start_homing(now)
+
+
+    @property
+    def position(self) -> list[float]:
+        with self._lock:
+            now = time.monotonic()
+            self.update(now)
+            return self._position_at(now)
+
+
+    @property
+    def buffer(self) -> list[tuple[int, int]]:
+        with self._lock:
+            self.update()
+            return list(self._buffer)
+
+
+    @property
+    def done(self) -> int:
+        with self._lock:
+            self.update()
+            return self._done
+
+
+    @property
+    def trace(self) -> list[tuple[int, int]]:
+        with self._lock:
+            self.update()
+            return list(self._trace)
+
+
+    def feed(self, data: bytes) -> None:
+        """
+        Bytes written by the host.
+
+        :param data: received bytes
+        """
+        if not data:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self.update(now)
+
+            if self._rand.random() < self.corrupt_rate:
+                data = bytearray(data)
+                data[self._rand.randrange(len(data))] ^= 0xFF
+                data = bytes(data)
+
+            self._rx.append((now + self.latency + len(data)*self.byte_time,
+                             data))
+            self._written.notify_all()
+
+
+    def fetch(self, size: int) -> bytes:
+        """
+        Bytes that were sent to the host and already arrived.
+
+        :param size: max number of bytes
+
+        :return: received bytes
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.update(now)
+
+            ret = bytearray()
+            while self._tx and self._tx[0][0] <= now and len(ret) < size:
+                t, data = self._tx.popleft()
+                missing = size - len(ret)
+                if len(data) > missing:
+                    self._tx.appendleft((t, data[missing:]))
+                    data = data[:missing]
+                ret += data
+
+            return bytes(ret)
+
+
+    def in_waiting(self) -> int:
+        """
+        Number of bytes that already arrived at the host.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.update(now)
+
+            return sum(len(data) for t, data in self._tx if t <= now)
+
+
+    def next_event(self) -> float:
+        """
+        Time of the next event that can cause a response.
+        """
+        with self._lock:
+            return min(self._rx[0][0] if self._rx else float("inf"),
+                       self._tx[0][0] if self._tx else float("inf"),
+                       self._move_end, self._pos_timeout)
+
+
+    def wait(self, timeout: float) -> None:
+        """
+        Wait until the next event or until the host writes.
+
+        :param timeout: max time to wait in s
+        """
+        with self._lock:
+            wait = min(self.next_event() - time.monotonic(), timeout)
+            if wait > 0:
+                self._written.wait(wait)
+
+
+    def reset_output(self) -> None:
+        with self._lock:
+            self._tx.clear()
+
+
+    def update(self, now: float | None = None) -> None:
+        """
+        Advance the simulation.
+
+        :param now: time to advance to, defaults to time.monotonic()
+        """
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            while True:
+                t_rx = self._rx[0][0] if self._rx else float("inf")
+                t = min(t_rx, self._move_end, self._pos_timeout)
+                if t > now:
+                    break
+
+                if self._pos_timeout < min(t_rx, self._move_end):
+                    self._abort_positions(t)
+                elif self._move_end <= t_rx:
+                    self._motion_done(self._move_end)
+                else:
+                    _, data = self._rx.popleft()
+                    for byte in data:
+                        self._read_byte(byte, t)
+                    if self._state == "readPositions":
+                        self._pos_timeout = t + self.POS_TIMEOUT
+
+                self._main_loop(t)
+
+
+    def _respond(self, t: float, msg: MsgType, data: bytes = b"") -> None:
+        if self._rand.random() < self.drop_rate:
+            return
+
+        msg = MsgType.headerA.value + MsgType.headerB.value + msg.value \
+            + data
+        self._tx.append((t + self.latency + len(msg)*self.byte_time, msg))
+
+
+    def _read_byte(self, byte: int, t: float) -> None:
+        """
+        Message parsing of SerialCom.cpp
+        """
+        match self._state:
+            case "readHeader":
+                self._header = [byte, self._header[0]]
+                if self._header[0] == MsgType.headerB.value[0] and \
+                        self._header[1] == MsgType.headerA.value[0]:
+                    self._state = "readMsg"
+            case "readMsg":
+                self._read_msg(byte, t)
+            case "readPosition":
+                self._data.append(byte)
+                if len(self._data) == 8:
+                    self._read_position(t)
+            case "readPositions":
+                self._read_positions(byte, t)
+            case "readSpeed":
+                self._data.append(byte)
+                if len(self._data) == 2:
+                    self._speed = int.from_bytes(self._data, "big")
+                    self._speed_update = True
+                    self._respond(t, MsgType.confirmRec)
+                    self._state = "readHeader"
+
+
+    def _read_msg(self, byte: int, t: float) -> None:
+        self._data = bytearray()
+        self._state = "readHeader"
+
+        try:
+            msg = MsgType(bytes([byte]))
+        except ValueError:
+            msg = None
+
+        match msg:
+            case MsgType.position:
+                self._state = "readPosition"
+            case MsgType.positions:
+                self._state = "readPositions"
+                self._pos_left = -1
+                self._pos_seq = None
+            case MsgType.speed:
+                self._state = "readSpeed"
+            case MsgType.getRBuffSize:
+                self._respond(t, MsgType.sendRBuffSize,
+                              bytes([len(self._buffer)]))
+            case MsgType.getFrameStatus:
+                self._respond(t, MsgType.sendFrameStatus,
+                              bytes([self._last_seq, self._last_accepted,
+                                     len(self._buffer)]))
+            case MsgType.start | MsgType.stop | MsgType.clear | \
+                    MsgType.home:
+                self._respond(t, MsgType.confirmRec)
+                self._control(msg, t)
+            case _:
+                self._respond(t, MsgType.failedRec)
+
+
+    def _is_full(self) -> bool:
+        return len(self._buffer) >= self.RBUFF_SIZE - 1
+
+
+    def _read_position(self, t: float) -> None:
+        self._state = "readHeader"
+        if self._is_full():
+            self._respond(t, MsgType.bufferFull)
+            return
+
+        self._buffer.append((int.from_bytes(self._data[:4], "big", signed=True),
+                            int.from_bytes(self._data[4:], "big", signed=True)))
+        self._respond(t, MsgType.confirmRec)
+
+
+    def _read_positions(self, byte: int, t: float) -> None:
+        if self._pos_seq is None:
+            self._pos_seq = byte
+            return
+
+        if self._pos_left < 0:
+            self._pos_left = byte
+            self._frame = []
+        else:
+            self._data.append(byte)
+
+        if len(self._data) == 8:
+            pos = (int.from_bytes(self._data[:4], "big", signed=True),
+                   int.from_bytes(self._data[4:], "big", signed=True))
+            self._data = bytearray()
+            self._pos_left -= 1
+
+            if len(self._frame) < self.RBUFF_SIZE - 1:
+                self._frame.append(pos)
+
+        if self._pos_left == 0:
+            self._pos_accepted = 0
+            for pos in self._frame:
+                if self._is_full():
+                    break
+                self._buffer.append(pos)
+                self._pos_accepted += 1
+
+            self._frame = []
+            self._pos_timeout = float("inf")
+            self._last_seq = self._pos_seq
+            self._last_accepted = self._pos_accepted
+            self._respond(t, MsgType.positionsRec,
+                          bytes([self._pos_seq, self._pos_accepted,
+                                 len(self._buffer)]))
+            self._pos_left = -1
+            self._state = "readHeader"
+
+
+    def _abort_positions(self, t: float) -> None:
+        """
+        A frame that stopped arriving is aborted without accepting any of
+        its positions, see SerialCOM::abortPositions.
+        """
+        self._frame = []
+        self._data = bytearray()
+        self._pos_timeout = float("inf")
+
+        if self._pos_left < 0:
+            self._respond(t, MsgType.failedRec)
+        else:
+            self._last_seq = self._pos_seq
+            self._last_accepted = 0
+            self._respond(t, MsgType.positionsRec,
+                          bytes([self._pos_seq, 0, len(self._buffer)]))
+
+        self._pos_left = -1
+        self._state = "readHeader"
+
+
+    def _control(self, msg: MsgType, t: float) -> None:
+        """
+        Handling of the control messages in SandTableArduino.ino
+        """
+        match msg:
+            case MsgType.home:
+                self._start_homing(t)
+            case MsgType.start:
+                self._m_state = "moveActive"
+                self._move_active = True
+                self._start_move(t)
+            case MsgType.stop:
+                self._stop_motors(t)
+                self._m_state = "idle"
+                self._move_active = False
+            case MsgType.clear:
+                self._stop_motors(t)
+                self._m_state = "idle"
+                self._move_finished = True
+                self._buffer.clear()
+
+
+    def _main_loop(self, t: float) -> None:
+        """
+        Take the next position from the buffer once a move is finished.
+        """
+        if not (self._move_finished and self._move_active):
+            return
+
+        if self._speed_update:
+            self._speed_update = False
+            self._max_speed = self._speed
+
+        if not self._buffer:
+            return
+
+        r, phi = self._buffer.popleft()
+        self._command[0] = min(max(r, self.R_MIN_STEP_LIMIT),
+                               self.R_MAX_STEP_LIMIT)
+        self._command[1] += phi
+        self._m_state = "moveActive"
+        self._move_finished = False
+        self._stop_motors(t)
+        self._target = list(self._command)
+        self._from_buffer = True
+        self._start_move(t)
+
+
+    def _position_at(self, t: float) -> list[float]:
+        if self._m_state != "moveActive" or self._move_end == float("inf"):
+            return list(self._pos)
+
+        duration = self._move_end - self._move_start
+        frac = 1 if duration <= 0 else min(1, (t - self._move_start)/duration)
+
+        return [p + (q - p)*frac for p, q in zip(self._pos, self._target)]
+
+
+    def _stop_motors(self, t: float) -> None:
+        if self._m_state == "moveActive":
+            self._pos = self._position_at(t)
+        self._move_end = float("inf")
+
+
+    def _start_move(self, t: float) -> None:
+        """
+        MultiStepper.moveTo: the motor with the longer distance runs at max
+        speed and the other one is slowed down to arrive at the same time.
+        """
+        dist = max(abs(q - p) for p, q in zip(self._pos, self._target))
+        self._move_start = t
+        self._move_end = t + dist/self._max_speed/self.time_scale
+
+
+    def _start_homing(self, t: float) -> None:
+        self._stop_motors(t)
+        self._m_state = "home"
+        self._move_start = t
+        self._move_end = t + max(self._pos[0], 0)/self.HOMING_SPEED \
+            / self.time_scale
+
+
+    def _motion_done(self, t: float) -> None:
+        if self._m_state == "home":
+            self._pos = [self.R_OFFSET, 0]
+            self._max_speed = self.INIT_SPEED
+            self._m_state = "moveActive"
+            self._target = list(self._command)
+            self._start_move(t)
+            return
+
+        self._pos = list(self._target)
+        self._move_end = float("inf")
+        self._m_state = "moveFinished"
+        self._move_finished = True
+
+        if self._from_buffer:
+            self._from_buffer = False
+            self._done += 1
+            if self.keep_trace:
+                self._trace.append(tuple(self._pos))
+
+
+
+class VirtualSerial(serial.SerialBase):
+    """
+    serial.Serial compatible port that is connected to a VirtualTable.
+    Opened with serial.serial_for_url("sandtable://") where the parameters
+    of the VirtualTable can be given as a query, for example
+    "sandtable://?latency=0.002&time_scale=10&drop_rate=0.01".
+    """
+
+    def open(self) -> None:
+        if self._port is None:
+            raise serial.SerialException("Port must be configured first")
+        if self.is_open:
+            raise serial.SerialException("Port is already open")
+
+        self.table = VirtualTable(baudrate=self._baudrate,
+                                  **self._parse_url(self.portstr))
+        self.is_open = True
+
+
+    def _parse_url(self, url: str) -> dict:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme != "sandtable":
+            raise serial.SerialException(
+                f"Expected a url like sandtable://?latency=0.01 not {url}")
+
+        types = {"latency": float, "time_scale": float, "drop_rate": float,
+                 "corrupt_rate": float, "seed": int,
+                 "keep_trace": lambda val: val.lower() in ("1", "true")}
+        kwargs = {}
+        for key, values in urllib.parse.parse_qs(parts.query).items():
+            if key not in types:
+                raise serial.SerialException(f"Unknown option {key}")
+            kwargs[key] = types[key](values[0])
+
+        return kwargs
+
+
+    def _reconfigure_port(self) -> None:
+        pass
+
+
+    def close(self) -> None:
+        self.is_open = False
+
+
+    def from_url(self, url: str) -> str:
+        return url
+
+
+    @property
+    def in_waiting(self) -> int:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        return self.table.in_waiting()
+
+
+    def read(self, size: int = 1) -> bytes:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+
+        timeout = serial.Timeout(self._timeout)
+        data = bytearray()
+        while len(data) < size:
+            data += self.table.fetch(size - len(data))
+            if len(data) >= size or timeout.expired():
+                break
+
+            left = timeout.time_left()
+            self.table.wait(0.1 if left is None else left)
+
+        return bytes(data)
+
+
+    def write(self, data: bytes) -> int:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+
+        data = bytes(data)
+        self.table.feed(data)
+        return len(data)
+
+
+    def flush(self) -> None:
+        pass
+
+
+    def reset_input_buffer(self) -> None:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        self.table.reset_output()
+
+
+    def reset_output_buffer(self) -> None:
+        pass
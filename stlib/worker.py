@@ -1,25 +1,270 @@
-from queue import Queue
-from .path_maker import PathMaker
+from queue import Empty, Queue
+from .engines import compile_path
+from .journal import Journal, resume_positions
+from .metrics import Registry, WorkerMetrics
+from .path_maker import PathMaker, TransitionSpiral
+from .progress import ProgressTracker
 from .serial_com import SerialCOM
+from .speed_plan import SpeedPlanner
+import logging
 import threading
 import time
+from typing import Generator
+import numpy as np
 
 
-class Worker:
+logger = logging.getLogger(__name__)
+
+
+class PathSender:
+    """
+    Turns PathMakers into the chunks of positions and the speeds of the
+    position queue and keeps the progress, journal and metrics of the
+    patterns up to date. Worker and AsyncWorker share it and only add the
+    queueing and waiting, see _path_items.
+
+    :param com: SerialCOM or AsyncSerialCOM the paths are sent with
+    :param q_path: queue of the PathMakers, a queue.Queue or an
+        asyncio.Queue
+    :param registry: where to register the metrics
+    :param erase: draw a TransitionSpiral before every PathMaker
+    :param ball_diameter: diameter of the ball in mm
+    :param journal: file to journal the drawn patterns in, see Worker
+    :param ball_speed: target speed of the ball in mm/s, see Worker
+    """
+    CLEAR_TIMEOUT = 10 # s to wait for the confirmation of a clear
+
+    def __init__(self, com, q_path, registry: Registry | None = None,
+                 erase: bool = True, ball_diameter: float = 10,
+                 journal: str | None = None,
+                 ball_speed: float | None = None):
+        self.q_path = q_path
+        self.com = com
+        self.erase = erase
+        self.ball_diameter = ball_diameter
+        self.ball_speed = ball_speed
+        self._skip = False
+        # last queued [r, phi] position in steps, phi is the sum of all
+        # sent phi steps
+        self._pos = [0, 0]
+        # epoch of the position queue _pos belongs to, see _after_clear
+        self._pos_epoch = com.epoch
+        self.metrics = WorkerMetrics(com.COM, self.q_path.qsize, registry)
+        self.progress = ProgressTracker(self.com)
+        self.journal = None if journal is None else Journal(journal, self.com)
+
+
+    def skip(self):
+        """
+        Stop adding the points of the current PathMaker to the position
+        queue.
+        """
+        self._skip = True
+
+
+    def _clear_paths(self) -> None:
+        """
+        Remove the queued PathMakers, see stop.
+        """
+        while not self.q_path.empty():
+            self.q_path.get_nowait()
+            self.q_path.task_done()
+
+
+    def _after_clear(self, epoch: int, confirmed: bool) -> None:
+        """
+        Continue at the position the sand table stands at after the clear
+        that started the epoch, the positions that were still queued were
+        never drawn.
+
+        :param epoch: epoch of the position queue after the clear
+        :param confirmed: whether the clear was confirmed, see
+            SerialCOM.wait_cleared
+        """
+        self._pos_epoch = epoch
+        if confirmed:
+            self._pos = list(self.com.clear_position)
+        else:
+            logger.warning("The clear wasn't confirmed, continuing at the "
+                           "last queued position")
+
+
+    def _interrupted(self, epoch: int, pattern: bool) -> bool:
+        """
+        :return: True if the position queue was cleared since epoch or the
+            pattern was skipped
+        """
+        if self.com.epoch != epoch:
+            logger.info("Cleared the rest of the path")
+            return True
+
+        if pattern and self._skip:
+            logger.info("Skipped the rest of the path")
+            return True
+
+        return False
+
+
+    def _transition(self, pm: PathMaker) -> TransitionSpiral | None:
+        """
+        :return: the TransitionSpiral that erases the table before the
+            PathMaker or None if it isn't erased
+        """
+        if not self.erase or isinstance(pm, TransitionSpiral):
+            return None
+
+        transition = TransitionSpiral.between(self._pos, pm,
+                                              self.ball_diameter)
+        logger.info("Erasing with %d revolutions", len(transition) - 1)
+
+        return transition
+
+
+    def _path_items(self, pm: PathMaker, pattern: bool, start: int,
+                    epoch: int) -> Generator[int | memoryview, None, bool]:
+        """
+        Split the PathMaker into the items of the position queue: speeds
+        as int, see queue_speed, and encoded positions of at most one frame,
+        see send_packets. The PathMaker is compiled chunk by chunk, see
+        PathMaker.chunks, so a StreamingPath is compiled while the first
+        chunks are drawn. An item counts as queued once the next one is
+        requested.
+
+        :param pm: PathMaker to send
+        :param pattern: update the progress metrics, journal the path and
+            stop when skip is called
+        :param start: index of the first point, used to resume a path
+        :param epoch: epoch of the position queue the PathMaker was taken
+            in, it stops once the queue is cleared
+
+        :return: generator of the items that returns True if all points
+            were queued
+        """
+        name = pm.name or type(pm).__name__
+        step = self.com.MAX_FRAME_POSITIONS
+        journal = self.journal if pattern and pm.source is not None \
+            else None
+        if journal is not None:
+            journal.start(pm.source, pm.total, pm.iteration_size, start)
+
+        planner = None if self.ball_speed is None \
+            else SpeedPlanner(self.ball_speed, lag=step)
+        path_id = None
+        # index of the first point of the chunk and phi steps before it
+        offset = 0
+        phi0 = pm.start_point()[1]*pm.ANGLE_STEPS_RAD if start else 0
+
+        for pts in pm.chunks():
+            if offset + pts.shape[0] <= start:
+                offset += pts.shape[0]
+                phi0 += int(pts[:, 1].sum(dtype=np.int64))
+                continue
+
+            if offset < start:
+                pts = resume_positions(pts, start - offset, phi0,
+                                       self._pos[1])
+                offset = start
+
+            if self._interrupted(epoch, pattern):
+                if journal is not None:
+                    journal.end()
+                return False
+
+            data = memoryview(pts.reshape(-1).view(np.uint8))
+            # bytes of an encoded position
+            size = pts.itemsize*2
+            path_id = self.progress.add(name, pts, self._pos[1], pattern,
+                                        path_id, offset, pm.total)
+            speeds = {} if planner is None \
+                else planner.plan(pts, self._pos[0])
+
+            # the chunks also end where the speed changes
+            num = pts.shape[0]
+            bounds = sorted(set(range(0, num, step)) | speeds.keys())
+
+            for i, end in zip(bounds, bounds[1:] + [num]):
+                if self._interrupted(epoch, pattern):
+                    if journal is not None:
+                        journal.end()
+                    return False
+
+                if i in speeds:
+                    yield speeds[i]
+
+                yield data[i*size:end*size]
+                chunk = pts[i:end]
+                self._pos[0] = int(chunk[-1, 0])
+                self._pos[1] += int(chunk[:, 1].sum())
+
+                if pattern:
+                    self.metrics.points_sent.set(offset + end)
+
+            offset += num
+
+        if path_id is not None:
+            self.progress.set_total(path_id, pm.total)
+        if journal is not None:
+            journal.set_size(pm.total, pm.iteration_size)
+
+        return True
+
+
+    def _resume_point(self) -> tuple[dict, int] | None:
+        """
+        :return: tuple of the source of the unfinished pattern of the
+            journal and the index of the first point that is sent again or
+            None if there is nothing to resume
+        """
+        pending = self.journal.pending()
+        if pending is None:
+            return None
+
+        source = pending["source"]
+        # the last acknowledged positions may still be in the buffer of the
+        # sand table
+        index = max(pending["index"] - self.com.RBUFF_SIZE, 0)
+        logger.info("Resuming %s at point %d", source["name"], index)
+
+        return source, index
+
+
+
+class Worker(PathSender):
     """
     Worker class that handles the given PathMakers and Communication to the
-    Sand table.
+    Sand table. Before every PathMaker a TransitionSpiral from the last
+    queued position to its start is drawn to erase the table.
+
+    :param COM: serial port or url, see SerialCOM
+    :param registry: where to register the metrics
+    :param erase: draw a TransitionSpiral before every PathMaker
+    :param ball_diameter: diameter of the ball in mm
+    :param journal: file to journal the drawn patterns in. If given, an
+        unfinished pattern is resumed when the worker starts, see Journal.
+    :param ball_speed: target speed of the ball in mm/s. If given, the
+        motor speed is planned along every path and queued in between the
+        positions, see plan_speeds. If None, all paths are drawn with the
+        last speed set with update_speed.
+    :param capture: file to log the serial traffic to, see SerialCOM
     """
-    def __init__(self, COM: str):
-        self.q_path: Queue[PathMaker] = Queue()
-        self.com = SerialCOM(COM)
+    def __init__(self, COM: str, registry: Registry | None = None,
+                 erase: bool = True, ball_diameter: float = 10,
+                 journal: str | None = None,
+                 ball_speed: float | None = None,
+                 capture: str | None = None):
+        super().__init__(SerialCOM(COM, registry, capture), Queue(),
+                         registry, erase, ball_diameter, journal,
+                         ball_speed)
         self._event = threading.Event()
         self._thread_active = False
+        # the PathMaker and the epoch of the position queue are taken
+        # together, see stop
+        self._lock = threading.Lock()
 
 
     def add_PathMaker(self, item: PathMaker):
         self.q_path.put(item)
-        print("Added to queue")
+        logger.info("Added to queue")
 
 
     def home(self):
@@ -27,54 +272,165 @@ class Worker:
 
 
     def stop(self, clear: bool = False):
-        #TODO also clear pos queue and remove pathmakers
-        self.com.stop(clear)
+        """
+        Stop the sand table, the msg is sent ahead of the queued positions.
+
+        :param clear: also remove the queued PathMakers and the queued
+            positions, the current PathMaker isn't queued any further
+        """
+        if not clear:
+            self.com.stop(clear)
+            return
+
+        with self._lock:
+            self._clear_paths()
+            # all paths that were taken before are sent with an old epoch
+            # and dropped, see SerialCOM.stop
+            self.com.stop(clear)
+        self.progress.clear()
+        logger.info("Cleared the queue")
 
 
     def start(self):
         self.com.start()    
 
 
+    def _send_path(self, pm: PathMaker, pattern: bool = True,
+                   start: int = 0, epoch: int | None = None) -> bool:
+        """
+        Add all points of the PathMaker to the position queue, see
+        _path_items. It waits while the queue is full.
+
+        :param pm: PathMaker to send
+        :param pattern: see _path_items
+        :param start: index of the first point, used to resume a path
+        :param epoch: epoch of the position queue the PathMaker was taken
+            in. If None, the current epoch.
+
+        :return: True if all points were queued
+        """
+        epoch = self.com.epoch if epoch is None else epoch
+        items = self._path_items(pm, pattern, start, epoch)
+
+        while True:
+            try:
+                item = next(items)
+            except StopIteration as e:
+                return e.value
+
+            if isinstance(item, int):
+                self.com.queue_speed(item, epoch)
+            else:
+                # wait until a slot gets freed
+                self.com.send_packets(item, epoch)
+
+
+    def _resume(self) -> None:
+        """
+        Continue the unfinished pattern of the journal with the points that
+        were not acknowledged. The path is compiled again from its source,
+        which loads it from the PathCache for svg patterns.
+        """
+        resume = self._resume_point()
+        if resume is None:
+            return
+        source, index = resume
+
+        try:
+            pm = compile_path(source["engine"], source["params"])
+            pm.name = source["name"]
+            pm.source = source
+
+            if index == 0:
+                # nothing was drawn yet, so the table can be erased
+                self.add_PathMaker(pm)
+                return
+
+            self.metrics.start_pattern(pm.name, pm.total)
+            if self._send_path(pm, start=index):
+                self.metrics.patterns.inc()
+
+        except Exception as e:
+            logger.exception("Failed to resume %s: %s", source["name"], e)
+
+
+    def _wait_cleared(self, epoch: int) -> bool:
+        """
+        Wait until the clear that started the epoch is confirmed or the
+        worker ends.
+
+        :return: True if the clear was confirmed
+        """
+        end = time.monotonic() + self.CLEAR_TIMEOUT
+        while self._event.is_set() and time.monotonic() < end:
+            if self.com.wait_cleared(epoch, 0.5):
+                return True
+
+        return False
+
+
     def _position_worker(self):
+        if self.journal is not None:
+            self._resume()
+
         while self._event.is_set():
-            if self.q_path.empty():
+            with self._lock:
+                try:
+                    pm = self.q_path.get_nowait()
+                except Empty:
+                    pm = None
+                epoch = self.com.epoch
+
+            if pm is None:
                 time.sleep(0.5)
                 continue
             try:
-                pm = self.q_path.get()
-                print("Got PathMaker")
+                logger.info("Got PathMaker")
+                self._skip = False
+                if epoch != self._pos_epoch:
+                    self._after_clear(epoch, self._wait_cleared(epoch))
+
+                transition = self._transition(pm)
+                if transition is not None:
+                    self._send_path(transition, pattern=False, epoch=epoch)
+
+                self.metrics.start_pattern(pm.name or type(pm).__name__,
+                                           pm.total)
+
+                if self._send_path(pm, epoch=epoch):
+                    self.metrics.patterns.inc()
+                    logger.info("Path fully added to pos queue")
 
-                for val in pm:
-                    # wait until a slot gets freed
-                    self.com.send_pos(val)
-                
                 self.q_path.task_done()
-                print("Path fully added to pos queue")
 
             except Exception as e:
-                print(f"Fail: {e}")
+                logger.exception("Fail: %s", e)
                 self.q_path.task_done()
 
 
     def start_worker(self):
         if self._thread_active:
-            print("Thread already active")
+            logger.warning("Thread already active")
             return
         
+        if self.journal is not None:
+            self.journal.open()
         self._worker_thread = threading.Thread(target=self._position_worker)
         self._event.set()
         self._worker_thread.start()
         self._thread_active = True
         self.com.begin_com()
-        print("Started workers")
+        logger.info("Started workers")
 
     
     def end_workers(self):
         if not self._thread_active:
-            print("Thread not active")
+            logger.warning("Thread not active")
             return
         
         self._event.clear()
         self.com.stop_com()
         self._worker_thread.join()
         self._thread_active = False
+        if self.journal is not None:
+            self.journal.close()
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+import pytest
+
+import replay
+from stlib.capture import CaptureKind, CaptureWriter, read_capture
+from stlib.metrics import Registry
+from stlib.serial_com import SerialCOM
+
+
+URL = "sandtable://?time_scale=20&latency=0.001"
+
+
+def test_records_are_read_back(tmp_path):
+    writer = CaptureWriter(str(tmp_path/"capture.bin"))
+    writer.start()
+    long = bytes(range(256))*300
+    writer.record(CaptureKind.open, b"COM9")
+    writer.record(CaptureKind.write, memoryview(b"ab\x71"))
+    writer.record(CaptureKind.read, b"")
+    writer.record(CaptureKind.read, long)
+    writer.close()
+
+    records = list(read_capture(writer.filename))
+    assert [rec["kind"] for rec in records[:3]] == \
+        [CaptureKind.open, CaptureKind.write, CaptureKind.read]
+    assert records[1]["data"] == b"ab\x71" and records[2]["data"] == b""
+    # longer reads are split into records of at most 2**16 - 1 bytes
+    assert b"".join(rec["data"] for rec in records[3:]) == long
+    times = [rec["time"] for rec in records]
+    assert times == sorted(times)
+
+
+def test_torn_record_is_ignored(tmp_path):
+    writer = CaptureWriter(str(tmp_path/"capture.bin"))
+    writer.start()
+    writer.record(CaptureKind.write, b"ab\x71")
+    writer.record(CaptureKind.read, b"ab\x72\x00")
+    writer.close()
+
+    with open(writer.filename, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 1)
+
+    assert [rec["data"] for rec in read_capture(writer.filename)] == \
+        [b"ab\x71"]
+
+
+def test_other_file_is_rejected(tmp_path):
+    (tmp_path/"other.bin").write_bytes(b"not a capture")
+
+    with pytest.raises(ValueError):
+        list(read_capture(str(tmp_path/"other.bin")))
+
+
+def test_captured_session_is_summarized_and_replayed(tmp_path):
+    filename = str(tmp_path/"capture.bin")
+    com = SerialCOM(URL, Registry(), capture=filename)
+    com.begin_com()
+    try:
+        assert com.wait_ready(5)
+        com.start()
+        pos = np.column_stack((1000 + np.arange(50), np.full(50, 7)))
+        com.send_packets(pos.astype(">i4").tobytes())
+        end = time.monotonic() + 10
+        while com.acked < 50:
+            assert time.monotonic() < end, "timed out"
+            time.sleep(0.01)
+    finally:
+        com.stop_com()
+
+    records = list(read_capture(filename))
+    assert records[0]["kind"] == CaptureKind.open
+    report = replay.summarize(records)
+    assert report["positions_accepted"] == report["positions_sent"] == 50
+    assert report["msgs"]["positions"] >= 50//SerialCOM.MAX_FRAME_POSITIONS
+    assert report["ack_latency"]["samples"] > 0
+
+    # the replay writes the same msgs, the motors of the virtual table
+    # are fast enough for all of them
+    replayed = replay.replay(records, "sandtable://?time_scale=1000",
+                             speed=0, timeout=1)
+    again = replay.summarize(replayed)
+    assert again["msgs"] == report["msgs"]
+    assert again["positions_accepted"] == again["positions_sent"] == 50
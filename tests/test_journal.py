@@ -0,0 +1,110 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from stlib.journal import Journal, resume_positions
+from stlib.path_maker import PathMaker
+
+
+SOURCE = {"id": 1, "engine": "SpiralAboutCenter", "name": "spiral",
+          "params": {"r0": 0, "r1": 100, "num_revolutions": 3}}
+
+
+@pytest.fixture
+def com():
+    """
+    The counters of SerialCOM the journal reads.
+    """
+    return SimpleNamespace(queued=0, acked=0)
+
+
+def records(journal: Journal) -> list[dict]:
+    with open(journal.path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_pending_returns_the_last_acked_index(tmp_path, com):
+    journal = Journal(str(tmp_path/"journal"), com, interval=60)
+    assert journal.pending() is None
+
+    com.queued = 20
+    journal.open()
+    journal.start(SOURCE, total=101, size=50)
+    com.queued += 101
+    com.acked = 20 + 60
+    journal.close()
+
+    assert journal.pending() == {"source": SOURCE, "index": 60}
+    # the rotation between the iterations is one more point
+    assert records(journal)[-1] == {"i": 60, "it": 1}
+
+
+def test_start_truncates_the_journal(tmp_path, com):
+    journal = Journal(str(tmp_path/"journal"), com, interval=60)
+    journal.open()
+    journal.start(SOURCE, total=100, size=100)
+    com.queued, com.acked = 100, 50
+    journal.close()
+
+    journal.open()
+    journal.start(SOURCE | {"id": 2}, total=None, size=None)
+    journal.close()
+
+    assert [record.get("op") for record in records(journal)] == ["start"]
+    assert journal.pending() == {"source": SOURCE | {"id": 2}, "index": 0}
+
+
+def test_finished_pattern_is_not_pending(tmp_path, com):
+    journal = Journal(str(tmp_path/"journal"), com, interval=60)
+    journal.open()
+    journal.start(SOURCE, total=100, size=100)
+    com.queued, com.acked = 100, 100
+    journal.close()
+
+    assert records(journal)[-1] == {"op": "end"}
+    assert journal.pending() is None
+
+
+def test_resumed_pattern_keeps_its_index(tmp_path, com):
+    journal = Journal(str(tmp_path/"journal"), com, interval=60)
+    com.queued = com.acked = 500
+    journal.open()
+    # the points before the offset were drawn before the restart
+    journal.start(SOURCE, total=100, size=100, offset=40)
+    com.queued += 60
+    com.acked += 10
+    journal.close()
+
+    assert journal.pending()["index"] == 50
+
+
+def test_torn_record_is_ignored(tmp_path, com):
+    journal = Journal(str(tmp_path/"journal"), com, interval=60)
+    journal.open()
+    journal.start(SOURCE, total=100, size=100)
+    com.queued, com.acked = 100, 30
+    journal.close()
+
+    with open(journal.path, "a") as f:
+        f.write('{"i": 4')
+
+    assert journal.pending() == {"source": SOURCE, "index": 30}
+
+
+@pytest.mark.parametrize("phi", [0, 10**6, -10**6])
+def test_resume_positions_continue_at_the_index(phi):
+    pts = np.column_stack((np.arange(100, 200), np.full(100, 300)))
+    phi0 = 1234
+    resumed = resume_positions(pts, 40, phi0, phi)
+
+    # the rest of the pattern is unchanged
+    assert np.array_equal(resumed[1:], pts[41:])
+    assert resumed[0, 0] == pts[40, 0]
+    # the first move reaches the angle of the point the shorter way
+    full = 2*np.pi*PathMaker.ANGLE_STEPS_RAD
+    target = phi0 + pts[:41, 1].sum()
+    assert abs(resumed[0, 1]) <= full/2 + 1
+    d = (phi + resumed[0, 1] - target)/PathMaker.ANGLE_STEPS_RAD
+    assert np.cos(d) == pytest.approx(1)
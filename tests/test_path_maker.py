@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from stlib.load_svg import get_pts_from_svg
+from stlib.path_maker import PathMaker, TransitionSpiral, _calc_trajectory, \
+    _subdivide
+from stlib.streaming import StreamingPath
+
+
+DATA = Path(__file__).parent.parent/"data"
+
+
+def arc(angle: float, num: int = 400, r: float = 100) -> np.ndarray:
+    t = np.linspace(0, angle, num)
+    return np.column_stack((r*np.cos(t), r*np.sin(t)))
+
+
+def rotation(positions: np.ndarray) -> float:
+    """
+    :return: rotation of the positions in degrees
+    """
+    return np.degrees(positions[:, 1].sum()/PathMaker.ANGLE_STEPS_RAD)
+
+
+@pytest.mark.parametrize("angle", [270, 360, 720])
+def test_simplify_keeps_the_rotation(angle):
+    pts = arc(np.radians(angle))
+    pm = PathMaker(pts, eps=1, tol=0.5)
+
+    assert rotation(pm.positions) == pytest.approx(angle, abs=0.1)
+    # the remaining points are less than pi apart
+    assert np.all(np.abs(pm.positions[1:, 1])
+                  < np.pi*PathMaker.ANGLE_STEPS_RAD)
+
+
+@pytest.mark.parametrize("angle", [270, 360])
+def test_streaming_simplify_keeps_the_rotation(angle):
+    path = StreamingPath.from_array(arc(np.radians(angle)), chunk_size=100,
+                                    eps=1, tol=0.5)
+    positions = np.vstack(list(path.chunks())).astype(np.int64)
+
+    assert rotation(positions) == pytest.approx(angle, abs=0.1)
+
+
+def subdivide_recursive(pts: np.ndarray, eps: float) -> np.ndarray:
+    """
+    Subdivision of PathMaker before _subdivide, segment by segment.
+    """
+    calc_pts = np.array(_calc_trajectory(pts[0], pts[1], eps))
+    for i in range(1, pts.shape[0] - 1):
+        ret = np.array(_calc_trajectory(pts[i], pts[i+1], eps))
+        calc_pts = np.vstack((calc_pts, ret[1:]))
+
+    return calc_pts
+
+
+@pytest.mark.parametrize("eps", [0.1, 1, 5])
+@pytest.mark.parametrize("filename", sorted(DATA.glob("*/source.svg")),
+                         ids=lambda path: path.parent.name)
+def test_subdivide_matches_the_recursive_version(filename, eps):
+    pts = np.array(get_pts_from_svg(str(filename)))
+
+    assert np.array_equal(_subdivide(pts, eps), subdivide_recursive(pts, eps))
+
+
+@pytest.mark.parametrize("pos", [(0, 0), (16000, -25000), (4000, 90000)])
+@pytest.mark.parametrize("ball_diameter", [5, 10])
+def test_transition_reaches_the_start(pos, ball_diameter):
+    # starts at r 150 and phi pi/2
+    pm = PathMaker(np.array([[0., 150.], [-50., 150.]]))
+    spiral = TransitionSpiral.between(list(pos), pm, ball_diameter)
+    positions = spiral.positions.astype(np.int64)
+    r1, phi1 = pm.start_point()
+
+    assert positions[0, 0] == pos[0]
+    assert positions[-1, 0] == round(r1*PathMaker.RADIUS_STEPS_MM)
+    phi = (pos[1] + positions[:, 1].sum())/PathMaker.ANGLE_STEPS_RAD
+    assert np.cos(phi - phi1) == pytest.approx(1)
+
+    # one position per revolution and neighbouring grooves overlap
+    full = 2*np.pi*PathMaker.ANGLE_STEPS_RAD
+    assert np.all(np.abs(positions[1:, 1]) <= full + 1)
+    pitch = np.abs(np.diff(positions[:, 0]))*full/np.abs(positions[1:, 1])
+    assert np.all(pitch <= ball_diameter*TransitionSpiral.PITCH_FACTOR
+                  *PathMaker.RADIUS_STEPS_MM + 1)
+
+
+@pytest.mark.parametrize("turn", [0.5, -0.5, 3, -3])
+def test_transition_turns_the_shorter_way(turn):
+    spiral = TransitionSpiral(100, 1, 100, 1 + turn)
+    angle = spiral.positions[:, 1].sum()/PathMaker.ANGLE_STEPS_RAD
+
+    assert angle == pytest.approx(turn, abs=1e-3)
+
+
+def test_transition_needs_a_ball():
+    with pytest.raises(ValueError):
+        TransitionSpiral(0, 0, 100, 0, ball_diameter=0)
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from stlib.async_worker import AsyncWorker
+from stlib.engines import compile_path
+from stlib.playlist import Compiler, Playlist
+
+
+URL = "sandtable://?time_scale=200"
+SPIRAL = {"r0": 0, "r1": 100, "num_revolutions": 3}
+
+
+def spiral(num: int) -> dict:
+    return SPIRAL | {"num_revolutions": num}
+
+
+def test_compiler_shares_equal_compiles():
+    async def main():
+        compiler = Compiler(max_workers=1)
+        compiler.start()
+        try:
+            first = compiler.compile("SpiralAboutCenter", SPIRAL)
+            # the order of the params doesn't matter
+            second = compiler.compile("SpiralAboutCenter",
+                                      dict(reversed(SPIRAL.items())))
+            assert len(compiler._futures) == 1
+
+            # cancelling one caller doesn't cancel the compile
+            first.cancel()
+            pm = await second
+            assert pm.num_revolutions == 3
+            assert await compiler.compile("SpiralAboutCenter", SPIRAL) is pm
+        finally:
+            compiler.stop()
+
+    asyncio.run(main())
+
+
+def test_compiler_keeps_the_recent_compiles():
+    async def main():
+        compiler = Compiler(max_workers=1, cache_size=2)
+        compiler.start()
+        try:
+            paths = [await compiler.compile("SpiralAboutCenter", spiral(num))
+                     for num in range(1, 5)]
+
+            assert await compiler.compile("SpiralAboutCenter",
+                                          spiral(4)) is paths[-1]
+            # only the last cache_size compiles are kept
+            assert len(compiler._futures) == 2
+            assert await compiler.compile("SpiralAboutCenter",
+                                          spiral(1)) is not paths[0]
+        finally:
+            compiler.stop()
+
+    asyncio.run(main())
+
+
+def test_jobs_can_be_moved_and_removed():
+    async def main():
+        playlist = Playlist(AsyncWorker(URL))
+        ids = [playlist.add("SpiralAboutCenter", "spiral", spiral(num))["id"]
+               for num in range(1, 4)]
+
+        playlist.move(ids[2], 0)
+        assert playlist.remove(ids[1])["id"] == ids[1]
+        assert [job["id"] for job in playlist.status()["jobs"]] == \
+            [ids[2], ids[0]]
+
+        with pytest.raises(KeyError):
+            playlist.remove(ids[1])
+        with pytest.raises(ValueError):
+            playlist.add("Unknown", "unknown", {})
+
+    asyncio.run(main())
+
+
+def test_estimate_waits_for_the_compile():
+    async def main():
+        worker = AsyncWorker(URL)
+        playlist = Playlist(worker, max_workers=1)
+        playlist.start()
+        try:
+            job = playlist.add("SpiralAboutCenter", "spiral", SPIRAL)
+            estimate = await playlist.estimate(job, 30)
+
+            pm = compile_path("SpiralAboutCenter", SPIRAL)
+            assert estimate == pytest.approx(
+                pm.estimate_time(worker.com.speed))
+            assert job["estimated_time"] == estimate
+
+            # a compile that doesn't finish in time is estimated later
+            slow = playlist.add("SpiralAboutCenter", "spiral", spiral(4))
+            assert await playlist.estimate(slow, 0) is None
+            assert slow["estimated_time"] is None
+        finally:
+            await playlist.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from stlib.path_maker import PathMaker
+from stlib.progress import ProgressTracker
+
+
+def com(queued: int = 0, acked: int = 0, speed: float = 100):
+    """
+    The counters of SerialCOM the tracker reads.
+    """
+    return SimpleNamespace(queued=queued, acked=acked, speed=speed)
+
+
+def path(num: int) -> np.ndarray:
+    return np.column_stack((np.arange(1, num + 1)*100, np.full(num, 10)))
+
+
+def test_status_follows_the_acked_positions():
+    tracker = ProgressTracker(com(queued=3))
+    pts = path(10)
+    path_id = tracker.add("test", pts, phi0=50, total=10)
+    tracker.com.queued += 10
+
+    tracker.com.acked = 3
+    assert tracker.status()["index"] == 0
+    tracker.com.acked = 7
+    status = tracker.status()
+
+    assert status["id"] == path_id and status["name"] == "test"
+    assert status["index"] == 4 and status["progress"] == 0.4
+    assert status["r"] == pytest.approx(400/PathMaker.RADIUS_STEPS_MM)
+    assert status["phi"] == pytest.approx(90/PathMaker.ANGLE_STEPS_RAD)
+    # the moves to the last 6 points are 100 steps in r
+    assert status["eta"] == pytest.approx(6*100/100)
+
+
+def test_chunks_of_a_path_share_the_id():
+    tracker = ProgressTracker(com())
+    pts = path(10)
+    path_id = tracker.add("test", pts[:6], phi0=0)
+    tracker.com.queued += 6
+    assert tracker.add("test", pts[6:], phi0=60, path_id=path_id,
+                       offset=6) == path_id
+    tracker.com.queued += 4
+
+    tracker.com.acked = 8
+    status = tracker.status()
+    assert status["index"] == 8
+    assert status["progress"] is None and status["eta"] is None
+
+    tracker.set_total(path_id, 10)
+    assert tracker.status()["progress"] == 0.8
+    assert tracker.status()["eta"] == pytest.approx(2)
+
+
+def test_trace_is_downsampled_to_the_last_point():
+    tracker = ProgressTracker(com())
+    pts = path(100)
+    tracker.add("test", pts, phi0=0, total=100)
+    tracker.com.queued += 100
+
+    trace = tracker.trace(None, 50, max_points=10)
+    assert trace.shape == (10, 2)
+    r = pts[49, 0]/PathMaker.RADIUS_STEPS_MM
+    phi = 500/PathMaker.ANGLE_STEPS_RAD
+    assert trace[-1] == pytest.approx([r*np.cos(phi), r*np.sin(phi)])
+
+    assert tracker.trace(50, 60, max_points=100).shape == (10, 2)
+
+
+def test_clear_forgets_the_paths():
+    tracker = ProgressTracker(com())
+    tracker.add("test", path(10), phi0=0, total=10)
+    tracker.clear()
+
+    assert tracker.status() == {"id": None}
+    assert tracker.trace(None, 5, 10).shape == (0, 2)
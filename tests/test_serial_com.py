@@ -0,0 +1,180 @@
+import asyncio
+import time
+
+import numpy as np
+
+from stlib.async_serial_com import AsyncSerialCOM
+from stlib.metrics import Registry
+from stlib.serial_com import SerialCOM
+
+
+LATENCY = 0.01 # s
+URL = f"sandtable://?time_scale=20&latency={LATENCY}"
+# slack for the scheduling of the threads and tasks
+SLACK = 0.01 # s
+
+
+def positions(num: int) -> bytes:
+    pos = np.column_stack((1000 + np.arange(num) % 50, np.full(num, 7)))
+    return pos.astype(">i4").tobytes()
+
+
+def frame_rtt(com) -> float:
+    """
+    :return: round trip of a full positions frame and its response
+    """
+    # a response has at most 6 bytes
+    return 2*LATENCY + (len(com._frame) + 6)*10/com.BAUDRATE
+
+
+def mean_rtt(com) -> float:
+    rtt = com.metrics.ack_rtt
+    return rtt.sum/rtt.count
+
+
+def wait_until(cond, timeout: float = 10) -> None:
+    end = time.monotonic() + timeout
+    while not cond():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.001)
+
+
+def expected_trace(num: int) -> list[tuple[int, int]]:
+    pos = np.frombuffer(positions(num), dtype=">i4").reshape(-1, 2)
+    return list(zip(pos[:, 0].tolist(), np.cumsum(pos[:, 1]).tolist()))
+
+
+def test_credits_never_overflow_the_buffer():
+    com = SerialCOM(f"{URL}&keep_trace=1", Registry())
+    com.begin_com()
+    try:
+        assert com.wait_ready(5)
+        com.start()
+        com.send_packets(positions(100))
+        table = com._serial.table
+        wait_until(lambda: table.done == 100 and com.acked == 100)
+
+        assert com.metrics.buffer_full.value == 0
+        assert com.metrics.denied.value == 0
+        assert com.metrics.retransmits.value == 0
+        assert table.trace == expected_trace(100)
+    finally:
+        com.stop_com()
+
+
+def test_lost_responses_send_every_position_once():
+    com = SerialCOM(f"{URL}&keep_trace=1&drop_rate=0.2&seed=3", Registry())
+    # the lost responses time out
+    com.READ_TIMEOUT = 0.1
+    com.begin_com()
+    try:
+        assert com.wait_ready(5)
+        com.start()
+        com.send_packets(positions(100))
+        table = com._serial.table
+        wait_until(lambda: table.done == 100, 30)
+
+        assert com.metrics.timeouts.value > 0
+        # phi is relative, a position that is accepted twice turns the
+        # rest of the pattern
+        assert table.trace == expected_trace(100)
+    finally:
+        com.stop_com()
+
+
+def test_positions_of_an_old_epoch_are_dropped():
+    com = SerialCOM(f"{URL}&keep_trace=1", Registry())
+    com.begin_com()
+    try:
+        assert com.wait_ready(5)
+        com.start()
+        epoch = com.epoch
+        com.send_packets(positions(200))
+        wait_until(lambda: com.acked >= 50)
+
+        com.stop(clear=True)
+        assert com.epoch == epoch + 1
+        assert com.wait_cleared(com.epoch, 5)
+        # queued for the epoch before the clear
+        com.send_packets(positions(10), epoch)
+        com.send_packets(positions(10))
+        com.start()
+
+        table = com._serial.table
+        done = len(table.trace)
+        wait_until(lambda: com._pos_queue.unfinished_tasks == 0
+                   and table.done == done + 10)
+        r, phi = com.clear_position
+        assert table.trace[done:] == [(r, phi + steps)
+                                      for r, steps in expected_trace(10)]
+    finally:
+        com.stop_com()
+
+
+def test_stop_overtakes_queued_frames():
+    com = SerialCOM(URL, Registry())
+    com.begin_com()
+    try:
+        assert com.wait_ready(5)
+        com.start()
+        com.send_packets(positions(200))
+        wait_until(lambda: com.acked >= 50)
+        assert com._pos_queue.qsize() > 0
+
+        latency = com.metrics.control_latency
+        count, total = latency.count, latency.sum
+        com.stop()
+        wait_until(lambda: latency.count > count)
+
+        # the stop waits at most for the frame that is in flight
+        assert latency.sum - total <= mean_rtt(com) + frame_rtt(com) + SLACK
+    finally:
+        com.stop_com()
+
+
+def test_clear_position_is_the_last_taken_position():
+    com = SerialCOM(URL, Registry())
+    com.begin_com()
+    try:
+        assert com.wait_ready(5)
+        com.start()
+        com.send_packets(positions(200))
+        wait_until(lambda: com.acked >= 50)
+
+        com.stop(clear=True)
+        assert com.wait_cleared(com.epoch, 5)
+
+        table = com._serial.table
+        assert com.clear_position == table._command
+        assert table.buffer == []
+    finally:
+        com.stop_com()
+
+
+def test_async_stop_overtakes_queued_frames():
+    async def main():
+        com = AsyncSerialCOM(URL, Registry())
+        await com.begin_com()
+        try:
+            assert await com.wait_ready(5)
+            await com.start()
+            await com.send_packets(positions(200))
+            while com.acked < 50:
+                await asyncio.sleep(0.001)
+
+            latency = com.metrics.control_latency
+            count, total = latency.count, latency.sum
+            await com.stop()
+            while latency.count == count:
+                await asyncio.sleep(0.001)
+
+            assert latency.sum - total <= mean_rtt(com) + frame_rtt(com) \
+                + SLACK
+
+            await com.stop(clear=True)
+            assert await com.wait_cleared(com.epoch, 5)
+            assert com.clear_position == com._serial.table._command
+        finally:
+            await com.stop_com()
+
+    asyncio.run(main())
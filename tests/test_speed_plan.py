@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from stlib.path_maker import PathMaker
+from stlib.speed_plan import RIM_SPEED, SpeedPlanner, move_speeds, \
+    plan_speeds, planned_time
+
+
+R_RIM = round(PathMaker.RADIUS_LIMIT_MM*PathMaker.RADIUS_STEPS_MM)
+
+
+def spiral(num: int = 2000) -> np.ndarray:
+    """
+    Spiral from the center to the rim in positions of one degree.
+    """
+    r = np.linspace(5, 250, num)*PathMaker.RADIUS_STEPS_MM
+    dphi = np.full(num, round(np.radians(1)*PathMaker.ANGLE_STEPS_RAD))
+    return np.column_stack((r, dphi)).astype(np.int64)
+
+
+def allowed(pts: np.ndarray, lag: int = 9, min_speed: int = 100,
+            max_speed: int = 3000) -> np.ndarray:
+    """
+    Max speed of every position, a speed change also reaches the lag
+    positions before it.
+    """
+    speed = np.clip(move_speeds(pts, None, RIM_SPEED), min_speed, max_speed)
+    return np.array([speed[max(i - lag, 0):i + 1].min()
+                     for i in range(speed.shape[0])])
+
+
+def test_rim_rotation_keeps_the_initial_speed():
+    pts = np.array([[R_RIM, 1000], [R_RIM, -1000]])
+
+    assert move_speeds(pts, R_RIM, RIM_SPEED) == \
+        pytest.approx(PathMaker.INIT_SPEED, rel=1e-3)
+    # the speed is rounded down by less than the tolerance
+    time = planned_time(pts, R_RIM, tolerance=0.25)
+    assert 2000/PathMaker.INIT_SPEED <= time <= \
+        2000/PathMaker.INIT_SPEED*1.25
+
+
+def test_radial_move_runs_at_the_ball_speed():
+    pts = np.array([[1000, 0]])
+
+    assert move_speeds(pts, 0, 10)[0] == \
+        pytest.approx(10*PathMaker.RADIUS_STEPS_MM)
+    # a position that doesn't move the ball has no limit
+    assert move_speeds(pts, 1000, 10)[0] == np.inf
+
+
+def test_no_move_is_faster_than_its_speed():
+    pts = spiral()
+    idx, speeds = plan_speeds(pts)
+    speed = speeds[np.searchsorted(idx, np.arange(pts.shape[0]),
+                                   side="right") - 1]
+
+    assert idx[0] == 0
+    assert np.all(speed <= allowed(pts))
+    # the speed drops towards the rim in a few steps
+    assert np.all(np.diff(speeds) < 0)
+    assert 1 < idx.size < 40
+
+
+def test_speeds_must_be_uint16():
+    with pytest.raises(ValueError):
+        plan_speeds(spiral(), min_speed=0)
+    with pytest.raises(ValueError):
+        plan_speeds(spiral(), max_speed=2**16)
+
+
+@pytest.mark.parametrize("chunk", [50, 333])
+def test_planner_keeps_the_speeds_across_chunks(chunk):
+    pts = spiral()
+    planner = SpeedPlanner()
+    speed = np.zeros(pts.shape[0], dtype=np.int64)
+    changes = []
+    current = None
+    for i in range(0, pts.shape[0], chunk):
+        plan = planner.plan(pts[i:i+chunk])
+        for k in range(min(chunk, pts.shape[0] - i)):
+            if k in plan:
+                current = plan[k]
+                changes.append(current)
+            speed[i + k] = current
+
+    assert np.all(speed <= allowed(pts))
+    # changes to the speed that is already set are dropped
+    assert all(a != b for a, b in zip(changes, changes[1:]))
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from stlib.load_svg import get_pts_from_svg
+from stlib.path_maker import PathMaker
+from stlib.streaming import StreamingPath, _svg_chunks
+
+
+DATA = Path(__file__).parent.parent/"data"
+
+
+def write_svg(filename: Path, polylines: np.ndarray) -> None:
+    paths = "".join(
+        f'<path d="M {" L ".join(f"{x:.3f} {y:.3f}" for x, y in pl)}"/>'
+        for pl in polylines)
+    filename.write_text(
+        f'<svg xmlns="http://www.w3.org/2000/svg">{paths}</svg>')
+
+
+@pytest.fixture
+def lines_svg(tmp_path) -> Path:
+    rng = np.random.default_rng(0)
+    # 40 polylines of 5 points scattered over the table
+    polylines = rng.uniform(-150, 150, (40, 1, 2)) \
+        + rng.uniform(-10, 10, (40, 5, 2))
+    filename = tmp_path/"lines.svg"
+    write_svg(filename, polylines)
+
+    return filename
+
+
+def test_svg_chunks_are_bounded(lines_svg):
+    chunks = list(_svg_chunks(str(lines_svg), 0.1, 12))
+    pts = get_pts_from_svg(str(lines_svg))
+
+    # a chunk is closed by the polyline that reaches the size
+    assert len(chunks) == 14
+    assert max(chunk.shape[0] for chunk in chunks) < 12 + 5
+    # the first polyline stays first, see order_polylines
+    assert np.array_equal(chunks[0][0], pts[0])
+    # every point is drawn once
+    joined = np.vstack(chunks)
+    assert np.array_equal(np.unique(joined, axis=0),
+                          np.unique(pts, axis=0))
+
+
+def test_from_svg_in_one_chunk_orders_like_get_pts(lines_svg):
+    path = StreamingPath.from_svg(str(lines_svg), chunk_size=10**6)
+    chunks = list(path._source())
+
+    assert len(chunks) == 1
+    assert np.array_equal(chunks[0], get_pts_from_svg(str(lines_svg)))
+
+
+@pytest.mark.parametrize("filename", sorted(DATA.glob("*/source.svg")),
+                         ids=lambda path: path.parent.name)
+def test_reduction_matches_path_maker(filename):
+    pm = PathMaker(get_pts_from_svg(str(filename)), eps=1, tol=0.5)
+    path = StreamingPath.from_svg(str(filename), chunk_size=10**6, eps=1,
+                                  tol=0.5)
+
+    assert path.reduction is None
+    list(path.chunks())
+    assert path.reduction == pytest.approx(pm.reduction)
+
+
+def test_has_the_attributes_of_path_maker():
+    pts = np.column_stack((np.linspace(10, 200, 50), np.zeros(50)))
+    path = StreamingPath.from_array(pts, chunk_size=16, num_iterations=2)
+
+    assert path.pts is None and path.positions is None
+    assert path.iteration_size is None and path.total is None
+
+    positions = np.vstack(list(path.chunks()))
+    assert path.iteration_size == 50
+    assert path.total == len(path) == positions.shape[0] == 101
+    assert "50 calculated points" in repr(path)
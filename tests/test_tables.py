@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import pytest
+
+from stlib.tables import TableRegistry
+
+
+URL = "sandtable://?time_scale=200"
+SPIRAL = {"r0": 0, "r1": 50, "num_revolutions": 2}
+
+
+def test_tables_are_found_by_id():
+    tables = TableRegistry(erase=False)
+    first = tables.add("first", f"{URL}&seed=1")
+    second = tables.add("second", f"{URL}&seed=2")
+
+    assert tables.get() is first and tables.get("second") is second
+    with pytest.raises(KeyError):
+        tables.get("third")
+    with pytest.raises(ValueError):
+        tables.add("first", f"{URL}&seed=3")
+    with pytest.raises(ValueError):
+        tables.add("third", f"{URL}&seed=1")
+    # all playlists compile with the same pool
+    assert first["playlist"].compiler is second["playlist"].compiler
+
+
+def test_start_doesnt_wait_for_the_hardware():
+    async def main():
+        tables = TableRegistry()
+        tables.add("missing", "/dev/no-sand-table")
+        start = time.monotonic()
+        await tables.start()
+        try:
+            assert time.monotonic() - start < 1
+            assert tables.status()[0]["connected"] is False
+            with pytest.raises(RuntimeError):
+                tables.add("late", URL)
+        finally:
+            await tables.stop()
+
+    asyncio.run(main())
+
+
+def test_pattern_is_compiled_once_for_all_tables():
+    async def main():
+        tables = TableRegistry(erase=False, max_workers=1)
+        for i in range(2):
+            tables.add(f"table{i}", f"{URL}&seed={i}")
+        await tables.start()
+        try:
+            for table in tables.tables.values():
+                table["playlist"].add("SpiralAboutCenter", "spiral", SPIRAL)
+            assert len(tables.compiler._futures) == 1
+
+            end = time.monotonic() + 10
+            while any(table["worker"].com.acked == 0
+                      for table in tables.tables.values()):
+                assert time.monotonic() < end, "timed out"
+                await asyncio.sleep(0.01)
+
+            assert all(status["connected"] for status in tables.status())
+        finally:
+            await tables.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+import time
+
+import pytest
+import serial
+
+from stlib.serial_com import MsgType
+from stlib.virtual_table import VirtualSerial, VirtualTable
+
+
+HEADER = MsgType.headerA.value + MsgType.headerB.value
+
+
+def position(r: int, phi: int) -> bytes:
+    return HEADER + MsgType.position.value \
+        + r.to_bytes(4, "big", signed=True) \
+        + phi.to_bytes(4, "big", signed=True)
+
+
+def frame(seq: int, positions: list[tuple[int, int]]) -> bytes:
+    data = b"".join(r.to_bytes(4, "big", signed=True)
+                    + phi.to_bytes(4, "big", signed=True)
+                    for r, phi in positions)
+    return HEADER + MsgType.positions.value + bytes([seq, len(positions)]) \
+        + data
+
+
+def response(table: VirtualTable, size: int, timeout: float = 1) -> bytes:
+    end = time.monotonic() + timeout
+    data = b""
+    while len(data) < size and time.monotonic() < end:
+        data += table.fetch(size - len(data))
+        table.wait(end - time.monotonic())
+
+    return data
+
+
+def test_truncated_frame_is_aborted():
+    table = VirtualTable()
+    table.feed(frame(5, [(100, 1), (200, 2)])[:-3])
+
+    # nothing is accepted, so the host sends the positions again
+    assert response(table, 6) == HEADER + MsgType.positionsRec.value \
+        + bytes([5, 0, 0])
+    assert table.buffer == []
+
+    # the next frame is parsed from its header
+    table.feed(frame(6, [(100, 1)]))
+    assert response(table, 6) == HEADER + MsgType.positionsRec.value \
+        + bytes([6, 1, 1])
+
+    table.feed(HEADER + MsgType.getFrameStatus.value)
+    assert response(table, 6) == HEADER + MsgType.sendFrameStatus.value \
+        + bytes([6, 1, 1])
+
+
+def test_frame_without_id_fails():
+    table = VirtualTable()
+    table.feed(HEADER + MsgType.positions.value)
+
+    assert response(table, 3) == HEADER + MsgType.failedRec.value
+    table.feed(HEADER + MsgType.getFrameStatus.value)
+    assert response(table, 6) == HEADER + MsgType.sendFrameStatus.value \
+        + bytes([0, 0, 0])
+
+
+def test_slow_frame_is_not_aborted():
+    table = VirtualTable()
+    data = frame(1, [(100, 1), (200, 2)])
+    table.feed(data[:10])
+    time.sleep(table.POS_TIMEOUT/2)
+    table.feed(data[10:])
+
+    assert response(table, 6) == HEADER + MsgType.positionsRec.value \
+        + bytes([1, 2, 2])
+    assert table.buffer == [(100, 1), (200, 2)]
+
+
+def test_url_sets_the_options():
+    port = serial.serial_for_url(
+        "sandtable://?latency=0.002&time_scale=10&drop_rate=0.5"
+        "&keep_trace=true&seed=1", baudrate=9600)
+
+    assert isinstance(port, VirtualSerial)
+    table = port.table
+    assert table.latency == 0.002 and table.time_scale == 10
+    assert table.drop_rate == 0.5 and table.keep_trace
+    assert table.byte_time == pytest.approx(10/9600)
+
+
+def test_url_with_unknown_option_fails():
+    with pytest.raises(serial.SerialException, match="Unknown option"):
+        serial.serial_for_url("sandtable://?speed=10")
+
+
+def test_full_buffer_denies_positions():
+    table = VirtualTable()
+    # not started, so no position is taken from the buffer
+    for i in range(table.RBUFF_SIZE):
+        table.feed(position(100 + i, 0))
+
+    confirm = HEADER + MsgType.confirmRec.value
+    assert response(table, 3*table.RBUFF_SIZE) == \
+        confirm*(table.RBUFF_SIZE - 1) + HEADER + MsgType.bufferFull.value
+    assert len(table.buffer) == table.RBUFF_SIZE - 1
+
+
+def test_moves_take_the_time_of_the_longer_axis():
+    table = VirtualTable(keep_trace=True)
+    t0 = time.monotonic()
+    table.feed(HEADER + MsgType.start.value + position(800, 400))
+
+    # the move from the home offset to 0 and then to r 800 both run at
+    # the initial speed, phi is slowed down to arrive at the same time
+    end = t0 + (-table.R_OFFSET + 800)/table.INIT_SPEED
+    table.update(end - 0.02)
+    assert table.done == 0
+    table.update(end + 0.02)
+    assert table.done == 1
+    assert table.trace == [(800, 400)]
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from stlib.path_cache import PathCache
+from stlib.progress import ProgressTracker
+
+# the web app imports its modules from its own directory
+sys.path.append(str(Path(__file__).parent.parent/"web"))
+from constants import PARAMETRIC_ENGINES
+from utils import Catalog, ProgressStream
+
+
+DATA = Path(__file__).parent.parent/"data"
+META = {"engine": "PathMaker",
+        "parameters": [{"name": "rotations", "type": "number"}]}
+
+
+def worker(num: int) -> SimpleNamespace:
+    """
+    Worker with one registered path of num points, see ProgressTracker.
+    """
+    com = SimpleNamespace(queued=0, acked=0, speed=100)
+    progress = ProgressTracker(com)
+    pts = np.column_stack((np.full(num, 1000), np.full(num, 10)))
+    progress.add("test", pts, phi0=0, total=num)
+    com.queued = num
+
+    return SimpleNamespace(com=com, progress=progress)
+
+
+def event(data: str) -> dict:
+    assert data.startswith("data: ") and data.endswith("\n\n")
+    return json.loads(data[len("data: "):])
+
+
+def test_progress_stream_sends_the_new_trace():
+    async def main():
+        w = worker(100)
+        w.com.acked = 20
+        stream = ProgressStream(w, interval=0.01, max_points=4)
+        stream.start()
+        try:
+            await asyncio.sleep(0.05)
+            first = stream.subscribe()
+            second = stream.subscribe()
+
+            # new clients get the trace up to now
+            snapshot = event(await anext(first))
+            assert snapshot["status"]["index"] == 20
+            assert len(snapshot["trace"]) == 20
+            assert event(await anext(second)) == snapshot
+
+            w.com.acked = 60
+            update = event(await anext(first))
+            assert update["status"]["index"] == 60
+            # downsampled to max_points per interval
+            assert len(update["trace"]) == 4
+            assert event(await anext(second)) == update
+        finally:
+            await first.aclose()
+            await second.aclose()
+            await stream.stop()
+
+    asyncio.run(main())
+
+
+def test_progress_stream_joins_the_missed_updates():
+    async def main():
+        w = worker(100)
+        stream = ProgressStream(w, interval=0.01, max_points=4)
+        stream.start()
+        client = stream.subscribe()
+        try:
+            assert event(await anext(client))["trace"] == []
+
+            for acked in (10, 20, 30):
+                w.com.acked = acked
+                await asyncio.sleep(0.03)
+
+            update = event(await anext(client))
+            assert update["status"]["index"] == 30
+            # the trace ends at the last acked point
+            assert update["trace"][-1] == pytest.approx(
+                w.progress.trace(29, 30, 1)[0], abs=0.01)
+        finally:
+            await client.aclose()
+            await stream.stop()
+
+    asyncio.run(main())
+
+
+def add_pattern(images: Path, name: str, svg: str = "blade") -> None:
+    (images/name).mkdir(parents=True)
+    (images/name/"meta.json").write_text(json.dumps(META))
+    shutil.copy(DATA/svg/"source.svg", images/name/"source.svg")
+
+
+@pytest.fixture
+def images(tmp_path) -> Path:
+    images = tmp_path/"images"
+    for name in ("blade", "infinity", "zajcek"):
+        add_pattern(images, name, name)
+
+    return images
+
+
+def ids(catalog: Catalog) -> dict[str, int]:
+    return {item["name"]: item["id"]
+            for item in catalog.page(0, 100)["items"]}
+
+
+def test_catalog_ids_are_stable_across_rescans(tmp_path, images):
+    cache = PathCache(str(tmp_path/"cache"))
+    catalog = Catalog(cache, str(images), max_workers=2)
+    assert catalog.update() == 3 + len(PARAMETRIC_ENGINES)
+    first = ids(catalog)
+
+    shutil.rmtree(images/"infinity")
+    add_pattern(images, "copy")
+    # a new catalog reads the stored index
+    catalog = Catalog(cache, str(images))
+    assert ids(catalog) == first
+    assert catalog.update() == 1
+    second = ids(catalog)
+
+    assert "infinity" not in second
+    assert {name: second[name] for name in first if name != "infinity"} \
+        == {name: first[name] for name in first if name != "infinity"}
+    # the id of the removed pattern is not used again
+    assert second["copy"] > max(first.values())
+
+
+def test_catalog_scans_the_changed_patterns(tmp_path, images):
+    catalog = Catalog(PathCache(str(tmp_path/"cache")), str(images))
+    catalog.update()
+    assert catalog.update() == 0
+
+    item = catalog.get(ids(catalog)["blade"])
+    svg = images/"blade"/"source.svg"
+    os.utime(svg, ns=(0, 0))
+    assert catalog.update() == 1
+    # the content didn't change, so the stats are kept
+    assert catalog.get(item["id"]) == item
+
+
+def test_catalog_page(tmp_path, images):
+    catalog = Catalog(PathCache(str(tmp_path/"cache")), str(images))
+    assert catalog.page()["ready"] is False
+    catalog.update()
+    total = 3 + len(PARAMETRIC_ENGINES)
+
+    page = catalog.page(2, 3)
+    assert page["ready"] and page["total"] == total
+    assert page["offset"] == 2
+    assert page["items"] == catalog.page(0, total)["items"][2:5]
+    assert catalog.page(total, 10)["items"] == []
+
+    item = catalog.get(ids(catalog)["blade"])
+    assert not set(Catalog.PRIVATE) & set(item)
+    assert item["cached"] is True and item["points"] > 0
+    rose = catalog.get(ids(catalog)["Rose"])
+    assert rose["cached"] is None
+    assert catalog.get(10**6) is None
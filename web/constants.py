@@ -2,6 +2,17 @@ from typing import Literal, Union
 from pydantic import BaseModel
 
 
+# accuracy of the trajectory calculation, see PathMaker
+COMPILE_EPS = 1
+# max deviation in mm of the simplified trajectory, see PathMaker
+COMPILE_TOL = 0.5
+# table id -> serial port of the sand tables, the first one is the default
+# of the routes without a table
+TABLES = {"main": "COM9"}
+# s that /submit waits for the compile to return the estimated time, the
+# estimate of a slower compile is shown in /playlist
+ESTIMATE_TIMEOUT = 1
+
 
 class PathMakerSubmission(BaseModel):
     engine: Literal["PathMaker"]
@@ -18,11 +29,89 @@ class SpiralAboutCenterSubmission(BaseModel):
     r1: int
 
 
+class RoseSubmission(BaseModel):
+    engine: Literal["Rose"]
+    item_id: int
+    rotations: int = 1
+    rotate: int = 0
+    radius: float = 200
+    n: int = 3
+    d: int = 1
+    r0: float = 0
+
+
+class SpirographSubmission(BaseModel):
+    engine: Literal["Spirograph"]
+    item_id: int
+    rotations: int = 1
+    rotate: int = 0
+    radius: float = 200
+    fixed: int = 96
+    rolling: int = 35
+    pen: float = 0.8
+
+
+class LissajousSubmission(BaseModel):
+    engine: Literal["Lissajous"]
+    item_id: int
+    rotations: int = 1
+    rotate: int = 0
+    radius: float = 200
+    a: int = 3
+    b: int = 4
+    phase: float = 90
+
+
+class StarSpiralSubmission(BaseModel):
+    engine: Literal["StarSpiral"]
+    item_id: int
+    rotations: int = 1
+    rotate: int = 0
+    r0: float = 20
+    r1: float = 200
+    points: int = 5
+    depth: float = 0.4
+    turns: int = 20
+
+
+class ModulatedSpiralSubmission(BaseModel):
+    engine: Literal["ModulatedSpiral"]
+    item_id: int
+    rotations: int = 1
+    rotate: int = 0
+    r0: float = 0
+    r1: float = 200
+    turns: int = 20
+    fermat: bool = False
+    amplitude: float = 0
+    waves: float = 0
+
+
+# engines that generate the pattern from their parameters, they are in the
+# catalog without any files in static/images
+PARAMETRIC_ENGINES: dict[str, type[BaseModel]] = {
+    "Rose": RoseSubmission,
+    "Spirograph": SpirographSubmission,
+    "Lissajous": LissajousSubmission,
+    "StarSpiral": StarSpiralSubmission,
+    "ModulatedSpiral": ModulatedSpiralSubmission,
+}
+
+
 EngineSubmission = Union[
     PathMakerSubmission,
-    SpiralAboutCenterSubmission
+    SpiralAboutCenterSubmission,
+    RoseSubmission,
+    SpirographSubmission,
+    LissajousSubmission,
+    StarSpiralSubmission,
+    ModulatedSpiralSubmission,
 ]
 
 
 class ButtonPress(BaseModel):
-    task: str
\ No newline at end of file
+    task: str
+
+
+class PlaylistMove(BaseModel):
+    index: int
\ No newline at end of file
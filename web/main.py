@@ -2,23 +2,63 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Form, HTTPException, Query
+from fastapi.responses import HTMLResponse, PlainTextResponse, \
+    StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from constants import EngineSubmission, ButtonPress
-from utils import load_json
+from constants import EngineSubmission, ButtonPress, PlaylistMove, \
+    COMPILE_EPS, COMPILE_TOL, ESTIMATE_TIMEOUT, PARAMETRIC_ENGINES, TABLES
+from utils import Catalog, ProgressStream
 import stlib as st
-import numpy as np
 
 
-id_map = load_json()
-app = FastAPI()
+# per position logs are on the debug level
+logging.basicConfig(level=logging.INFO)
+
+path_cache = st.PathCache("cache")
+# the stored index is served until the patterns are scanned on startup
+catalog = Catalog(path_cache)
+# an interrupted pattern is resumed from the journal of its table on
+# startup and the ball moves at the speed the rim had with a single motor
+# speed. The submitted patterns are compiled in the background once for
+# all tables.
+tables = st.TableRegistry(journal_dir=path_cache.directory,
+                          ball_speed=st.RIM_SPEED)
+for table_id, port in TABLES.items():
+    tables.add(table_id, port)
+progress_streams = {table_id: ProgressStream(table["worker"])
+                    for table_id, table in tables.tables.items()}
+
+
+def get_table(table_id: str | None) -> st.Table:
+    try:
+        return tables.get(table_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-worker = st.Worker(COM="COM9")
-worker.start_worker()
-worker.start()
-worker.home()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # nothing waits for the hardware or the catalog, the workers connect
+    # to the tables in the background of the event loop of the app
+    # only the new and changed patterns are compiled
+    scan = asyncio.create_task(asyncio.to_thread(catalog.update))
+    await tables.start()
+    for stream in progress_streams.values():
+        stream.start()
+    yield
+    for stream in progress_streams.values():
+        await stream.stop()
+    await tables.stop()
+    await asyncio.gather(scan, return_exceptions=True)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Serve static files (HTML, CSS, JS, and images)
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -31,43 +71,140 @@ async def index():
 
 
 @app.post("/submit")
-async def submit(data: EngineSubmission):
-    
+async def submit(data: EngineSubmission,
+                 table: list[str] | None = Query(None)):
+    # the same pattern can be sent to several tables, it is compiled once
+    playlists = [get_table(table_id)["playlist"]
+                 for table_id in table or [None]]
+
     match data.engine:
         case "PathMaker":
             print(f"Got pathmaker: rot->{data.rotate}° n->{data.rotations}")
-            name = id_map[data.item_id]
-            fname = f"static/images/{name}/source.svg"
-            pts = st.get_pts_from_svg(fname)
-            pts = np.array(pts)
-            pm = st.PathMaker(pts, eps=1, rot_angle=data.rotate, 
-                         num_iterations=data.rotations)
-            worker.add_PathMaker(pm)
+            item = catalog.get(data.item_id)
+            if item is None:
+                raise HTTPException(status_code=404 if catalog.ready else 503,
+                                    detail="Unknown pattern or the catalog "
+                                           "is still loading")
+            name = item["name"]
+            params = {"filename": f"static/images/{name}/source.svg",
+                      "cache_dir": path_cache.directory,
+                      "eps": COMPILE_EPS, "tol": COMPILE_TOL,
+                      "rot_angle": data.rotate,
+                      "num_iterations": data.rotations}
 
         case "SpiralAboutCenter":
             print(f"Got spiral: n->{data.rotations} r0->{data.r0} r1->{data.r1}")
-            pm = st.SpiralAboutCenter(r0 = data.r0, r1 = data.r1, 
-                                      num_revolutions = data.rotations)
-            worker.add_PathMaker(pm)
+            name = "spiral"
+            params = {"r0": data.r0, "r1": data.r1,
+                      "num_revolutions": data.rotations}
+
+        case engine if engine in PARAMETRIC_ENGINES:
+            print(f"Got {engine}: n->{data.rotations}")
+            name = engine
+            params = data.model_dump(exclude={"engine", "item_id",
+                                              "rotations", "rotate"})
+            params |= {"eps": COMPILE_TOL, "rot_angle": data.rotate,
+                       "num_iterations": data.rotations}
 
         case _:
             print(f"Received unexpected engine {data.engine}")
+            return {"status": "error"}
+
+    jobs = [playlist.add(data.engine, name, params)
+            for playlist in playlists]
+    # cached and small patterns are compiled in time, the others get their
+    # estimated_time in /playlist once they are compiled
+    await asyncio.gather(*(playlist.estimate(job, ESTIMATE_TIMEOUT)
+                           for playlist, job in zip(playlists, jobs)))
+
+    return {"status": "ok", **jobs[0], "jobs": jobs}
+
+
+@app.get("/catalog")
+async def get_catalog(offset: int = Query(0, ge=0),
+                      limit: int = Query(100, ge=1, le=500)):
+    return catalog.page(offset, limit)
+
+
+@app.post("/catalog/refresh")
+async def refresh_catalog():
+    # picks up patterns that were added while the server runs
+    scanned = await asyncio.to_thread(catalog.update)
+    return {"status": "ok", "scanned": scanned}
+
+
+@app.get("/tables")
+async def get_tables():
+    return tables.status()
+
+
+@app.get("/playlist")
+async def get_playlist(table: str | None = None):
+    return get_table(table)["playlist"].status()
+
+
+@app.post("/playlist/skip")
+async def skip_job(table: str | None = None):
+    get_table(table)["playlist"].skip()
+    return {"status": "ok"}
+
+
+@app.post("/playlist/{job_id}/move")
+async def move_job(job_id: int, data: PlaylistMove,
+                   table: str | None = None):
+    playlist = get_table(table)["playlist"]
+    try:
+        playlist.move(job_id, data.index)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return playlist.status()
+
+
+@app.delete("/playlist/{job_id}")
+async def remove_job(job_id: int, table: str | None = None):
+    playlist = get_table(table)["playlist"]
+    try:
+        playlist.remove(job_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return playlist.status()
 
 
 @app.post("/button")
-async def button_press(data: ButtonPress):
+async def button_press(data: ButtonPress, table: str | None = None):
+    entry = get_table(table)
+    worker, playlist = entry["worker"], entry["playlist"]
     match data.task:
         case "home":
             # print("home")
-            worker.home()
+            await worker.home()
         case "start":
             # print("start")
-            worker.start()
+            await worker.start()
         case "stop":
             # print("stop")
-            worker.stop()
+            await worker.stop()
         case "clear":
             # print("clear")
-            worker.stop(clear=True)
+            # the playlist would hand the next job to the worker
+            await playlist.clear()
         case _:
-            print(f"Received unexpected {data.task}")
\ No newline at end of file
+            print(f"Received unexpected {data.task}")
+
+
+@app.get("/events")
+async def events(table: str | None = None):
+    # live progress and trace as server sent events
+    stream = progress_streams[get_table(table)["id"]]
+    return StreamingResponse(stream.subscribe(),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format
+    return PlainTextResponse(st.REGISTRY.render(),
+                             media_type="text/plain; version=0.0.4")
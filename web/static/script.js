@@ -1,32 +1,74 @@
 let selectedId = null;
 let selectedMeta = null;
+let selectedTable = null;
+let tableIds = [];
+const RADIUS_MM = 251;
+
+function formatTime(seconds) {
+  const min = Math.round(seconds / 60);
+  return min < 60 ? `${min} min` : `${Math.floor(min / 60)} h ${min % 60} min`;
+}
+
+const CATALOG_PAGE = 100;
+
+function itemElement(item) {
+  const div = document.createElement("div");
+  div.className = "item";
+  // parametric patterns have no files, their preview is drawn
+  const preview = item.preview
+    ? `<canvas width="300" height="300"></canvas>`
+    : `<img src="/static/images/${item.name}/preview.png" alt="Item ${item.name}" loading="lazy">`;
+  div.innerHTML = `
+    ${preview}
+    <p>${item.name}</p>
+    ${item.draw_time != null ? `<p>~${formatTime(item.draw_time)}</p>` : ""}`;
+  if (item.points != null) {
+    div.title = `${item.points} points, ${item.positions} positions, r ${item.radius} mm`
+      + (item.cached ? ", compiled" : "");
+  }
+  if (item.preview) {
+    drawPreview(div.querySelector("canvas"), item.preview);
+  }
+  div.onclick = () => selectItem(item, div);
+  return div;
+}
 
 async function loadItems() {
-  const imageData = await fetch("/static/items.json");
-  const items = await imageData.json();
-  
   const container = document.getElementById("items");
-  items.forEach((item) => {
-    const div = document.createElement("div");
-    div.className = "item";
-    div.innerHTML = `
-      <img src="/static/images/${item.name}/preview.png" alt="Item ${item.name}">
-      <p>${item.name}</p>`;
-    div.onclick = () => selectItem(item.id, item.name, div);
-    container.appendChild(div);
-  });
+  let offset = 0;
+  while (true) {
+    const res = await fetch(`/catalog?offset=${offset}&limit=${CATALOG_PAGE}`);
+    const page = await res.json();
+    // the first scan of a new server has nothing stored yet
+    if (!page.ready && page.total === 0) {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      continue;
+    }
+    page.items.forEach((item) => container.appendChild(itemElement(item)));
+    offset += page.items.length;
+    if (page.items.length === 0 || offset >= page.total) {
+      break;
+    }
+  }
 }
 
-async function selectItem(id, name, element) {
-  selectedId = id;
+function drawPreview(canvas, pts) {
+  const ctx = canvas.getContext("2d");
+  ctx.strokeStyle = "#6b4f1d";
+  ctx.beginPath();
+  ctx.moveTo(...liveToCanvas(canvas, pts[0]));
+  pts.forEach((pt) => ctx.lineTo(...liveToCanvas(canvas, pt)));
+  ctx.stroke();
+}
+
+function selectItem(item, element) {
+  selectedId = item.id;
   document.querySelectorAll(".item").forEach((el) => el.classList.remove("selected"));
   element.classList.add("selected");
-  
-  const file = await fetch(`/static/images/${name}/meta.json`);
-  const meta = await file.json();
 
-  selectedMeta = meta;
-  showParameters(meta.parameters);
+  // the catalog has the engine and parameters of every pattern
+  selectedMeta = item;
+  showParameters(item.parameters);
 }
 
 function showParameters(params) {
@@ -39,7 +81,7 @@ function showParameters(params) {
 
         html = `
           <label>${p.name}</label>
-          <input type="number" id="${p.name}" value="">
+          <input type="number" id="${p.name}" value="${p.value ?? ""}">
         `;
 
         container.innerHTML += `<div class="param">${html}</div>`;
@@ -64,25 +106,53 @@ async function sendData() {
     payload[p.name] = document.getElementById(p.name).value;
   });
   
-  await fetch("/submit", {
+  // the pattern is compiled once for all tables it is sent to
+  const ids = document.getElementById("all-tables").checked
+    ? tableIds : [selectedTable];
+  const query = ids.map((id) => `table=${encodeURIComponent(id)}`).join("&");
+  const res = await fetch(`/submit?${query}`, {
     method: "POST",
     headers: {"Content-Type": "application/json"},
     body: JSON.stringify(payload)
   });
+  const ret = await res.json();
 
-  alert("Data sent!");
+  if (ret.estimated_time != null) {
+    alert(`Data sent! Estimated drawing time ~${formatTime(ret.estimated_time)}`);
+  } else {
+    alert("Data sent!");
+  }
 }
 
 
 loadItems();
 
 
+function tableQuery() {
+  return `table=${encodeURIComponent(selectedTable)}`;
+}
+
+async function loadTables() {
+  const res = await fetch("/tables");
+  const tables = await res.json();
+  const select = document.getElementById("table");
+  tableIds = tables.map((table) => table.id);
+  tables.forEach((table) => {
+    const option = document.createElement("option");
+    option.value = table.id;
+    option.textContent = `${table.id} (${table.COM})`;
+    select.appendChild(option);
+  });
+  selectTable(tableIds[0]);
+}
+
+
 async function buttonPress(task) {
   const payload = {
     task: task  
   };
 
-  await fetch("/button", {
+  await fetch(`/button?${tableQuery()}`, {
     method: "POST",
     headers: {"Content-Type": "application/json"},
     body: JSON.stringify(payload)
@@ -110,4 +180,66 @@ async function stop() {
 
 async function clearQueue() {
     buttonPress("clear");
-}
\ No newline at end of file
+}
+
+
+// live trace of the table, only the new points of every event are drawn
+let livePathId = null;
+let liveLast = null;
+
+function liveToCanvas(canvas, pt) {
+  const scale = canvas.width / (2 * RADIUS_MM);
+  return [canvas.width / 2 + pt[0] * scale, canvas.height / 2 + pt[1] * scale];
+}
+
+function onLiveEvent(event) {
+  const data = JSON.parse(event.data);
+  const status = data.status;
+  const canvas = document.getElementById("live");
+  const ctx = canvas.getContext("2d");
+
+  if (status.id !== livePathId) {
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    livePathId = status.id;
+    liveLast = null;
+  }
+
+  if (data.trace.length > 0) {
+    ctx.strokeStyle = status.pattern ? "#6b4f1d" : "#b8a27a";
+    ctx.lineWidth = 1;
+    ctx.beginPath();
+    const start = liveLast ?? data.trace[0];
+    ctx.moveTo(...liveToCanvas(canvas, start));
+    data.trace.forEach((pt) => ctx.lineTo(...liveToCanvas(canvas, pt)));
+    ctx.stroke();
+    liveLast = data.trace[data.trace.length - 1];
+  }
+
+  const text = document.getElementById("progress");
+  if (status.id === null) {
+    text.textContent = "Idle";
+  } else {
+    const name = status.pattern ? status.name : "Erasing";
+    // unknown while a streamed pattern is compiled
+    const done = status.progress === null ? `${status.index} points`
+      : `${Math.round(status.progress * 100)}%`;
+    const left = status.eta === null ? ""
+      : ` ~${formatTime(status.eta)} left`;
+    text.textContent = `${name} ${done}${left}`;
+  }
+}
+
+let liveSource = null;
+
+function selectTable(tableId) {
+  selectedTable = tableId;
+  // the first event of the new table has its whole trace
+  if (liveSource !== null) {
+    liveSource.close();
+  }
+  livePathId = undefined;
+  liveSource = new EventSource(`/events?${tableQuery()}`);
+  liveSource.onmessage = onLiveEvent;
+}
+
+loadTables();
@@ -1,18 +1,416 @@
 import os
 import json
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable
 
+import numpy as np
 
-def load_json() -> dict:
-    names = os.listdir("static/images")
+import stlib as st
+from constants import COMPILE_EPS, COMPILE_TOL, PARAMETRIC_ENGINES
 
-    data = []
-    id_map = {}
 
-    for i, name in enumerate(names):
-        id_map[i+1] = name
-        data.append({"id": i+1, "name": name})
+logger = logging.getLogger(__name__)
 
-    with open("static/items.json", "w") as file:
-        json.dump(data, file, indent=2)
 
-    return id_map
+def _path_stats(pm: st.PathMaker) -> dict:
+    """
+    :return: point counts before and after compiling, bounding radius and
+        draw time of one iteration at the speed after homing
+    """
+    return {"points": int(pm.pts.shape[0]),
+            "positions": int(pm.positions.shape[0]),
+            "radius": round(float(np.max(pm.pts_polar[:, 0])), 1),
+            "draw_time": round(pm.estimate_time(), 1)}
+
+
+def parametric_parameters(engine: str) -> list[dict]:
+    """
+    :param engine: name of the engine in PARAMETRIC_ENGINES
+
+    :return: parameters of the page and their default values from the
+        submission model
+    """
+    # the page only has number inputs, so flags are 0 or 1
+    return [{"name": name, "type": "number",
+             "value": int(field.default)
+             if isinstance(field.default, bool) else field.default}
+            for name, field in
+            PARAMETRIC_ENGINES[engine].model_fields.items()
+            if name not in ("engine", "item_id")]
+
+
+def parametric_item(engine: str, preview_points: int = 1024) -> dict:
+    """
+    Catalog entry of a parametric engine without an id. The preview is
+    drawn by the page from the points of the default pattern.
+
+    :param engine: name of the engine in PARAMETRIC_ENGINES
+    :param preview_points: max number of preview points
+
+    :return: catalog entry
+    """
+    pm = st.ENGINES[engine](eps=COMPILE_TOL)
+
+    # the dense curve, the lines between the samples would be straight
+    r, phi = pm.pts[:, 0], pm.pts[:, 1]
+    idx = np.unique(np.linspace(0, r.shape[0] - 1,
+                                preview_points).astype(np.intp))
+    preview = np.column_stack((r[idx]*np.cos(phi[idx]),
+                               r[idx]*np.sin(phi[idx])))
+
+    return {"name": engine, "engine": engine,
+            "parameters": parametric_parameters(engine),
+            "preview": np.round(preview, 1).tolist(),
+            **_path_stats(pm)}
+
+
+
+class Catalog:
+    """
+    Index of the patterns in static/images and of the parametric engines.
+    Per pattern it has a stable id, the number of points before and after
+    compiling, the bounding radius, the draw time and whether the compiled
+    pattern is in the PathCache.
+
+    The index is stored in catalog.json of the cache directory and updated
+    incrementally. A pattern is only read again if the mtime or size of
+    its files changed and only compiled again if its cache key, the hash
+    of the svg and the compile parameters, changed. The changed patterns
+    are scanned in parallel in a thread pool.
+
+    A pattern keeps its id as long as it exists and the ids of removed
+    patterns are never used again, so the page and the submitted jobs
+    never refer to the wrong pattern.
+
+    Available methods:
+    - update() -> scan the new and changed patterns
+    - get() -> entry by id
+    - page() -> part of the catalog for the page
+
+    :param path_cache: cache the svg patterns are compiled with, the index
+        is stored in its directory
+    :param images: directory with a directory per pattern
+    :param max_workers: number of threads that scan the patterns
+    """
+
+    # fields of the index that are not sent to the page
+    PRIVATE = ("source", "signature", "key")
+
+    def __init__(self, path_cache: st.PathCache,
+                 images: str = "static/images", max_workers: int = 4):
+        self.path_cache = path_cache
+        self.images = images
+        self.max_workers = max_workers
+        self.path = os.path.join(path_cache.directory, "catalog.json")
+        # True once the patterns were scanned, until then the stored index
+        # is served
+        self.ready = False
+        self._lock = threading.Lock()
+
+        index = self._load()
+        self._next_id = index["next_id"]
+        self._set_items(index["items"])
+
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning("Rebuilding the catalog: %s", e)
+            return {"next_id": 1, "items": []}
+
+
+    def _set_items(self, items: list[dict]) -> None:
+        # both are replaced at once, the page reads them from the event loop
+        self._items = sorted(items, key=lambda item: item["id"])
+        self._by_id = {item["id"]: item for item in self._items}
+
+
+    def _svg_signature(self, name: str) -> list | None:
+        """
+        :return: mtime and size of the files of a pattern or None if it has
+            no meta.json
+        """
+        signature = []
+        for fname in ("meta.json", "source.svg"):
+            try:
+                stat = os.stat(os.path.join(self.images, name, fname))
+            except (FileNotFoundError, NotADirectoryError):
+                if fname == "meta.json":
+                    return None
+                stat = None
+
+            signature.append(None if stat is None
+                             else [stat.st_mtime_ns, stat.st_size])
+
+        return signature
+
+
+    def _scan_svg(self, name: str, signature: list,
+                  old: dict | None) -> dict:
+        """
+        :return: entry of a pattern in static/images without an id
+        """
+        path = os.path.join(self.images, name)
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+
+        item = {"name": name, "engine": meta["engine"],
+                "parameters": meta["parameters"], "key": None,
+                "points": None, "positions": None, "radius": None,
+                "draw_time": None}
+        # other engines only use the preview of the svg
+        if meta["engine"] != "PathMaker" or signature[1] is None:
+            return item
+
+        fname = os.path.join(path, "source.svg")
+        with open(fname, "rb") as file:
+            item["key"] = self.path_cache.get_key(file.read(), COMPILE_EPS,
+                                                  COMPILE_TOL)
+
+        # only the mtime changed
+        if old is not None and old["key"] == item["key"] \
+                and old["points"] is not None:
+            return item | {field: old[field] for field in
+                           ("points", "positions", "radius", "draw_time")}
+
+        try:
+            pm = self.path_cache.get_path_maker(fname, eps=COMPILE_EPS,
+                                                tol=COMPILE_TOL)
+        except ValueError as e:
+            logger.warning("No stats for %s: %s", name, e)
+            return item
+
+        return item | _path_stats(pm)
+
+
+    def _scan_engine(self, engine: str, old: dict | None) -> dict:
+        """
+        :return: entry of a parametric engine without an id
+        """
+        return parametric_item(engine) | {"key": None}
+
+
+    def _sources(self) -> dict[str, tuple[Callable[[], dict], Any]]:
+        """
+        :return: dict of source -> function that scans it and its signature
+        """
+        sources = {}
+        for name in sorted(os.listdir(self.images)):
+            signature = self._svg_signature(name)
+            if signature is not None:
+                sources[f"svg:{name}"] = partial(self._scan_svg, name,
+                                                 signature), signature
+
+        for engine in PARAMETRIC_ENGINES:
+            # compiled again when the defaults or the tolerance change
+            signature = [parametric_parameters(engine), COMPILE_TOL]
+            sources[f"engine:{engine}"] = partial(self._scan_engine,
+                                                  engine), signature
+
+        return sources
+
+
+    def update(self) -> int:
+        """
+        Scan the new and changed patterns and store the index. Blocks until
+        they are compiled, so it should run in a thread.
+
+        :return: number of scanned patterns
+        """
+        with self._lock:
+            old = {item["source"]: item for item in self._items}
+            sources = self._sources()
+            changed = [source for source, (_, signature) in sources.items()
+                       if source not in old
+                       or old[source]["signature"] != signature]
+
+            def scan(source):
+                fn, signature = sources[source]
+                try:
+                    item = fn(old.get(source))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning("Skipping %s: %s", source, e)
+                    return None
+                return item | {"source": source, "signature": signature}
+
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                scanned = dict(zip(changed, pool.map(scan, changed)))
+
+            items = []
+            for source in sources:
+                item = scanned.get(source, old.get(source))
+                if item is None:
+                    continue
+                if source in old:
+                    item["id"] = old[source]["id"]
+                else:
+                    item["id"] = self._next_id
+                    self._next_id += 1
+                items.append(item)
+
+            if changed or len(items) != len(old):
+                self._store(items)
+            self._set_items(items)
+            self.ready = True
+
+            logger.info("Catalog has %d patterns, scanned %d", len(items),
+                        len(changed))
+
+            return len(changed)
+
+
+    def _store(self, items: list[dict]) -> None:
+        # replaced at once, so a crash never leaves a partial index
+        with open(self.path + ".tmp", "w") as file:
+            json.dump({"next_id": self._next_id, "items": items}, file)
+        os.replace(self.path + ".tmp", self.path)
+
+
+    def _public(self, item: dict) -> dict:
+        ret = {name: value for name, value in item.items()
+               if name not in self.PRIVATE}
+        # the cache can be evicted since the scan, parametric patterns are
+        # not cached
+        ret["cached"] = None if item["key"] is None \
+            else self.path_cache.has(item["key"])
+
+        return ret
+
+
+    def get(self, item_id: int) -> dict | None:
+        """
+        :param item_id: id of the pattern
+
+        :return: entry of the pattern or None
+        """
+        item = self._by_id.get(item_id)
+
+        return None if item is None else self._public(item)
+
+
+    def page(self, offset: int = 0, limit: int = 100) -> dict:
+        """
+        :param offset: index of the first entry, ordered by id
+        :param limit: max number of entries
+
+        :return: dict with the entries, the total number of entries and
+            whether the patterns were scanned since the start
+        """
+        items = self._items
+
+        return {"ready": self.ready, "total": len(items), "offset": offset,
+                "items": [self._public(item)
+                          for item in items[offset:offset+limit]]}
+
+
+
+class ProgressStream:
+    """
+    Server sent events with the progress of the worker. The status and the
+    new part of the trace are calculated and serialized once per interval
+    for all clients. Clients that didn't read the last events get the
+    trace parts joined in a single event.
+
+    :param worker: worker whose progress is streamed
+    :param interval: time between the updates in s
+    :param max_points: max number of trace points per update
+    :param snapshot_points: max number of trace points for new clients
+    """
+    def __init__(self, worker: st.AsyncWorker, interval: float = 0.25,
+                 max_points: int = 64, snapshot_points: int = 2000):
+        self.worker = worker
+        self.interval = interval
+        self.max_points = max_points
+        self.snapshot_points = snapshot_points
+        self._clients: set[_Client] = set()
+        self._last = 0
+        self._status = None
+        self._task = None
+
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+    @staticmethod
+    def _trace_json(pts: np.ndarray) -> str:
+        # points without the outer brackets, so parts can be joined
+        return json.dumps(np.round(pts, 2).tolist())[1:-1]
+
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            acked = self.worker.com.acked
+            if not self._clients:
+                self._last = acked
+                continue
+
+            status = json.dumps(self.worker.progress.status())
+            trace = self._trace_json(self.worker.progress.trace(
+                self._last, acked, self.max_points))
+            self._last = acked
+
+            if status == self._status and not trace:
+                continue
+            self._status = status
+
+            for client in self._clients:
+                client.status = status
+                if trace:
+                    client.trace.append(trace)
+                client.event.set()
+
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """
+        Events of one client. The first event has the trace of the current
+        path up to now.
+
+        :return: generator of server sent event strings
+        """
+        progress = self.worker.progress
+        snapshot = progress.trace(None, self._last, self.snapshot_points)
+        client = _Client(json.dumps(progress.status()))
+        if len(snapshot):
+            client.trace.append(self._trace_json(snapshot))
+        self._clients.add(client)
+
+        try:
+            while True:
+                await client.event.wait()
+                client.event.clear()
+                trace = ",".join(client.trace)
+                client.trace.clear()
+
+                yield f'data: {{"status": {client.status}, ' \
+                      f'"trace": [{trace}]}}\n\n'
+        finally:
+            self._clients.discard(client)
+
+
+
+class _Client:
+    """
+    Pending updates of one connected client.
+    """
+    def __init__(self, status: str):
+        self.event = asyncio.Event()
+        self.event.set()
+        self.status = status
+        self.trace: list[str] = []